@@ -0,0 +1,369 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module provides the daemon's *accomDB*, and the compact records it
+keeps accomplishments in.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+# Fields an accomplishment may have. Each of these is stored in a slot of
+# it's own, any other fields go to a dict that is only created if needed.
+FIELDS = (
+    'type', 'title', 'description', 'summary', 'steps', 'help', 'links',
+    'pitfalls', 'tips', 'icon', 'author', 'depends', 'needs-signing',
+    'needs-information', 'keywords', 'categories', 'set', 'collection',
+    'lang', 'base-path', 'script-path', 'file-path', 'accomplished',
+    'locked', 'date-accomplished',
+)
+
+# Fields whose values are the same for many accomplishments (usually for
+# a whole collection). These strings are interned, so that every
+# accomplishment refers to the same copy of them.
+INTERNED_FIELDS = frozenset((
+    'type', 'icon', 'author', 'needs-signing', 'needs-information', 'set',
+    'collection', 'lang', 'base-path',
+))
+
+# field name -> slot name (slot names have to be valid identifiers)
+_ATTRS = dict((field, field.replace('-', '_')) for field in FIELDS)
+
+
+def _intern(field, value):
+    if type(value) is str and field in INTERNED_FIELDS:
+        return intern(value)
+    return value
+
+
+def split_list(value):
+    """
+    Splits a comma separated list (e.g. the "depends" field) into a tuple
+    of stripped items.
+    """
+    return tuple(_intern_item(item.strip()) for item in value.split(","))
+
+
+def _intern_item(item):
+    if type(item) is str:
+        return intern(item)
+    return item
+
+
+def parse_needs_signing(value):
+    return value not in ("false", "False", "no")
+
+
+# Fields that are parsed once they are set, so that their values do not
+# need to be parsed on every access:
+#   field -> (slot name, value if the field is missing, parser)
+PARSED_FIELDS = {
+    'depends': ('parsed_depends', (), split_list),
+    'keywords': ('parsed_keywords', ("",), split_list),
+    'needs-information': ('parsed_needs_info', (), split_list),
+    'needs-signing': ('parsed_needs_signing', False, parse_needs_signing),
+}
+
+
+class AccomRecord(object):
+    """
+    The data of a single accomplishment.
+
+    This behaves like a dict, so all code that reads or updates the
+    *accomDB* can use it as such, but it takes a fraction of the memory a
+    dict with the same contents would. Use dict(record) wherever a real
+    dict is needed, e.g. to send it over D-Bus.
+
+    The values of PARSED_FIELDS are also available already parsed, as
+    the *parsed_depends*, *parsed_keywords*, *parsed_needs_info* (tuples
+    of strings) and *parsed_needs_signing* (bool) attributes.
+    """
+    __slots__ = tuple(_ATTRS[field] for field in FIELDS) + \
+        tuple(slot for slot, default, parse in PARSED_FIELDS.values()) + \
+        ('_extra',)
+
+    def __init__(self, data=None):
+        self._extra = None
+        for slot, default, parse in PARSED_FIELDS.itervalues():
+            setattr(self, slot, default)
+        if data:
+            self.update(data)
+
+    def __getitem__(self, key):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            try:
+                return getattr(self, attr)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            setattr(self, attr, _intern(key, value))
+            if key in PARSED_FIELDS:
+                slot, default, parse = PARSED_FIELDS[key]
+                setattr(self, slot, parse(value))
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                raise KeyError(key)
+            if key in PARSED_FIELDS:
+                slot, default, parse = PARSED_FIELDS[key]
+                setattr(self, slot, default)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+            if not self._extra:
+                self._extra = None
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        attr = _ATTRS.get(key)
+        if attr is not None:
+            return hasattr(self, attr)
+        return self._extra is not None and key in self._extra
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def keys(self):
+        keys = [field for field in FIELDS if hasattr(self, _ATTRS[field])]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def update(self, other):
+        if hasattr(other, 'keys'):
+            for key in other.keys():
+                self[key] = other[key]
+        else:
+            for key, value in other:
+                self[key] = value
+
+    def copy(self):
+        return AccomRecord(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (AccomRecord, dict)):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "AccomRecord(%r)" % dict(self.items())
+
+    def __getstate__(self):
+        # A bitmask of fields that are set, followed by their values.
+        present = 0
+        values = []
+        for i, field in enumerate(FIELDS):
+            try:
+                values.append(getattr(self, _ATTRS[field]))
+            except AttributeError:
+                continue
+            present |= 1 << i
+        return (present, tuple(values), self._extra)
+
+    def __setstate__(self, state):
+        # Parsed values are not stored, they are parsed again.
+        present, values, self._extra = state
+        for slot, default, parse in PARSED_FIELDS.itervalues():
+            setattr(self, slot, default)
+        values = iter(values)
+        for i, field in enumerate(FIELDS):
+            if present & (1 << i):
+                self[field] = values.next()
+
+
+class AccomDB(dict):
+    """
+    The accomplishments database: a dict of collections (keyed by their
+    name), sets (*collection:set*) and accomplishments
+    (*collection/accomplishment*).
+
+    On top of the dict itself, this keeps an index of entries of each type
+    and of entries belonging to each collection, so that listing them does
+    not require going through the whole database. It also keeps a reverse
+    index of dependencies, mapping each accomplishment ID to the
+    accomplishments that depend on it.
+    """
+    def __init__(self, data=None):
+        dict.__init__(self)
+        # type -> set of keys
+        self._types = {}
+        # type -> sorted tuple of keys, None if it needs to be sorted again
+        self._sorted = {}
+        # collection -> set of keys of all it's entries
+        self._collections = {}
+        # accomID -> set of accomIDs of accomplishments depending on it
+        self._dependents = {}
+        if data:
+            self.update(data)
+
+    @staticmethod
+    def _collection_of(key, entrytype):
+        if entrytype == "accomplishment":
+            return key.split("/", 1)[0]
+        elif entrytype == "set":
+            return key.split(":", 1)[0]
+        return key
+
+    def _index(self, key, data):
+        entrytype = data['type']
+        self._types.setdefault(entrytype, set()).add(key)
+        self._sorted[entrytype] = None
+        collection = self._collection_of(key, entrytype)
+        self._collections.setdefault(collection, set()).add(key)
+        for dep in getattr(data, 'parsed_depends', ()):
+            self._dependents.setdefault(dep, set()).add(key)
+
+    def _unindex(self, key):
+        data = dict.__getitem__(self, key)
+        entrytype = data['type']
+        self._types[entrytype].discard(key)
+        self._sorted[entrytype] = None
+        collection = self._collection_of(key, entrytype)
+        keys = self._collections[collection]
+        keys.discard(key)
+        if not keys:
+            del self._collections[collection]
+        for dep in getattr(data, 'parsed_depends', ()):
+            dependents = self._dependents[dep]
+            dependents.discard(key)
+            if not dependents:
+                del self._dependents[dep]
+
+    def __setitem__(self, key, data):
+        if key in self:
+            self._unindex(key)
+        dict.__setitem__(self, key, data)
+        self._index(key, data)
+
+    def __delitem__(self, key):
+        if key in self:
+            self._unindex(key)
+        dict.__delitem__(self, key)
+
+    def update(self, other=None, **kwargs):
+        if other is not None:
+            if hasattr(other, 'keys'):
+                for key in other.keys():
+                    self[key] = other[key]
+            else:
+                for key, data in other:
+                    self[key] = data
+        for key, data in kwargs.iteritems():
+            self[key] = data
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        data = self[key]
+        del self[key]
+        return data
+
+    def popitem(self):
+        for key in self:
+            return key, self.pop(key)
+        raise KeyError("popitem(): dictionary is empty")
+
+    def clear(self):
+        dict.clear(self)
+        self._types.clear()
+        self._sorted.clear()
+        self._collections.clear()
+        self._dependents.clear()
+
+    def copy(self):
+        return AccomDB(self)
+
+    def __reduce__(self):
+        # The indexes are not stored, they are rebuilt when unpickling.
+        return (AccomDB, (dict(self),))
+
+    def keys_of_type(self, entrytype):
+        """
+        Returns a sorted tuple of keys of all entries of given type
+        ("collection", "set" or "accomplishment").
+        """
+        keys = self._sorted.get(entrytype)
+        if keys is None:
+            keys = tuple(sorted(self._types.get(entrytype, ())))
+            self._sorted[entrytype] = keys
+        return keys
+
+    def keys_of_collection(self, collection):
+        """
+        Returns a list of keys of all entries belonging to **collection**:
+        the collection itself, it's sets and it's accomplishments.
+        """
+        return list(self._collections.get(collection, ()))
+
+    def dependents_of(self, accomID):
+        """
+        Returns a sorted list of IDs of accomplishments that directly
+        depend on **accomID**. This works whether **accomID** is
+        installed or not.
+        """
+        return sorted(self._dependents.get(accomID, ()))
@@ -14,9 +14,9 @@ import gettext
 from gettext import gettext as _
 from gettext import ngettext as N_
 import ConfigParser
+import cPickle
 import Image
 import ImageEnhance
-from StringIO import StringIO
 import datetime
 import getpass
 import glob
@@ -25,9 +25,10 @@ import gpgme
 import os
 import time
 import locale
+import multiprocessing
 from collections import deque
 
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, task
 from twisted.python import log
 
 import xdg.BaseDirectory
@@ -44,8 +45,21 @@ from ubuntuone.couch import auth
 
 import accomplishments
 from accomplishments import exceptions
+from accomplishments.daemon import accomdb
+from accomplishments.daemon import backoff
 from accomplishments.daemon import dbusapi
+from accomplishments.daemon import depgraph
+from accomplishments.daemon import history
+from accomplishments.daemon import journal
+from accomplishments.daemon import loader
+from accomplishments.daemon import scheduler
+from accomplishments.daemon import search
+from accomplishments.daemon import status
+from accomplishments.daemon import trophies
+from accomplishments.daemon import verification
+from accomplishments.daemon import workers
 from accomplishments.util import SubprocessReturnCodeProtocol
+from accomplishments.util import ScriptProtocol, SETSID_COMMAND, TIMED_OUT
 from accomplishments.util.paths import daemon_exec_dir, media_dir, module_dir1, module_dir2, installed, locale_dir
 
 gettext.bindtextdomain('accomplishments-daemon', locale_dir)
@@ -61,14 +75,30 @@ if installed:
 
 LOCAL_USERNAME = getpass.getuser()
 SCRIPT_DELAY = 900
+# How many seconds a script may run for by default, before it is stopped
+SCRIPT_TIMEOUT = 300
 ONLINETROPHIESHOST = "91.189.93.66"
 STAGING_ID = "openiduser204307"  # staging ID
 PRODUCTION_ID = "openiduser155707"  # production ID
 
+# bump this whenever the layout of accomDB changes, so that outdated
+# snapshots stored in the cache directory get ignored
+ACCOMDB_SNAPSHOT_VERSION = 3
+
+# The stages of the daemon's startup, in order (see get_startup_progress).
+# When the daemon is created, it's database is loaded already, but the
+# signatures of some trophies may still be waiting to be verified.
+STARTUP_STAGES = ("signatures", "icons", "share", "ready")
+
 # flags used for scripts_state
 NOT_RUNNING = 0
 RUNNING = 1
 
+# what AsyncAPI._run_script returns if the script has not been run
+NOT_RUN = "not-run"
+# ... and if it has been started, but it's result is not known
+SCRIPT_LOST = "lost"
+
 # XXX the source code needs to be updated to use Twisted async calls better:
 # grep the source code for any *.asyncapi.* references, and if they return
 # deferreds, adjust them to use callbacks
@@ -95,11 +125,17 @@ class AsyncAPI(object):
         self.scripts_state = NOT_RUNNING
 
     @staticmethod
-    def _run_a_subprocess(command):
+    def _run_a_subprocess(command, timeout=None):
         # Commented out this debug message, as it creates lots of junk,
         # and is not needed for common troubleshooting
         # log.msg("Running subprocess command: " + str(command))
-        pprotocol = SubprocessReturnCodeProtocol()
+        if timeout:
+            # The command gets a process group of it's own, so that if it
+            # times out, everything it has started can be stopped with it.
+            pprotocol = ScriptProtocol(command, timeout)
+            command = SETSID_COMMAND + command
+        else:
+            pprotocol = SubprocessReturnCodeProtocol()
         reactor.spawnProcess(pprotocol, command[0], command, env=os.environ)
         return pprotocol.returnCodeDeferred
 
@@ -188,6 +224,15 @@ class AsyncAPI(object):
 
         self.parent._refresh_share_data()
 
+    def _get_script_concurrency(self):
+        concurrency = self.parent.script_concurrency
+        if concurrency is None:
+            try:
+                concurrency = multiprocessing.cpu_count()
+            except NotImplementedError:
+                concurrency = 1
+        return max(concurrency, 1)
+
     # XXX let's rewrite this to use deferreds explicitly
     @defer.inlineCallbacks
     def start_scriptrunner(self):
@@ -206,51 +251,31 @@ class AsyncAPI(object):
         # to keep the code cleaner and the logic more limited to one particular
         # task
 
-        queuesize = len(self.parent.scripts_queue)
+        queue = self.parent.scripts_queue
+        concurrency = self._get_script_concurrency()
 
-        log.msg("--- Starting Running Scripts - %d items on the queue ---" %
-                (queuesize))
+        log.msg("--- Starting Running Scripts - %d items on the queue, "
+                "running up to %d at once ---" % (len(queue), concurrency))
         timestart = time.time()
         if not self.parent.test_mode:
             self.parent.service.scriptrunner_start()
 
-        while queuesize > 0:
-            accomID = self.parent.scripts_queue.popleft()
-            log.msg("Running %s, left on queue: %d" % (accomID, queuesize - 1))
-
-            # First ensure that the acccomplishemt has not yet
-            # accomplished.
-            # It happens that the .asc file is present, but we miss the
-            # signal it triggers - so here we can re-check if it is not
-            # present.
-            if self.parent._check_if_accom_is_accomplished(accomID):
-                self.parent.accomplish(accomID)
-            else:
-                # Okay, this one hasn't been yet accomplished.
-                # Run the accom script and determine exit code.
-                scriptpath = self.parent.get_accom_script_path(accomID)
-                if scriptpath is None:
-                    log.msg("...No script for this accomplishment, skipping")
-                elif not self.parent._is_all_extra_information_available(accomID):
-                    log.msg("...Extra information required, but not available, skipping")
-                else:
-                    # There is a script for this accomplishmend, so run it
-                    exitcode = yield self._run_a_subprocess([scriptpath])
-                    if exitcode == 0:
-                        log.msg("...Accomplished")
-                        self.parent.accomplish(accomID)
-                    elif exitcode == 1:
-                        log.msg("...Not Accomplished")
-                    elif exitcode == 2:
-                        log.msg("....Error")
-                    elif exitcode == 4:
-                        log.msg("...Could not get extra-information")
-                    else:
-                        log.msg("...Error code %d" % exitcode)
-
-            # New queue size is determined on the very end, since accomplish()
-            # might have added something new to the queue.
-            queuesize = len(self.parent.scripts_queue)
+        # Up to **concurrency** scripts are run at once, but their results
+        # are processed in the order they were started in. Accomplishments
+        # unlocked by a result are added to the queue by accomplish(), so
+        # they get picked up by this same loop, before the rest of a
+        # sweep.
+        running = deque()
+        while queue or running:
+            while queue and len(running) < concurrency:
+                accomID = queue.pop()
+                log.msg("Running %s, left on queue: %d" % (
+                    accomID, len(queue)))
+                running.append((accomID, self._run_script(accomID)))
+
+            accomID, d = running.popleft()
+            result = yield d
+            self._process_script_result(accomID, result)
 
         log.msg("The queue is now empty - stopping the scriptrunner.")
 
@@ -262,11 +287,89 @@ class AsyncAPI(object):
 
         log.msg(
             "--- Emptied the scripts queue in %.2f seconds---" % timefinal)
+        self.parent.script_backoff.save()
         if not self.parent.test_mode:
             self.parent.service.scriptrunner_finish()
 
         self.scripts_state = NOT_RUNNING
 
+    @defer.inlineCallbacks
+    def _run_script(self, accomID):
+        # Returns a Deferred firing with True if the accomplishment turns
+        # out to be accomplished already, with the exit code of it's
+        # script (None if it was killed by a signal), or with NOT_RUN if
+        # the script was not run.
+        try:
+            # First ensure that the acccomplishemt has not yet
+            # accomplished.
+            # It happens that the .asc file is present, but we miss the
+            # signal it triggers - so here we can re-check if it is not
+            # present.
+            accomplished = yield \
+                self.parent._verify_if_accom_is_accomplished(accomID)
+            if accomplished:
+                defer.returnValue(True)
+
+            # Okay, this one hasn't been yet accomplished.
+            # Run the accom script and determine exit code.
+            scriptpath = self.parent.get_accom_script_path(accomID)
+            if scriptpath is None:
+                log.msg("%s: No script for this accomplishment, skipping" %
+                        accomID)
+            elif not self.parent._is_all_extra_information_available(accomID):
+                log.msg("%s: Extra information required, but not available, "
+                        "skipping" % accomID)
+            else:
+                # There is a script for this accomplishmend, so run it
+                timeout = self.parent.get_accom_script_timeout(accomID)
+                if self.parent._can_use_worker_pool(accomID, scriptpath):
+                    try:
+                        exitcode = yield self.parent.worker_pool.run(
+                            scriptpath, timeout)
+                        defer.returnValue(exitcode)
+                    except exceptions.ScriptLost, e:
+                        # it may have done part of it's work already
+                        log.msg("%s: %s Not running it again." % (
+                            accomID, e))
+                        defer.returnValue(SCRIPT_LOST)
+                    except exceptions.WorkerPoolError, e:
+                        log.msg("%s: %s Running it on it's own." % (
+                            accomID, e))
+                exitcode = yield self._run_a_subprocess(
+                    [scriptpath], timeout)
+                defer.returnValue(exitcode)
+        except Exception, e:
+            log.msg("%s: Could not run script: %s" % (accomID, e))
+        defer.returnValue(NOT_RUN)
+
+    def _process_script_result(self, accomID, result):
+        outcome = backoff.ERROR
+        if result is True:
+            outcome = backoff.ACCOMPLISHED
+            self.parent.accomplish(accomID)
+        elif result == NOT_RUN:
+            return
+        elif result is None:
+            log.msg("%s: Killed by a signal" % accomID)
+        elif result == 0:
+            log.msg("%s: Accomplished" % accomID)
+            outcome = backoff.ACCOMPLISHED
+            self.parent.accomplish(accomID)
+        elif result == 1:
+            log.msg("%s: Not Accomplished" % accomID)
+            outcome = backoff.NOT_ACCOMPLISHED
+        elif result == 2:
+            log.msg("%s: Error" % accomID)
+        elif result == 4:
+            log.msg("%s: Could not get extra-information" % accomID)
+        elif result == TIMED_OUT:
+            log.msg("%s: Timed out" % accomID)
+        elif result == SCRIPT_LOST:
+            log.msg("%s: Result unknown" % accomID)
+        else:
+            log.msg("%s: Error code %d" % (accomID, result))
+        self.parent.script_backoff.record(accomID, outcome)
+
 
 class Accomplishments(object):
     """The main accomplishments daemon.
@@ -292,8 +395,41 @@ class Accomplishments(object):
         self.service = service
         self.asyncapi = AsyncAPI(self)
 
-        self.scripts_queue = deque()
+        self.scripts_queue = scheduler.ScriptScheduler()
         self.test_mode = test_mode
+        self.startup_stage = STARTUP_STAGES[0]
+        # run_scripts() calls made before the startup has completed
+        self.postponed_script_runs = []
+        # fires once the statuses set by the last reload of the database
+        # are complete, i.e. all signatures have been verified
+        self.statuses_complete = defer.succeed(None)
+
+        # The accomplishments database, and the signature of collections
+        # it has been built from (see reload_accom_database)
+        self.accomDB = accomdb.AccomDB()
+        self.accomdb_signature = None
+        # The dependencies between accomplishments in the accomDB
+        self.depgraph = depgraph.DependencyGraph(self.accomDB)
+        # The status flags of all accomplishments (see status.py)
+        self.statuses = status.StatusVectors(())
+        self.search_index = search.SearchIndex()
+        # Earned trophies by date (see history.TrophyHistory)
+        self.trophy_history = history.TrophyHistory()
+        # The number of processes used to parse collections, None means
+        # as many as there are CPUs
+        self.loader_processes = None
+        # Whether long accomplishment texts are kept out of the accomDB
+        # and only read when asked for (see get_accom_data)
+        self.lazy_text_fields = False
+        self.text_field_cache = loader.TextFieldCache()
+        # The number of scripts the scriptrunner runs at once, None means
+        # as many as there are CPUs
+        self.script_concurrency = None
+        # How many seconds a script may run for, 0 for no limit
+        self.script_timeout = SCRIPT_TIMEOUT
+        # Runs Python scripts in processes forked from a warm one (see
+        # workers.WorkerPool), None if scripts are always run on their own
+        self.worker_pool = None
 
         try:
             rootdir = os.environ['ACCOMPLISHMENTS_ROOT_DIR']
@@ -320,6 +456,28 @@ class Accomplishments(object):
         if not os.path.exists(self.dir_cache):
             os.makedirs(self.dir_cache)
 
+        # Parsed .trophy files (see trophies.TrophyCache)
+        self.trophy_cache = trophies.TrophyCache(
+            os.path.join(self.dir_cache, "trophies.cache"))
+        self.trophy_cache.load()
+        # Trophies with verified signatures (see trophies.SignatureCache)
+        self.signature_cache = trophies.SignatureCache(
+            os.path.join(self.dir_cache, "signatures.cache"))
+        self.signature_cache.load()
+        self.verifier = verification.SignatureVerifier(
+            self.signature_cache, synchronous=self.test_mode)
+        # Status changes of accomplishments (see journal.Journal). While
+        # all trophies are being checked again, changes are not recorded,
+        # as the journal is reset afterwards.
+        self.journal = journal.Journal(os.path.join(self.dir_data, "journal"))
+        self.journal.load()
+        self.journaling = True
+        # Outcomes of scripts, used to run the scripts that keep not
+        # succeeding less often (see backoff.ScriptBackoff)
+        self.script_backoff = backoff.ScriptBackoff(
+            os.path.join(self.dir_cache, "script-backoff"))
+        self.script_backoff.load()
+
         self.dir_autostart = os.path.join(
             xdg.BaseDirectory.xdg_config_home, "autostart")
 
@@ -339,13 +497,91 @@ class Accomplishments(object):
             log.msg("Test mode enabled, not connecting to SyncDaemonTool()")
             self.sd = None
 
+        # Load the database now, so that it can be served as soon as the
+        # D-Bus object is exported. Everything else is completed in the
+        # background (see _complete_startup).
         self.reload_accom_database()
 
         if not self.test_mode:
             self.sd.connect_signal(
                 "DownloadFinished", self._process_received_trophy_file)
 
-        self._refresh_share_data()
+        # fires once the startup is complete, even if one of it's stages
+        # has failed
+        self.startup_complete = self._complete_startup()
+        self.startup_complete.addErrback(self._startup_failed)
+
+    @defer.inlineCallbacks
+    def _complete_startup(self):
+        # Waits for signatures to be verified, creates trophy icons and
+        # refreshes share data, one stage after another. D-Bus calls are
+        # answered in the meantime. In test mode, all of this is done
+        # before this function returns.
+        self._set_startup_stage("signatures")
+        yield self.statuses_complete
+
+        self._set_startup_stage("icons")
+        for col in self.list_collections():
+            self.create_trophy_icons(col)
+            if not self.test_mode:
+                # let the reactor handle other events in between
+                yield task.deferLater(reactor, 0, lambda: None)
+
+        self._set_startup_stage("share")
+        try:
+            yield self._refresh_share_data()
+        except Exception, e:
+            log.msg("Could not refresh share data: %s" % e)
+
+        self._finish_startup()
+
+    def _startup_failed(self, failure):
+        # The database is loaded already, so the daemon becomes ready
+        # anyway; the stages left are skipped.
+        log.msg("Startup stage %s failed: %s" % (
+            self.startup_stage, failure.getTraceback()))
+        self._finish_startup()
+
+    def _finish_startup(self):
+        self._set_startup_stage("ready")
+        if not self.test_mode:
+            self.service.daemon_ready()
+        postponed, self.postponed_script_runs = \
+            self.postponed_script_runs, []
+        for which, lane in postponed:
+            self.run_scripts(which, lane)
+
+    def _set_startup_stage(self, stage):
+        self.startup_stage = stage
+        log.msg("Startup stage: %s" % stage)
+
+    def get_startup_progress(self):
+        """
+        Tells how far the daemon got with starting up. The accomplishments database is available from the very beginning, as it is loaded before the daemon is exported on D-Bus; if the database cached by the previous run can not be used, all collections are parsed at that point, and the daemon does not answer until that is done. Until the daemon is ready, some accomplishments that require signed trophies may not be shown as accomplished yet, and trophy icons may be missing.
+
+        Args:
+            *None.*
+
+        Returns:
+            * **dict** - with the following keys:
+                * **stage** - (str) the current stage: "signatures", "icons", "share", or "ready" once the startup is complete (or one of the stages before has failed).
+                * **completed** - (int) the number of completed stages.
+                * **stages** - (int) the number of all stages.
+                * **pending-signatures** - (int) the number of trophies whose signatures are still to be verified.
+                * **ready** - (bool) whether the startup is complete.
+
+        Example:
+            >>> acc.get_startup_progress()
+            {'stage': 'icons', 'completed': 1, 'stages': 3, 'pending-signatures': 0, 'ready': False}
+        """
+        completed = STARTUP_STAGES.index(self.startup_stage)
+        return {
+            'stage': self.startup_stage,
+            'completed': completed,
+            'stages': len(STARTUP_STAGES) - 1,
+            'pending-signatures': self.verifier.pending,
+            'ready': self.startup_stage == "ready",
+        }
 
     def get_media_file(self, media_file_name):
         media_filename = os.path.join(media_dir, media_file_name)
@@ -363,47 +599,56 @@ class Accomplishments(object):
         cols = self.list_collections()
 
         for col in cols:
-            col_imagespath = os.path.join(self.accomDB[col]['base-path'],
-                                          "trophyimages")
-            cache_trophyimagespath = os.path.join(
-                self.dir_cache, "trophyimages", col)
-            lock_image_path = os.path.join(media_dir, "lock.png")
-            if not os.path.exists(cache_trophyimagespath):
-                os.makedirs(cache_trophyimagespath)
-
-            # First, delete all cached images:
-            cachedlist = glob.glob(cache_trophyimagespath + "/*")
-            for c in cachedlist:
-                os.remove(c)
-
-            mark = Image.open(lock_image_path)
-            for root, dirs, files in os.walk(col_imagespath):
-                for name in files:
-                    try:
-                        im = Image.open(os.path.join(root, name))
-                        filename = os.path.join(cache_trophyimagespath, name)
-                        filecore = os.path.splitext(filename)[0]
-                        filetype = os.path.splitext(filename)[1]
-
-                        im.save(filename)
-
-                        # Opacity set to 1.0 until we figure out a better way of
-                        # showing opportunities
-                        reduced = self._create_reduced_opacity_trophy_icon(im,
-                                                                           1.0)
-                        reduced.save(filecore + "-opportunity" + filetype)
-
-                        if im.mode != 'RGBA':
-                            im = im.convert('RGBA')
-                        layer = Image.new('RGBA', im.size, (0, 0, 0, 0))
-                        position = (
-                            im.size[0] - mark.size[0], im.size[1] - mark.size[1])
-                        layer.paste(mark, position)
-                        img = Image.composite(layer, reduced, layer)
-                        img.save(filecore + "-locked" + filetype)
-
-                    except Exception, (msg):
-                        log.msg(msg)
+            self.create_trophy_icons(col)
+
+    def create_trophy_icons(self, col):
+        """Generate all of the icons for a single collection. If the
+        collection is no longer installed, its cached icons are removed."""
+        cache_trophyimagespath = os.path.join(
+            self.dir_cache, "trophyimages", col)
+        lock_image_path = os.path.join(media_dir, "lock.png")
+        if not os.path.exists(cache_trophyimagespath):
+            os.makedirs(cache_trophyimagespath)
+
+        # First, delete all cached images:
+        cachedlist = glob.glob(cache_trophyimagespath + "/*")
+        for c in cachedlist:
+            os.remove(c)
+
+        if not col in self.accomDB:
+            os.rmdir(cache_trophyimagespath)
+            return
+
+        col_imagespath = os.path.join(self.accomDB[col]['base-path'],
+                                      "trophyimages")
+        mark = Image.open(lock_image_path)
+        for root, dirs, files in os.walk(col_imagespath):
+            for name in files:
+                try:
+                    im = Image.open(os.path.join(root, name))
+                    filename = os.path.join(cache_trophyimagespath, name)
+                    filecore = os.path.splitext(filename)[0]
+                    filetype = os.path.splitext(filename)[1]
+
+                    im.save(filename)
+
+                    # Opacity set to 1.0 until we figure out a better way of
+                    # showing opportunities
+                    reduced = self._create_reduced_opacity_trophy_icon(im,
+                                                                       1.0)
+                    reduced.save(filecore + "-opportunity" + filetype)
+
+                    if im.mode != 'RGBA':
+                        im = im.convert('RGBA')
+                    layer = Image.new('RGBA', im.size, (0, 0, 0, 0))
+                    position = (
+                        im.size[0] - mark.size[0], im.size[1] - mark.size[1])
+                    layer.paste(mark, position)
+                    img = Image.composite(layer, reduced, layer)
+                    img.save(filecore + "-locked" + filetype)
+
+                except Exception, (msg):
+                    log.msg(msg)
 
     def _create_reduced_opacity_trophy_icon(self, im, opacity):
         """Returns an image with reduced opacity."""
@@ -521,6 +766,30 @@ class Accomplishments(object):
                 self.matrix_username = STAGING_ID
             else:
                 self.matrix_username = PRODUCTION_ID
+            if config.has_option('config', 'loader_processes'):
+                self.loader_processes = config.getint(
+                    'config', 'loader_processes')
+            if config.has_option('config', 'lazy_text_fields'):
+                self.lazy_text_fields = config.getboolean(
+                    'config', 'lazy_text_fields')
+            if config.has_option('config', 'text_field_cache_size'):
+                self.text_field_cache.size = max(config.getint(
+                    'config', 'text_field_cache_size'), 1)
+            if config.has_option('config', 'script_concurrency'):
+                self.script_concurrency = config.getint(
+                    'config', 'script_concurrency')
+            if config.has_option('config', 'script_timeout'):
+                self.script_timeout = config.getint(
+                    'config', 'script_timeout')
+            if config.has_option('config', 'script_backoff'):
+                self.script_backoff.base = config.getint(
+                    'config', 'script_backoff')
+            if config.has_option('config', 'script_backoff_max'):
+                self.script_backoff.cap = config.getint(
+                    'config', 'script_backoff_max')
+            if config.has_option('config', 'script_worker_pool') and \
+                    config.getboolean('config', 'script_worker_pool'):
+                self.worker_pool = workers.WorkerPool()
 
         else:
             # setting accomplishments path to the system default
@@ -546,6 +815,8 @@ class Accomplishments(object):
         if not self.test_mode:
             l = self.sd.list_shared()
             l.addCallback(self._complete_refreshing_share_data)
+            return l
+        return defer.succeed(None)
 
     def _complete_refreshing_share_data(self, shares):
         matchingshares = []
@@ -760,6 +1031,9 @@ class Accomplishments(object):
             f = open(os.path.join(extrainfodir, item), 'w')
             f.write(data)
             f.close()
+            self._journal("extra-information-changed", item=item)
+            self._reset_script_backoff(item)
+            self._update_extra_information_statuses()
 
     def _process_valid_trophy_received(self, path):
         log.msg("Valid trophy received...")
@@ -769,10 +1043,12 @@ class Accomplishments(object):
             self._display_unlocked_bubble(accomID)
         else:
             accomID = path[len(self.trophies_path) + 1:-7]
+        self._journal("trophy-received", accomID,
+                      files=self._get_trophy_file_keys(accomID))
         # Mark as accomplished and get list of new opportunities
         just_unlocked = self._mark_as_accomplished(accomID)
         self.service.trophy_received(accomID)
-        self.run_scripts(just_unlocked)
+        self.run_scripts(just_unlocked, scheduler.UNLOCKED)
 
     def _process_received_trophy_file(self, path, info):
         log.msg("Trophy file received: validating...")
@@ -780,11 +1056,8 @@ class Accomplishments(object):
         if path.startswith(self.trophies_path):
             if path.endswith(".asc"):
                 log.msg("Processing signature: " + path)
-                valid = self._get_is_asc_correct(path)
-                if not valid:
-                    log.msg("WARNING: invalid .asc signature received from the server!")
-                else:
-                    self._process_valid_trophy_received(path)
+                d = self.verifier.verify(path)
+                d.addCallback(self._process_received_signature, path)
             else:
                 # process unsigned trophies
                 log.msg("Processing unsigned trophy: " + path)
@@ -793,6 +1066,12 @@ class Accomplishments(object):
                 else:
                     self._process_valid_trophy_received(path)
 
+    def _process_received_signature(self, valid, path):
+        if not valid:
+            log.msg("WARNING: invalid .asc signature received from the server!")
+        else:
+            self._process_valid_trophy_received(path)
+
     def write_extra_information_file(self, item, data):
         log.msg(
             "Saving Extra Information file: %s, %s" % (item, data))
@@ -809,6 +1088,17 @@ class Accomplishments(object):
         else:
             # file would be empty, remove it instead
             os.remove(os.path.join(extrainfodir, item))
+        self._journal("extra-information-changed", item=item)
+        self._reset_script_backoff(item)
+        self._update_extra_information_statuses()
+
+    def _reset_script_backoff(self, item):
+        # The scripts of accomplishments that need the extra information
+        # **item** may succeed now that it has changed
+        for accomID in self.script_backoff.entries.keys():
+            if accomID not in self.accomDB or \
+                    item in self.get_accom_needs_info(accomID):
+                self.script_backoff.reset(accomID)
 
     # Returns True if all extra information is available for an accom,
     # False otherwise
@@ -894,7 +1184,9 @@ class Accomplishments(object):
 
         All results are stored in an internal variable, *self.accomDB*. They can be accessed afterwards using get_acc_* functions.
 
-        Running this function also calls _update_all_locked_and_accomplished_statuses(), which completes initialising the *accomDB*, as it fills in it's "accomplished" and "locked" fields.
+        Only collections that were added, removed or modified since the last reload are parsed again; all the others are kept as they are. When the daemon starts, the database stored in the cache directory by the previous run is used as the starting point, so that unchanged collections do not need to be parsed at all.
+
+        Running this function also calls _update_all_locked_and_accomplished_statuses(), which completes initialising the *accomDB*, as it fills in it's "accomplished" and "locked" fields. On later reloads, these fields are updated only for the accomplishments from changed collections, and for accomplishments depending on them.
 
         .. note::
             There is no need for clients to run this method manually when the daemon is started - this function is called by this class' __init__.
@@ -903,248 +1195,207 @@ class Accomplishments(object):
             *None.*
 
         Returns:
-            * Nothing.
+            * **list(str)** - The names of collections that have changed.
 
         """
-        # First, clear the database.
-        self.accomDB = {}
         # Get the list of all paths where accomplishments may be
         # installed...
         installpaths = self.accoms_installpaths.split(":")
+        signature = self._get_accom_database_signature(installpaths)
+
+        full_update = self.accomdb_signature is None
+        if full_update:
+            # Nothing has been loaded yet. Start off with the snapshot
+            # stored by the previous run, if there is one.
+            self._load_accom_database_snapshot()
+
+        changed = loader.get_changed_collections(
+            self.accomdb_signature, signature)
+        if changed:
+            log.msg("Loading collections: " + ", ".join(changed))
+        affected = self._reload_collections(changed, signature)
+        self.accomdb_signature = signature
+        if changed:
+            self._save_accom_database_snapshot()
+
+        olddepgraph = self.depgraph
+        if changed or full_update:
+            self.depgraph = depgraph.DependencyGraph(self.accomDB)
+            self.statuses = status.StatusVectors(
+                self.depgraph.order, self.statuses)
+
+        if full_update:
+            self.search_index.clear()
+            for accom in self.list_accoms():
+                self._index_accom(accom)
+            # Trophy icons are created while completing the startup
+            self.statuses_complete = \
+                self._update_all_locked_and_accomplished_statuses(
+                    use_journal=not changed)
+        else:
+            for accom in affected:
+                if self.get_accom_exists(accom):
+                    self._index_accom(accom)
+                else:
+                    self.search_index.remove(accom)
+                    self.trophy_history.remove(accom)
+            # Accomplishments that got into or out of a dependency cycle
+            # need to be checked too, even if they have not changed.
+            lockcheck = set(self._list_affected_by(affected))
+            lockcheck.update(
+                a for a in olddepgraph.quarantined ^ self.depgraph.quarantined
+                if self.get_accom_exists(a))
+            self.statuses_complete = \
+                self._update_locked_and_accomplished_statuses(
+                    [a for a in affected if self.get_accom_exists(a)],
+                    sorted(lockcheck))
+            for collection in changed:
+                self.create_trophy_icons(collection)
+
+        if not self.test_mode:
+            self.service.accoms_collections_reloaded(changed)
+        # Uncomment following for debugging
+        # print self.accomDB\
+
+        return changed
+
+    def _reload_collections(self, collections, signature):
+        """Drops all accomDB entries of given **collections**, and parses
+        those of them that are still installed (according to
+        **signature**) again. Returns a set of IDs of all accomplishments
+        that were removed, added or reloaded in the process."""
+        affected = set()
+        for collection in collections:
+            # Forget everything that was known about this collection...
+            for key in self.accomDB.keys_of_collection(collection):
+                if self.accomDB[key]['type'] == "accomplishment":
+                    affected.add(key)
+                del self.accomDB[key]
+        if collections:
+            # Texts read lazily may be outdated now
+            self.text_field_cache.clear()
+
+        # ...and load the ones that are still installed again, in the
+        # order of install paths.
+        installpaths = self.accoms_installpaths.split(":")
+        tasks = [(signature['collections'][collection][0], collection,
+                  self.lang, self.lazy_text_fields)
+                 for collection in collections
+                 if collection in signature['collections']]
+        tasks.sort(key=lambda task: (installpaths.index(task[0]), task[1]))
+
+        processes = self.loader_processes
+        if reactor.running:
+            # Forking the daemon is only safe before the reactor has
+            # started; by then it may have threads (e.g. verifying
+            # signatures) and connections of it's own.
+            processes = 1
+        results = loader.parse_collections(tasks, processes)
+        for entries in results:
+            for key, data in entries.iteritems():
+                if data['type'] == "accomplishment":
+                    affected.add(key)
+            self.accomDB.update(entries)
+        return affected
+
+    def _get_accom_database_signature(self, installpaths):
+        """Returns a signature of all installed collections, which is used
+        to tell which collections have changed since they were loaded. It
+        is keyed by the collection name, and it also states the install
+        path the collection was found in, as well as the language used
+        and whether texts are loaded lazily."""
+        collections = {}
         for installpath in installpaths:
-            # Look for all accomplishment collections in this path
             path = os.path.join(installpath, 'accomplishments')
             if not os.path.exists(path):
                 continue
-
-            collections = os.listdir(path)
-            for collection in collections:
-                # For each collection...
-                if collection in self.accomDB:
-                    # This collection has already been loaded from another
-                    # install path!
+            for collection in os.listdir(path):
+                if collection in collections:
+                    # Already found in another install path
                     continue
-
                 collpath = os.path.join(path, collection)
-                aboutpath = os.path.join(collpath, 'ABOUT')
-
-                # Load data from ABOUT file
-                cfg = ConfigParser.RawConfigParser()
-                cfg.read(aboutpath)
-
-                if not (cfg.has_option("general", "langdefault") and cfg.has_option("general", "name")):
-                    print aboutpath
-                    raise LookupError(
-                        "Accomplishment collection with invalid ABOUT file ")
-
-                langdefault = cfg.get("general", "langdefault")
-                collectionname = cfg.get("general", "name")
-
-                collauthors = set()
-                collcategories = {}
-
-                langdefaultpath = os.path.join(collpath, langdefault)
-                setsslist = os.listdir(langdefaultpath)
-                accno = 0
-                for accomset in setsslist:
-                    if accomset[-15:] == '.accomplishment':
-                        # this is an ungroped accomplishment file
-                        accompath = os.path.join(langdefaultpath, accomset)
-                        accomcfg = ConfigParser.RawConfigParser()
-                        # check if there is a translated version...
-                        translatedpath = os.path.join(
-                            os.path.join(collpath, self.lang), accomset)
-                        if os.path.exists(translatedpath):
-                            # yes, so use the translated file
-                            readpath = translatedpath
-                            langused = self.lang
-                        else:
-                            # no. maybe there is a shorter language code?
-                            translatedpath = os.path.join(os.path.join(
-                                collpath, self.lang.split("_")[0]), accomset)
-                            if os.path.exists(translatedpath):
-                                readpath = translatedpath
-                                langused = self.lang.split("_")[0]
-                            else:
-                                # no. fallback to default one
-                                readpath = accompath
-                                langused = langdefault
-
-                        # do the parse
-                        try:
-                            accomcfg.read(readpath)
-                        except ConfigParser.ParsingError, e:
-                            log.msg("Parse error for %s.  Skipping."
-                                    "Parse error is: %s" % (readpath, e.message))
-                            continue
-
-                        accomdata = dict(accomcfg._sections["accomplishment"])
-                        accomID = collection + "/" + accomset[:-15]
-                        if 'author' in accomdata:
-                            collauthors.add(accomdata['author'])
-                        del accomdata['__name__']
-                        accomdata['set'] = ""
-                        accomdata['collection'] = collection
-                        accomdata['type'] = "accomplishment"
-                        accomdata['lang'] = langused
-                        accomdata['base-path'] = collpath
-                        accomdata['script-path'] = os.path.join(installpath, os.path.join('scripts', os.path.join(collection, accomset[:-15] + ".py")))
-                        if 'category' in accomdata:
-                            cats = accomdata['category'].split(",")
-                            categories = []
-                            accomdata['categories'] = []
-                            for cat in cats:
-                                catsplitted = cat.rstrip().lstrip().split(":")
-                                accomdata['categories'].append(
-                                    cat.rstrip().lstrip())
-                                if catsplitted[0] in collcategories:
-                                    pass
-                                else:
-                                    collcategories[catsplitted[0]] = []
-                                if len(catsplitted) > 1:
-                                    # category + subcategory
-                                    if catsplitted[1] not in collcategories[catsplitted[0]]:
-                                        collcategories[catsplitted[
-                                            0]].append(catsplitted[1])
-                            del accomdata['category']
-                        else:
-                            accomdata['categories'] = []
-                        self.accomDB[accomID] = accomdata
-                        accno = accno + 1
-                    else:
-                        # this is indeed a set!
-                        setID = collection + ":" + accomset
-                        setdata = {'type': "set", 'name': accomset}
-                        self.accomDB[setID] = setdata
-                        setdir = os.path.join(langdefaultpath, accomset)
-                        accomfiles = os.listdir(setdir)
-                        for accomfile in accomfiles:
-                            # For each accomplishment in this set...
-                            accompath = os.path.join(langdefaultpath, os.path.join(accomset, accomfile))
-                            accomcfg = ConfigParser.RawConfigParser()
-                            # check if there is a translated version...
-                            translatedpath = os.path.join(os.path.join(collpath, self.lang), os.path.join(accomset, accomfile))
-                            if os.path.exists(translatedpath):
-                                # yes, so use the translated file
-                                readpath = translatedpath
-                                langused = self.lang
-                            else:
-                                # no. maybe there is a shorter language code?
-                                translatedpath = os.path.join(os.path.join(collpath, self.lang.split("_")[0]), os.path.join(accomset, accomfile))
-                                if os.path.exists(translatedpath):
-                                    readpath = translatedpath
-                                    langused = self.lang.split("_")[0]
-                                else:
-                                    # no. fallback to default one
-                                    readpath = accompath
-                                    langused = langdefault
-
-                            # do the parse
-                            try:
-                                accomcfg.read(readpath)
-                            except ConfigParser.ParsingError, e:
-                                log.msg("Parse error for %s.  Skipping."
-                                        "Parse error is: %s" % (readpath, e.message))
-                                continue
-
-                            accomdata = dict(
-                                accomcfg._sections["accomplishment"])
-                            accomID = collection + "/" + accomfile[:-15]
-                            if 'author' in accomdata:
-                                collauthors.add(accomdata['author'])
-                            accomdata['type'] = "accomplishment"
-                            del accomdata['__name__']
-                            accomdata['set'] = accomset
-                            accomdata['collection'] = collection
-                            accomdata['lang'] = langused
-                            accomdata['base-path'] = collpath
-                            accomdata['script-path'] = os.path.join(installpath, os.path.join('scripts', os.path.join(collection, os.path.join(accomset, accomfile[:-15] + ".py"))))
-                            if 'category' in accomdata:
-                                cats = accomdata['category'].split(",")
-                                categories = []
-                                accomdata['categories'] = []
-                                for cat in cats:
-                                    catsplitted = cat.rstrip(
-                                    ).lstrip().split(":")
-                                    accomdata['categories'].append(
-                                        cat.rstrip().lstrip())
-                                    if catsplitted[0] in collcategories:
-                                        pass
-                                    else:
-                                        collcategories[catsplitted[0]] = []
-                                    if len(catsplitted) > 1:
-                                        # category + subcategory
-                                        if catsplitted[1] not in collcategories[catsplitted[0]]:
-                                            collcategories[catsplitted[
-                                                0]].append(catsplitted[1])
-                                del accomdata['category']
-                            else:
-                                accomdata['categories'] = []
-                            self.accomDB[accomID] = accomdata
-                            accno = accno + 1
-
-                # Look for extrainformation dir
-                extrainfodir = os.path.join(collpath, "extrainformation")
-                extrainfolist = os.listdir(extrainfodir)
-                extrainfo = {}
-                for extrainfofile in extrainfolist:
-                    extrainfopath = os.path.join(extrainfodir, extrainfofile)
-                    eicfg = ConfigParser.RawConfigParser()
-                    eicfg.read(extrainfopath)
-
-                    if eicfg.has_option("label", self.lang):
-                        label = eicfg.get("label", self.lang)
-                    elif eicfg.has_option("label", self.lang.split("_")[0]):
-                        label = eicfg.get("label", self.lang.split("_")[0])
-                    else:
-                        label = eicfg.get("label", langdefault)
-
-                    if eicfg.has_option("description", self.lang):
-                        description = eicfg.get("description", self.lang)
-                    elif eicfg.has_option("description", self.lang.split("_")[0]):
-                        description = eicfg.get(
-                            "description", self.lang.split("_")[0])
-                    else:
-                        description = eicfg.get("description", langdefault)
-
-                    if eicfg.has_option("example", self.lang):
-                        example = eicfg.get("example", self.lang)
-                    elif eicfg.has_option("example", self.lang.split("_")[0]):
-                        example = eicfg.get("example", self.lang.split("_")[0])
-                    elif eicfg.has_option("example", langdefault):
-                        example = eicfg.get("example", langdefault)
-                    else:
-                        example = None
-
-                    if eicfg.has_option("regex", "value"):
-                        regex = eicfg.get("regex", "value")
-                    else:
-                        regex = None
-
-                    extrainfo[extrainfofile] = {
-                        'label': label,
-                        'description': description,
-                        'example': example,
-                        'regex': regex,
-                    }
-
-                # Store data about this colection
-                collectiondata = {'langdefault': langdefault, 'name': collectionname, 'acc_num': accno, 'type': "collection", 'base-path': collpath, 'categories': collcategories, 'extra-information': extrainfo, 'authors': collauthors}
-                self.accomDB[collection] = collectiondata
-
-        self._update_all_locked_and_accomplished_statuses()
-
-        self.create_all_trophy_icons()
+                scriptspath = os.path.join(installpath, 'scripts', collection)
+                collections[collection] = (
+                    installpath, loader.get_collection_signature(collpath),
+                    loader.get_collection_signature(scriptspath))
+        return {'lang': self.lang, 'lazy': self.lazy_text_fields,
+                'collections': collections}
+
+    def _get_accom_database_snapshot_path(self):
+        return os.path.join(self.dir_cache, "accomdb.snapshot")
+
+    def _load_accom_database_snapshot(self):
+        """Loads the accomDB, along with the signature of collections it
+        was built from, from the snapshot stored in the cache directory.
+        Returns True if this succeeded, or False if there is no usable
+        snapshot."""
+        snapshotpath = self._get_accom_database_snapshot_path()
+        if not os.path.exists(snapshotpath):
+            return False
 
-        if not self.test_mode:
-            self.service.accoms_collections_reloaded()
-        # Uncomment following for debugging
-        # print self.accomDB\
+        try:
+            f = open(snapshotpath, "rb")
+            try:
+                snapshot = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            log.msg("Could not load accomDB snapshot %s: %s" % (
+                snapshotpath, e))
+            return False
+
+        if not isinstance(snapshot, dict) or \
+                snapshot.get('version') != ACCOMDB_SNAPSHOT_VERSION:
+            log.msg("Ignoring accomDB snapshot of an unknown version.")
+            return False
+
+        log.msg("Using accomDB snapshot from %s" % snapshotpath)
+        self.accomDB = snapshot['accomDB']
+        self.accomdb_signature = snapshot['signature']
+        return True
+
+    def _save_accom_database_snapshot(self):
+        """Stores the accomDB in the cache directory, along with the
+        signature of the collections it was built from."""
+        snapshotpath = self._get_accom_database_snapshot_path()
+        snapshot = {
+            'version': ACCOMDB_SNAPSHOT_VERSION,
+            'signature': self.accomdb_signature,
+            'accomDB': self.accomDB,
+        }
+        # Write to a temporary file first, so that a crash cannot leave a
+        # truncated snapshot behind.
+        tmppath = snapshotpath + ".tmp"
+        try:
+            f = open(tmppath, "wb")
+            try:
+                cPickle.dump(snapshot, f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmppath, snapshotpath)
+        except (IOError, OSError, cPickle.PicklingError), e:
+            log.msg("Could not save accomDB snapshot %s: %s" % (
+                snapshotpath, e))
 
     # ======= Access functions =======
 
     def get_accom_data(self, accomID):
-        return self.accomDB[accomID]
+        # accomplishments are kept in AccomRecords, hand out a real dict
+        data = dict(self.accomDB[accomID])
+        if 'file-path' in data:
+            # This accomplishment was loaded lazily, fill in the texts
+            data.update(self._get_accom_text_fields(accomID))
+            del data['file-path']
+        return data
+
+    def _get_accom_text_fields(self, accomID):
+        """Returns a dict of the long texts of an accomplishment that was
+        loaded with lazy_text_fields enabled (see
+        loader.LAZY_TEXT_FIELDS). These are read from it's
+        .accomplishment file the first time they are needed, and kept in
+        a bounded cache afterwards."""
+        return self.text_field_cache.get(
+            accomID, self.accomDB[accomID]['file-path'])
 
     def get_accom_exists(self, accomID):
         """
@@ -1170,7 +1421,7 @@ class Accomplishments(object):
         if not accomID in self.accomDB:
             return False
 
-        if self.accomDB[accomID]['type'] is "accomplishment":
+        if self.accomDB[accomID]['type'] == "accomplishment":
             return True
         else:
             return False
@@ -1179,13 +1430,15 @@ class Accomplishments(object):
         return self.accomDB[accomID]['title']
 
     def get_accom_description(self, accomID):
-        return self.accomDB[accomID]['description']
+        data = self.accomDB[accomID]
+        if 'file-path' in data:
+            # empty if the file cannot be read anymore
+            fields = self._get_accom_text_fields(accomID)
+            return fields.get('description', "")
+        return data['description']
 
     def get_accom_keywords(self, accomID):
-        if not 'keywords' in self.accomDB[accomID]:
-            return [""]
-        else:
-            return [a.rstrip().lstrip() for a in self.accomDB[accomID]['keywords'].split(",")]
+        return self.accomDB[accomID].parsed_keywords
 
     def get_accom_needs_signing(self, accomID):
         """
@@ -1203,12 +1456,7 @@ class Accomplishments(object):
             >>> acc.get_accom_needs_signing("ubuntu-desktop/gwibber-twitter")
             False
         """
-        if not 'needs-signing' in self.accomDB[accomID]:
-            return False
-        elif (self.accomDB[accomID]['needs-signing'] == "false" or self.accomDB[accomID]['needs-signing'] == "False" or self.accomDB[accomID]['needs-signing'] == "no"):
-            return False
-        else:
-            return True
+        return self.accomDB[accomID].parsed_needs_signing
 
     def get_accom_depends(self, accomID):
         """
@@ -1218,21 +1466,18 @@ class Accomplishments(object):
             * **accomID** - (str) The accomplishmentID.
 
         Returns:
-            * **(list[str])** - List of accomplishmentIDs of
+            * **(tuple(str))** - accomplishmentIDs of
             * accomplishments that need to be accomplished before this one is unlocked.
 
         Example:
             >>> acc.get_accom_depends("ubuntu-community/registered-on-launchpad")
-            []
+            ()
             >>> acc.get_accom_depends("ubuntu-community/ubuntu-member")
-            ["ubuntu-community/registered-on-launchpad", "ubuntu-community/signed-ubuntu-code-of-conduct"]
+            ("ubuntu-community/registered-on-launchpad", "ubuntu-community/signed-ubuntu-code-of-conduct")
             >>> acc.get_accom_depends("ubuntu-desktop/gnomine_small-5-times")
-            ["ubuntu-desktop/gnomine_win-small"]
+            ("ubuntu-desktop/gnomine_win-small",)
         """
-        if 'depends' in self.accomDB[accomID]:
-            return [a.rstrip().lstrip() for a in self.accomDB[accomID]['depends'].split(",")]
-        else:
-            return []
+        return self.accomDB[accomID].parsed_depends
 
     def get_accom_is_unlocked(self, accomID):
         """
@@ -1305,6 +1550,43 @@ class Accomplishments(object):
         else:
             return res
 
+    def get_accom_script_timeout(self, accomID):
+        """
+        Returns how many seconds the script of an accomplishment may run
+        for, before it is stopped. Accomplishments can set this with the
+        "script-timeout" field, otherwise it is the script_timeout config
+        option. 0 means there is no limit.
+
+        Args:
+            * **accomID** - (str) The Accomplishment ID
+
+        Returns:
+            * **(int)** - The number of seconds.
+
+        Example:
+            >>> acc.get_accom_script_timeout("ubuntu-community/registered-on-launchpad")
+            300
+        """
+        timeout = self.accomDB[accomID].get('script-timeout')
+        if timeout is not None:
+            try:
+                return max(int(timeout), 0)
+            except ValueError:
+                log.msg("%s: Ignoring invalid script-timeout: %s" % (
+                    accomID, timeout))
+        return self.script_timeout
+
+    def _can_use_worker_pool(self, accomID, scriptpath):
+        # Accomplishments can opt out with "script-worker-pool = false",
+        # e.g. if their scripts do not work well in a forked process.
+        if self.worker_pool is None:
+            return False
+        optout = self.accomDB[accomID].get('script-worker-pool')
+        if optout is not None and optout.strip().lower() in \
+                ("false", "no", "0"):
+            return False
+        return workers.can_run(scriptpath)
+
     def get_accom_icon(self, accomID):
         return self.accomDB[accomID]['icon']
 
@@ -1325,9 +1607,7 @@ class Accomplishments(object):
         return os.path.join(imagesdir, iconfile)
 
     def get_accom_needs_info(self, accomID):
-        if not 'needs-information' in self.accomDB[accomID]:
-            return []
-        return [a.strip() for a in self.accomDB[accomID]['needs-information'].split(",")]
+        return self.accomDB[accomID].parsed_needs_info
 
     def get_accom_collection(self, accomID):
         """
@@ -1396,9 +1676,7 @@ class Accomplishments(object):
         if not self.get_accom_is_accomplished(accomID):
             return None
         else:
-            cfg = ConfigParser.RawConfigParser()
-            cfg.read(self.get_trophy_path(accomID))
-            return dict(cfg._sections["trophy"])
+            return self.trophy_cache.get(self.get_trophy_path(accomID))
 
     def get_collection_name(self, collection):
         """
@@ -1428,7 +1706,8 @@ class Accomplishments(object):
             >>> acc.get_collection_exists("a totally wrong name")
             False
         """
-        return collection in self.list_collections()
+        return collection in self.accomDB and \
+            self.accomDB[collection]['type'] == "collection"
 
     def get_collection_authors(self, collection):
         """
@@ -1488,37 +1767,186 @@ class Accomplishments(object):
         """
         return self.accomDB[collection]
 
+    def get_collection_progress(self, collection):
+        """
+        Returns how many accomplishments of a given collection there are, and how many of them have been accomplished or are unlocked.
+
+        Args:
+            * **collection** - (str) Sellected collection name (e.g. "ubuntu-community")
+        Returns:
+            * **dict(str:int)** - The number of accomplishments:
+                * *total* - in this collection
+                * *accomplished* - that have been accomplished
+                * *unlocked* - that are unlocked, but not yet accomplished
+        Example:
+            >>> acc.get_collection_progress("ubuntu-community")
+            {"total" : 52, "accomplished" : 12, "unlocked" : 21}
+        """
+        if not self.get_collection_exists(collection):
+            raise KeyError(collection)
+        return {
+            'total': self.statuses.count(0, 0, collection),
+            'accomplished': self.statuses.count(
+                status.ACCOMPLISHED, collection=collection),
+            'unlocked': self.statuses.count(
+                status.LOCKED | status.ACCOMPLISHED, 0, collection),
+        }
+
     # ====== Listing functions ======
 
     def list_accoms(self):
-        return [accom for accom in self.accomslist()]
+        return list(self.accomDB.keys_of_type("accomplishment"))
 
     def list_trophies(self):
-        return [accom for accom in self.accomslist() if self.get_accom_is_accomplished(accom)]
+        return self.statuses.select(status.ACCOMPLISHED)
 
     def list_opportunities(self):
-        return [accom for accom in self.accomslist() if not self.get_accom_is_accomplished(accom)]
+        return self.statuses.select(status.ACCOMPLISHED, 0)
 
     def list_depending_on(self, accomID):
-        return [accom for accom in self.accomslist() if accomID in self.get_accom_depends(accom)]
+        return self.accomDB.dependents_of(accomID)
 
     def list_unlocked(self):
-        return [accom for accom in self.accomslist() if self.get_accom_is_unlocked(accom)]
+        return self.statuses.select(status.LOCKED, 0)
 
     def list_unlocked_not_accomplished(self):
-        return [accom for accom in self.accomslist() if self.get_accom_is_unlocked(accom) and not self.get_accom_is_accomplished(accom)]
+        return self.statuses.select(status.LOCKED | status.ACCOMPLISHED, 0)
+
+    def list_runnable(self):
+        """
+        Returns a list of unlocked accomplishments that are not yet
+        accomplished, have a script, and have all the extra information
+        they need available - as far as the daemon knows. These are the
+        accomplishments whose scripts are worth running.
+        """
+        return self.statuses.select(
+            status.LOCKED | status.ACCOMPLISHED | status.HAS_SCRIPT |
+            status.EXTRAINFO_COMPLETE,
+            status.HAS_SCRIPT | status.EXTRAINFO_COMPLETE)
 
     def list_collections(self):
-        return [col for col in self.accomDB if self.accomDB[col]['type'] == 'collection']
+        return list(self.accomDB.keys_of_type("collection"))
+
+    # ====== Trophy history ======
+
+    def list_trophies_between(self, start, end):
+        """
+        Lists trophies accomplished between two dates, ordered by the date they were accomplished on.
+
+        Args:
+            * **start** - (str) the first date, e.g. "2012-06-01" or "2012-06-01 12:30". An empty string means no limit.
+            * **end** - (str) the last date, in the same form. It is included as a whole, so "2012-06-30" includes all of that day, and "2012-06" all of June. An empty string means no limit.
+
+        Returns:
+            * **list(str)** - accomplishmentIDs, the oldest first.
+
+        Example:
+            >>> acc.list_trophies_between("2012-06-01", "2012-06-30")
+            ["ubuntu-community/registered-on-launchpad", "ubuntu-community/signed-code-of-conduct"]
+        """
+        return self.trophy_history.between(start, end)
+
+    def list_recent_trophies(self, n):
+        """
+        Lists the most recently accomplished trophies.
+
+        Args:
+            * **n** - (int) how many trophies to list.
+
+        Returns:
+            * **list(str)** - accomplishmentIDs, the newest first.
+
+        Example:
+            >>> acc.list_recent_trophies(1)
+            ["ubuntu-community/signed-code-of-conduct"]
+        """
+        return self.trophy_history.recent(n)
+
+    def get_trophy_counts_by_day(self, start, end):
+        """
+        Counts trophies accomplished on each day between two dates.
+
+        Args:
+            * **start**, **end** - (str) the first and the last date, see list_trophies_between.
+
+        Returns:
+            * **dict(str:int)** - the numbers of trophies accomplished, by day ("YYYY-MM-DD"). Days on which no trophies were accomplished are left out.
+
+        Example:
+            >>> acc.get_trophy_counts_by_day("2012-06", "2012-06")
+            {'2012-06-12': 1, '2012-06-21': 2}
+        """
+        return self.trophy_history.counts_by_day(start, end)
+
+    # ====== Searching ======
+
+    # search_accoms() filters -> (status flags mask, value)
+    SEARCH_FILTERS = {
+        "": (0, 0),
+        "accomplished": (status.ACCOMPLISHED, status.ACCOMPLISHED),
+        "locked": (status.LOCKED, status.LOCKED),
+        "opportunity": (status.LOCKED | status.ACCOMPLISHED, 0),
+    }
+
+    def search_accoms(self, query, limit=0, which=""):
+        """
+        Searches for accomplishments by words in their (translated) titles, keywords and categories. An accomplishment matches if it has a word starting with each of the words in **query**. Matches in titles rank best, then in keywords, then in categories.
+
+        Args:
+            * **query** - (str) the words to look for.
+            * **limit** - (int) the maximum number of results, 0 means no limit.
+            * **which** - (str) "accomplished", "locked" or "opportunity" (unlocked, but not accomplished) to return only accomplishments with this status, "" for all.
+
+        Returns:
+            * **list(str)** - accomplishmentIDs, the best matches first.
+
+        Example:
+            >>> acc.search_accoms("launchpad reg")
+            ["ubuntu-community/registered-on-launchpad"]
+            >>> acc.search_accoms("ask", 2, "opportunity")
+            ["ubuntu-community/askubuntu-1-answer", "ubuntu-community/askubuntu-1-question"]
+        """
+        if which not in self.SEARCH_FILTERS:
+            raise ValueError("Unknown search filter: %s" % which)
+        mask, value = self.SEARCH_FILTERS[which]
+        accept = None
+        if mask:
+            number = self.statuses.number
+            states = self.statuses.states
+            accept = lambda accomID: states[number[accomID]] & mask == value
+        return self.search_index.search(query, limit, accept)
+
+    def _index_accom(self, accomID):
+        self.search_index.add(accomID, self.get_accom_title(accomID),
+                              self.get_accom_keywords(accomID),
+                              self.get_accom_categories(accomID))
 
     # ====== Scriptrunner functions ======
 
     def run_script(self, accomID):
         if not self.get_accom_exists(accomID):
             return
-        self.run_scripts([accomID])
+        # Asked for explicitly, so the script is run however often it
+        # has not succeeded before
+        self.script_backoff.reset(accomID)
+        self.run_scripts([accomID], scheduler.INTERACTIVE)
+
+    def run_scripts(self, which=None, lane=None):
+        # Scripts are queued in **lane** (see scheduler.LANES). By default
+        # that is the sweep lane when running all scripts, and the
+        # interactive lane when running the scripts in the list **which**.
+        if lane is None:
+            if isinstance(which, list):
+                lane = scheduler.INTERACTIVE
+            else:
+                lane = scheduler.SWEEP
+
+        if self.startup_stage != "ready":
+            # The statuses may not be complete yet
+            log.msg("Daemon is starting up, scripts will be run later")
+            self.postponed_script_runs.append((which, lane))
+            return
 
-    def run_scripts(self, which=None):
         if isinstance(which, list):
             to_schedule = which
         elif which is None:
@@ -1527,15 +1955,25 @@ class Accomplishments(object):
             log.msg("Note: This call to run_scripts is incorrect, run_scripts takes (optionally) a list of accomID to run their scripts")
             to_schedule = self.list_unlocked_not_accomplished()
 
+        if lane == scheduler.SWEEP:
+            # Leave out the scripts that keep not succeeding, and have
+            # been run recently
+            now = time.time()
+            due = [accomID for accomID in to_schedule
+                   if self.script_backoff.is_due(accomID, now)]
+            if len(due) < len(to_schedule):
+                log.msg("Backing off from %d scripts" % (
+                    len(to_schedule) - len(due)))
+            to_schedule = due
+
         if len(to_schedule) == 0:
             log.msg("No scripts to run, returning without starting "
                     "scriptrunner")
             return
 
-        log.msg("Adding to scripts queue: %s " % (str(to_schedule)))
-        for i in to_schedule:
-            if not i in self.scripts_queue:
-                self.scripts_queue.append(i)
+        log.msg("Adding to scripts queue (%s): %s " % (
+            scheduler.LANE_NAMES[lane], str(to_schedule)))
+        self.scripts_queue.extend(to_schedule, lane)
         self.asyncapi.start_scriptrunner()
 
     # ====== Viewer-specific functions ======
@@ -1554,7 +1992,7 @@ class Accomplishments(object):
                 'collection-human': self.get_collection_name(
                 self.get_accom_collection(accom)),
                 'categories': self.get_accom_categories(accom),
-                'keywords': self.get_accom_keywords(accom),
+                'keywords': list(self.get_accom_keywords(accom)),
                 'id': accom
             })
         return db
@@ -1600,7 +2038,7 @@ class Accomplishments(object):
             self._display_unlocked_bubble(accomID)
             # Mark as accomplished and get list of new opportunities
             just_unlocked = self._mark_as_accomplished(accomID)
-            self.run_scripts(just_unlocked)
+            self.run_scripts(just_unlocked, scheduler.UNLOCKED)
 
         return True
 
@@ -1626,11 +2064,10 @@ class Accomplishments(object):
             # overwrite it anyway if there was a change in extrainformation
             # provided by the user. To recognise this situation, we'll
             # need to read this file.
-            cfg = ConfigParser.RawConfigParser()
-            cfg.read(trophypath)
+            trophydata = self.trophy_cache.get(trophypath) or {}
             if len(needsinfo) > 0:
                 for i in needsinfo:
-                    if not (cfg.get("trophy", i).strip() == self.get_extra_information(coll, i)[0][i].strip()):
+                    if not (trophydata.get(i, "").strip() == self.get_extra_information(coll, i)[0][i].strip()):
                         # At least one extrainformation has changed since this file was written.
                         # Therefore overwrite the file anyway.
                         overwrite = True
@@ -1663,6 +2100,11 @@ class Accomplishments(object):
         fp = open(trophypath, "w")
         cp.write(fp)
         fp.close()
+        # The file may have been rewritten within the same timestamp
+        # granularity, don't trust it's cached contents
+        self.trophy_cache.discard(trophypath)
+        self._journal("trophy-created", accomID,
+                      files=self._get_trophy_file_keys(accomID))
 
     def set_daemon_session_start(self, value):
         log.msg(value)
@@ -1778,121 +2220,305 @@ NoDisplay=true"
                 n.show()
 
     def accomslist(self):
-        for k in self.accomDB:
-            if self.accomDB[k]['type'] is "accomplishment":
-                yield k
-
-    def _get_is_asc_correct(self, filepath):
-        if not os.path.exists(filepath):
-            log.msg("Cannot check if signature is correct, because file"
-                    "%s does not exist" % filepath)
-            return False
-        elif not os.path.exists(filepath[:-4]):
-            log.msg("Cannot check if signature is correct, because file"
-                    "%s does not exist" % filepath[:-4])
-            return False
-        else:
-            # the .asc signed file exists, so let's verify that it is correctly
-            # signed by the Matrix
-            try:
-                trophysigned = open(filepath, "r")
-                trophy = open(filepath[:-4], "r")
-            except IOError, e:
-                log.msg("Cannot validate signature due to exception: %s" % e)
-                return False
-
-            c = gpgme.Context()
-
-            signed = StringIO(trophysigned.read())
-            plaintext = StringIO(trophy.read())
-            sig = c.verify(signed, None, plaintext)
-
-            if len(sig) != 1:
-                # No Sig
-                return False
-
-            if sig[0].status is not None:
-                # Bad Sig
-                return False
-            else:
-                # Correct!
-                # result = {'timestamp': sig[0].timestamp, 'signer':
-                # sig[0].fpr}
-                return True
-
-    def _check_if_accom_is_accomplished(self, accomID):
+        for k in self.accomDB.keys_of_type("accomplishment"):
+            yield k
+
+    def _find_trophy_signature(self, accomID, found=None):
+        # Returns (accomplished, ascpath). If whether the accomplishment
+        # is accomplished depends on the signature at ascpath being
+        # correct, accomplished is None; otherwise ascpath is None.
+        # **found** are the trophies found by trophies.scan_trophies(); if
+        # given, they are used instead of looking for the files again.
         trophypath = self.get_trophy_path(accomID)
-        if not os.path.exists(trophypath):
+        if found is not None:
+            files = found.get(accomID)
+            has_trophy = files is not None and files.trophy is not None
+            has_asc = files is not None and files.asc is not None
+        else:
+            has_trophy = os.path.exists(trophypath)
+            has_asc = None
+        if not has_trophy:
             # There is no trophy file
-            return False
+            return False, None
         if not self.get_accom_needs_signing(accomID):
             # The trophy does not need a signature
-            return True
+            return True, None
         else:
             # The trophy needs to be signed
             ascpath = trophypath + ".asc"
-            if not os.path.exists(ascpath):
-                return False
+            if has_asc is None:
+                has_asc = os.path.exists(ascpath)
+            if not has_asc:
+                return False, None
             else:
-                return self._get_is_asc_correct(ascpath)
+                return None, ascpath
+
+    def _verify_if_accom_is_accomplished(self, accomID):
+        # Returns a Deferred firing with whether the accomplishment is
+        # accomplished, as the signature is verified outside of the
+        # reactor thread.
+        accomplished, ascpath = self._find_trophy_signature(accomID)
+        if ascpath is None:
+            return defer.succeed(accomplished)
+        return self.verifier.verify(ascpath)
 
     def _check_if_accom_is_locked(self, accomID):
-        dep = self.get_accom_depends(accomID)
-        if not dep:
-            return False
-        else:
-            locked = False
-            for d in dep:
-                # If at least one dependency is not accomplished...
-                if not self.get_accom_is_accomplished(d):
-                    locked = True
-                    break
-            return locked
-
-    def _update_all_locked_and_accomplished_statuses(self):
-        accoms = self.list_accoms()
+        # Locked if at least one dependency is not accomplished, or if
+        # the dependencies are broken (see DependencyGraph)
+        return self.depgraph.is_locked(
+            accomID, self.get_accom_is_accomplished)
+
+    def _update_all_locked_and_accomplished_statuses(self, use_journal=False):
+        # Updates the statuses of all accomplishments. If **use_journal**
+        # is set and the journal matches the trophies that are there, the
+        # accomplished statuses recorded in it are used, instead of
+        # checking all trophies again.
+        accoms = self.depgraph.order
+        keys = self._check_accomplishments_keys()
+        found = trophies.scan_trophies(self.trophies_path,
+                                       self.list_collections())
+        files = self._get_all_trophy_file_keys(found)
+        if use_journal:
+            if self.journal.agrees_with(files, keys):
+                log.msg("Restoring accomplished statuses from the journal")
+                known = dict((accom, accom in self.journal.accomplished)
+                             for accom in accoms)
+                return self._update_locked_and_accomplished_statuses(
+                    accoms, accoms, found, known)
+            log.msg("The journal does not match the trophies, checking "
+                    "all of them")
+
+        self.journaling = False
+        d = self._update_locked_and_accomplished_statuses(
+            accoms, accoms, found)
+        d.addCallback(self._forget_lost_trophies)
+        d.addCallback(self._reset_journal, files, keys)
+        return d
+
+    def _forget_lost_trophies(self, result=None):
+        # Forget about trophies that are gone, or no longer count
+        self.trophy_cache.retain(
+            self.get_trophy_path(accom) for accom in self.list_trophies())
+        self._save_trophy_caches()
+        return result
+
+    def _reset_journal(self, result, files, keys):
+        # Replaces the journal's state with the one found by checking all
+        # trophies.
+        self.journal.reset(
+            dict((accom, self.get_accom_date_accomplished(accom))
+                 for accom in self.list_trophies()),
+            self.list_unlocked(), files, keys)
+        self.journaling = True
+        return result
+
+    def _check_accomplishments_keys(self):
+        # Signatures verified with keys that are gone or revoked by now
+        # have to be verified again
+        keys = trophies.get_accomplishments_keys(gpgme.Context())
+        self.signature_cache.set_keys(keys)
+        return keys
+
+    def _update_locked_and_accomplished_statuses(self, accoms, lockcheck,
+                                                 found=None, known=None):
+        # Updates the "accomplished" status (along with other status
+        # flags) of **accoms**, and then the "locked" status of
+        # **lockcheck**.
+        # **found** are the trophies found by trophies.scan_trophies(),
+        # if they are known already. **known** may map accomIDs to their
+        # accomplished statuses, if they are known already.
+        # Other signatures are verified by self.verifier; until they are,
+        # the accomplishments keep the status they had. Returns a Deferred
+        # that fires once all of them are verified and their statuses
+        # are updated.
+        available = self._get_available_extra_information()
+        if found is None:
+            self._check_accomplishments_keys()
+            # Look for trophies of all these accomplishments at once, this
+            # is a single pass over the trophy directories of their
+            # collections.
+            collections = sorted(set(
+                accom.split("/", 1)[0] for accom in accoms))
+            found = trophies.scan_trophies(self.trophies_path, collections)
+        # ascpath -> accomID of accomplishments waiting for verification
+        pending = {}
         for accom in accoms:
-            self.accomDB[accom][
-                'accomplished'] = self._check_if_accom_is_accomplished(accom)
-            if self.accomDB[accom]['accomplished'] == True:
-                self.accomDB[accom]['date-accomplished'] = self._get_trophy_date_accomplished(accom)
+            if known is not None:
+                accomplished, ascpath = known[accom], None
             else:
-                self.accomDB[accom]['date-accomplished'] = "None"
-        for accom in accoms:
-            self.accomDB[accom][
-                'locked'] = self._check_if_accom_is_locked(accom)
+                accomplished, ascpath = self._find_trophy_signature(
+                    accom, found)
+            if ascpath is not None:
+                pending[ascpath] = accom
+                accomplished = self.statuses.get(accom, status.ACCOMPLISHED)
+            if accomplished:
+                files = found.get(accom)
+                self._set_accomplished(
+                    accom, True, files.trophy if files else None)
+            else:
+                self._set_accomplished(accom, False)
+            self.statuses.set(accom, status.HAS_SCRIPT, os.path.exists(
+                self.accomDB[accom]['script-path']))
+            self.statuses.set(accom, status.EXTRAINFO_COMPLETE,
+                              available.issuperset(
+                                  self.get_accom_needs_info(accom)))
+        # If the reactor is not running, this has already fired, so the
+        # locked statuses below are based on the verified signatures.
+        d = self.verifier.verify_many(pending)
+        d.addCallback(self._apply_verified_signatures, pending, found)
+        for accom in lockcheck:
+            self._set_locked(accom, self._check_if_accom_is_locked(accom))
+        self._save_trophy_caches()
+        return d
+
+    def _apply_verified_signatures(self, results, pending, found):
+        # Updates the statuses of accomplishments whose signatures have
+        # been verified, as requested by
+        # _update_locked_and_accomplished_statuses.
+        for ascpath, correct in sorted(results.iteritems()):
+            accom = pending[ascpath]
+            if not self.get_accom_exists(accom):
+                continue
+            if correct:
+                self._journal("signature-verified", accom,
+                              files=self._get_trophy_file_keys(accom))
+            if correct == self.get_accom_is_accomplished(accom):
+                continue
+            if correct:
+                self._set_accomplished(accom, True, found[accom].trophy)
+            else:
+                self._set_accomplished(accom, False)
+            self._propagate_lock_statuses(accom)
+        self._save_trophy_caches()
 
-    # XXX - NEEDS UNIT TEST
-    def _get_trophy_date_accomplished(self, accomID):
+    def _journal(self, event, accomID=None, **data):
+        if self.journaling:
+            self.journal.record(event, accomID, **data)
+
+    def _get_trophy_file_keys(self, accomID):
+        # Returns the journal.file_key()s of the trophy and signature files
+        # of **accomID**, or None if there are none.
         trophypath = self.get_trophy_path(accomID)
-        if not os.path.exists(trophypath):
+        keys = []
+        for path in (trophypath, trophypath + ".asc"):
+            try:
+                keys.append(journal.file_key(os.stat(path)))
+            except OSError:
+                keys.append(None)
+        if keys == [None, None]:
+            return None
+        return keys
+
+    def _get_all_trophy_file_keys(self, found):
+        # Like _get_trophy_file_keys, for all trophies of installed
+        # accomplishments in **found**.
+        return dict((accom, [journal.file_key(files.trophy),
+                             journal.file_key(files.asc)])
+                    for accom, files in found.iteritems()
+                    if self.get_accom_exists(accom))
+
+    def _set_accomplished(self, accomID, accomplished, st=None):
+        # **st** may be the stat result of the trophy file, if it is
+        # already known
+        self.accomDB[accomID]['accomplished'] = accomplished
+        if accomplished:
+            self.accomDB[accomID]['date-accomplished'] = \
+                self._get_trophy_date_accomplished(accomID, st)
+        else:
+            self.accomDB[accomID]['date-accomplished'] = "None"
+        self.statuses.set(accomID, status.ACCOMPLISHED, accomplished)
+        self.trophy_history.add(
+            accomID, self.accomDB[accomID]['date-accomplished'])
+        if self.journaling and \
+                accomplished != (accomID in self.journal.accomplished):
+            if accomplished:
+                self._journal(
+                    "accomplished", accomID,
+                    date=self.accomDB[accomID]['date-accomplished'],
+                    files=self._get_trophy_file_keys(accomID))
+            else:
+                self._journal("unaccomplished", accomID,
+                              files=self._get_trophy_file_keys(accomID))
+
+    def _save_trophy_caches(self):
+        self.trophy_cache.save()
+        self.signature_cache.save()
+
+    def _set_locked(self, accomID, locked):
+        self.accomDB[accomID]['locked'] = locked
+        self.statuses.set(accomID, status.LOCKED, locked)
+        if locked == (accomID in self.journal.unlocked):
+            self._journal("locked" if locked else "unlocked", accomID)
+
+    def _get_available_extra_information(self):
+        # Returns a set of names of extra information items that the
+        # user has provided.
+        available = set()
+        extrainfodir = os.path.join(self.trophies_path, ".extrainformation")
+        try:
+            items = os.listdir(extrainfodir)
+        except OSError:
+            return available
+        for item in items:
+            try:
+                f = open(os.path.join(extrainfodir, item))
+                try:
+                    if f.read():
+                        available.add(item)
+                finally:
+                    f.close()
+            except IOError:
+                continue
+        return available
+
+    def _update_extra_information_statuses(self):
+        # Updates the EXTRAINFO_COMPLETE flag of all accomplishments,
+        # after extra information has been changed.
+        available = self._get_available_extra_information()
+        for accom in self.list_accoms():
+            self.statuses.set(accom, status.EXTRAINFO_COMPLETE,
+                              available.issuperset(
+                                  self.get_accom_needs_info(accom)))
+
+    def _list_affected_by(self, accomIDs):
+        # Returns a list of accomplishments whose "locked" status may
+        # have changed because **accomIDs** were added, removed or
+        # reloaded: those of them that still exist, and all accomplishments
+        # that depend on any of them.
+        affected = set()
+        for accomID in accomIDs:
+            if self.get_accom_exists(accomID):
+                affected.add(accomID)
+            affected.update(self.accomDB.dependents_of(accomID))
+        return sorted(affected)
+
+    # XXX - NEEDS UNIT TEST
+    def _get_trophy_date_accomplished(self, accomID, st=None):
+        trophydata = self.trophy_cache.get(self.get_trophy_path(accomID), st)
+        if trophydata is None:
             # There is no trophy file
             return False
-
-        config = ConfigParser.RawConfigParser()
-        cfile = trophypath
-        config.read(cfile)
-
-        if config.has_option("trophy", "date-accomplished"):
-            return config.get("trophy", "date-accomplished")
+        return trophydata.get("date-accomplished")
 
     # XXX - NEEDS UNIT TEST
     def _mark_as_accomplished(self, accomID):
         # Marks accomplishments as accomplished in the accomDB, and
         # returns a list of accomIDs that just got unlocked.
-        self.accomDB[accomID]['accomplished'] = True
-        self.accomDB[accomID][
-            'date-accomplished'] = self._get_trophy_date_accomplished(accomID)
-        accoms = self.list_depending_on(accomID)
-        res = []
-        for accom in accoms:
+        self._set_accomplished(accomID, True)
+        self._save_trophy_caches()
+        return self._propagate_lock_statuses(accomID)
+
+    def _propagate_lock_statuses(self, accomID):
+        # Updates the "locked" status of accomplishments directly
+        # depending on accomID, after it's "accomplished" status changed.
+        # Returns a list of accomIDs that just got unlocked.
+        unlocked = []
+        for accom in self.depgraph.dependents_of(accomID):
             before = self.accomDB[accom]['locked']
-            self.accomDB[accom][
-                'locked'] = self._check_if_accom_is_locked(accom)
-            # If it just got unlocked...
-            if (before == True and self.accomDB[accom]['locked'] == False):
-                res.append(accom)
-        return res
+            self._set_locked(accom, self._check_if_accom_is_locked(accom))
+            if before and not self.accomDB[accom]['locked']:
+                unlocked.append(accom)
+        return unlocked
 
     # Other significant system functions
 
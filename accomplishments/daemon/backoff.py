@@ -0,0 +1,163 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module keeps track of the outcomes of accomplishments' scripts, so
+that the scripts of accomplishments that keep not being accomplished, or
+keep failing, are run less and less often by the periodic sweep.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import json
+import os
+import time
+
+from twisted.python import log
+
+# bump this whenever the layout of the stored history changes
+BACKOFF_VERSION = 1
+
+# The outcomes of scripts, see ScriptBackoff.record
+ACCOMPLISHED = "accomplished"
+NOT_ACCOMPLISHED = "not-accomplished"
+ERROR = "error"
+
+# By default, a script that has not accomplished it's accomplishment is
+# not run by the sweep for an hour; this doubles with every further run
+# with the same result, up to a day.
+BACKOFF_BASE = 3600
+BACKOFF_MAX = 86400
+
+# Each error counts as this many unsuccessful runs, so that scripts that
+# keep failing back off faster.
+ERROR_WEIGHT = 2
+
+
+class ScriptBackoff(object):
+    """
+    The history of recent script outcomes of each accomplishment, and when
+    the sweep may run it's script again.
+
+    For each accomplishment whose script has not succeeded the last time
+    it ran, the number of unsuccessful runs since the last success is
+    counted, errors counting ERROR_WEIGHT times. After *n* of them, the
+    script is not run again for **base** * 2 ** (*n* - 1) seconds, or
+    **cap** seconds if that is shorter. A **base** of 0 turns the backoff
+    off.
+    """
+    def __init__(self, path=None, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+        # **path** is where the history is stored, None to keep it in
+        # memory only
+        self.path = path
+        self.base = base
+        self.cap = cap
+        # accomID -> {'failures': int, 'last': outcome, 'time': time of
+        # the last run}
+        self.entries = {}
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_delay(self, failures):
+        """
+        Returns the number of seconds a script is not run for after
+        **failures** unsuccessful runs.
+        """
+        if not self.base or failures <= 0:
+            return 0
+        # avoid computing huge powers, the cap is reached long before
+        exponent = min(failures - 1, 32)
+        return min(self.base * 2 ** exponent, self.cap)
+
+    def record(self, accomID, outcome, now=None):
+        """
+        Records that the script of **accomID** has ended with **outcome**
+        (ACCOMPLISHED, NOT_ACCOMPLISHED or ERROR).
+        """
+        if outcome == ACCOMPLISHED:
+            self.reset(accomID)
+            return
+        if now is None:
+            now = time.time()
+        entry = self.entries.get(accomID)
+        if entry is None:
+            entry = self.entries[accomID] = {'failures': 0}
+        if outcome == ERROR:
+            entry['failures'] += ERROR_WEIGHT
+        else:
+            entry['failures'] += 1
+        entry['last'] = outcome
+        entry['time'] = now
+        self.dirty = True
+
+    def is_due(self, accomID, now=None):
+        """
+        Tells whether the sweep may run the script of **accomID**.
+        """
+        entry = self.entries.get(accomID)
+        if entry is None or not self.base:
+            return True
+        if now is None:
+            now = time.time()
+        return now >= entry['time'] + self.get_delay(entry['failures'])
+
+    def reset(self, accomID):
+        """
+        Forgets the history of **accomID**, so that it's script is run by
+        the next sweep.
+        """
+        if self.entries.pop(accomID, None) is not None:
+            self.dirty = True
+
+    def clear(self):
+        self.entries.clear()
+        self.dirty = True
+
+    def load(self):
+        """
+        Loads the history stored by save(). Returns True if this
+        succeeded, or False if there is nothing usable stored.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            f = open(self.path)
+            try:
+                stored = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            log.msg("Could not load script backoff %s: %s" % (self.path, e))
+            return False
+        if not isinstance(stored, dict) or \
+                stored.get('version') != BACKOFF_VERSION:
+            log.msg("Ignoring script backoff of an unknown version.")
+            return False
+        self.entries = stored['entries']
+        self.dirty = False
+        return True
+
+    def save(self):
+        """
+        Stores the history in the cache directory, if it has changed since
+        it was loaded or last saved.
+        """
+        if not self.dirty or self.path is None:
+            return
+        tmppath = self.path + ".tmp"
+        try:
+            f = open(tmppath, "w")
+            try:
+                json.dump({'version': BACKOFF_VERSION,
+                           'entries': self.entries}, f, sort_keys=True)
+            finally:
+                f.close()
+            os.rename(tmppath, self.path)
+            self.dirty = False
+        except (IOError, OSError), e:
+            log.msg("Could not save script backoff %s: %s" % (self.path, e))
@@ -279,10 +279,24 @@ class AccomplishmentsDBusService(service.DBusExportService):
     def verify_ubuntu_one_account(self):
         return self.api.verify_ubuntu_one_account()
 
+    @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
+                         in_signature="", out_signature="a{sv}")
+    def get_startup_progress(self):
+        """
+        Tells how far the daemon got with starting up. The accomplishments database can be used right away, as it is loaded before the daemon is exported on D-Bus (if the database cached by the previous run can not be used, all collections are parsed at that point, before any calls are answered), but until the daemon is ready, accomplishments with signed trophies may not be shown as accomplished yet, and trophy icons may be missing. The `daemon_ready` signal is emitted once the startup is complete.
+
+        Returns:
+            * **(dict)** - `stage` (the current stage: `signatures`, `icons`, `share` or `ready`, which is also reached if one of the stages has failed), `completed` (the number of completed stages), `stages` (the number of all stages), `pending-signatures` (the number of signatures still to be verified) and `ready` (whether the startup is complete).
+        Example:
+            >>> obj.get_startup_progress()
+            {'stage': 'icons', 'completed': 1, 'stages': 3, 'pending-signatures': 0, 'ready': False}
+        """
+        return self.api.get_startup_progress()
+
     @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
                          in_signature="", out_signature="")
     def reload_accom_database(self):
-        return self.api.reload_accom_database()
+        self.api.reload_accom_database()
 
     @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
                          in_signature="s", out_signature="a{sv}")
@@ -718,6 +732,22 @@ class AccomplishmentsDBusService(service.DBusExportService):
 
         return self.api.get_collection_data(collection)
 
+    @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
+                         in_signature="s", out_signature="a{si}")
+    def get_collection_progress(self, collection):
+        """
+        Returns how many accomplishments a collection has, and how many of them have been accomplished or are unlocked.
+
+        Args:
+            * **collection** - (str) the collection name (e.g. `ubuntu-community`).
+        Returns:
+            * **(dict)** - the `total` number of accomplishments in this collection, and the numbers of `accomplished` and `unlocked` (but not yet accomplished) ones.
+        Example:
+            >>> obj.get_collection_progress("ubuntu-community")
+            {"total" : 52, "accomplished" : 12, "unlocked" : 21}
+        """
+        return self.api.get_collection_progress(collection)
+
     @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
                          in_signature="", out_signature="as")
     def list_accoms(self):
@@ -832,6 +862,90 @@ class AccomplishmentsDBusService(service.DBusExportService):
 
         return self.api.list_collections()
 
+    @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
+                         in_signature="ss", out_signature="as")
+    def list_trophies_between(self, start, end):
+        """
+        Lists trophies accomplished between two dates.
+
+        Args:
+            * **start** - (str) the first date, e.g. `2012-06-01` or `2012-06-01 12:30`; an empty string for no limit.
+            * **end** - (str) the last date, in the same form, which is included as a whole (`2012-06-30` includes all of that day, `2012-06` all of June); an empty string for no limit.
+        Returns:
+            * **(list)** - the accomplishment IDs of the trophies, the oldest first.
+        Example:
+            >>> obj.list_trophies_between("2012-06-01", "2012-06-30")
+            ["ubuntu-community/registered-on-launchpad", "ubuntu-community/signed-code-of-conduct"]
+        """
+        return self.api.list_trophies_between(start, end)
+
+    @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
+                         in_signature="i", out_signature="as")
+    def list_recent_trophies(self, n):
+        """
+        Lists the **n** most recently accomplished trophies.
+
+        Args:
+            * **n** - (int) how many trophies to list.
+        Returns:
+            * **(list)** - the accomplishment IDs of the trophies, the newest first.
+        Example:
+            >>> obj.list_recent_trophies(1)
+            ["ubuntu-community/signed-code-of-conduct"]
+        """
+        return self.api.list_recent_trophies(n)
+
+    @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
+                         in_signature="ss", out_signature="a{si}")
+    def get_trophy_counts_by_day(self, start, end):
+        """
+        Counts trophies accomplished on each day between two dates.
+
+        Args:
+            * **start**, **end** - (str) the first and the last date, as for list_trophies_between.
+        Returns:
+            * **(dict)** - the numbers of trophies accomplished, by day (`YYYY-MM-DD`). Days without trophies are left out.
+        Example:
+            >>> obj.get_trophy_counts_by_day("2012-06", "2012-06")
+            {'2012-06-12': 1, '2012-06-21': 2}
+        """
+        return self.api.get_trophy_counts_by_day(start, end)
+
+    @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
+                         in_signature="si", out_signature="as")
+    def search_accoms(self, query, limit):
+        """
+        Searches for accomplishments by words in their titles, keywords and categories. Words in the query may be incomplete (e.g. `launch` matches `Launchpad`).
+
+        Args:
+            * **query** - (str) the words to look for.
+            * **limit** - (int) the maximum number of results, 0 for no limit.
+        Returns:
+            * **(list)** - the accomplishment IDs of matching accomplishments, the best matches first.
+        Example:
+            >>> obj.search_accoms("launchpad reg", 10)
+            ["ubuntu-community/registered-on-launchpad"]
+        """
+        return self.api.search_accoms(query, limit)
+
+    @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
+                         in_signature="sis", out_signature="as")
+    def search_accoms_with_status(self, query, limit, which):
+        """
+        Works like search_accoms, but returns only accomplishments with the given status.
+
+        Args:
+            * **query** - (str) the words to look for.
+            * **limit** - (int) the maximum number of results, 0 for no limit.
+            * **which** - (str) `accomplished`, `locked` or `opportunity` (unlocked, but not yet accomplished).
+        Returns:
+            * **(list)** - the accomplishment IDs of matching accomplishments, the best matches first.
+        Example:
+            >>> obj.search_accoms_with_status("ask", 10, "opportunity")
+            ["ubuntu-community/askubuntu-1-answer", "ubuntu-community/askubuntu-1-question"]
+        """
+        return self.api.search_accoms(query, limit, which)
+
     @dbus.service.method(dbus_interface='org.ubuntu.accomplishments',
                          in_signature="", out_signature="aa{sv}")
     def build_viewer_database(self):
@@ -934,5 +1048,19 @@ class AccomplishmentsDBusService(service.DBusExportService):
         pass
 
     @dbus.service.signal(dbus_interface='org.ubuntu.accomplishments')
-    def accoms_collections_reloaded(self):
+    def daemon_ready(self):
+        """
+        Emitted once the daemon has completed starting up: all signatures have been verified and all trophy icons are in place. See get_startup_progress.
+        """
         pass
+
+    @dbus.service.signal(dbus_interface='org.ubuntu.accomplishments',
+                         signature="as")
+    def accoms_collections_reloaded(self, collections):
+        """
+        Emitted when the accomplishments database has been reloaded.
+
+        Args:
+            * **collections** - (list) the names of collections that were added, removed or modified; clients only need to refresh these.
+        """
+        return collections
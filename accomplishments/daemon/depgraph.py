@@ -0,0 +1,166 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module provides the graph of dependencies between installed
+accomplishments, which is used to tell which of them are locked.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+from collections import deque
+
+from twisted.python import log
+
+
+class DependencyGraph(object):
+    """
+    The dependencies between all accomplishments of an *accomDB*.
+
+    When it is built, the graph is checked for problems:
+
+    * **cycles** - a list of sorted lists of accomIDs that (directly or
+      not) depend on each other, so none of them could ever be unlocked
+      in the regular way. All of these accomplishments are *quarantined*,
+      which means they are always considered to be locked.
+    * **dangling** - a dict mapping accomIDs to a tuple of their
+      dependencies that are not installed. Such dependencies can never
+      be accomplished, so these accomplishments stay locked.
+
+    The accomplishment's "locked" status depends on the "accomplished"
+    status of it's direct dependencies only. So, when an accomplishment
+    gets accomplished (or stops being accomplished), only it's direct
+    dependents (see dependents_of) need to be checked again.
+    """
+    def __init__(self, accomdb):
+        self.accomdb = accomdb
+        accoms = accomdb.keys_of_type("accomplishment")
+        self.installed = frozenset(accoms)
+
+        # accomID -> tuple of it's installed dependencies
+        self.depends = {}
+        self.dangling = {}
+        for accom in accoms:
+            deps = []
+            missing = []
+            for dep in accomdb[accom].parsed_depends:
+                if not dep or dep in deps or dep in missing:
+                    # "depends=" with nothing, or a duplicate
+                    continue
+                if dep in self.installed:
+                    deps.append(dep)
+                else:
+                    missing.append(dep)
+            self.depends[accom] = tuple(deps)
+            if missing:
+                self.dangling[accom] = tuple(missing)
+
+        self.cycles = self._find_cycles(accoms)
+        self.quarantined = frozenset(
+            accom for cycle in self.cycles for accom in cycle)
+        self.order = self._sort_topologically(accoms)
+
+        for accom, missing in sorted(self.dangling.iteritems()):
+            log.msg("%s depends on %s, which is not installed. It will stay "
+                    "locked." % (accom, ", ".join(missing)))
+        for cycle in self.cycles:
+            log.msg("Accomplishments %s depend on each other. They will "
+                    "stay locked." % ", ".join(cycle))
+
+    def dependents_of(self, accomID):
+        """
+        Returns a sorted list of accomIDs of installed accomplishments
+        that directly depend on **accomID**.
+        """
+        return self.accomdb.dependents_of(accomID)
+
+    def is_locked(self, accomID, is_accomplished):
+        """
+        Tells whether **accomID** is locked, given **is_accomplished**,
+        a function that tells whether an installed accomplishment has been
+        accomplished.
+        """
+        if accomID in self.quarantined or accomID in self.dangling:
+            return True
+        for dep in self.depends[accomID]:
+            if not is_accomplished(dep):
+                return True
+        return False
+
+    def _sort_topologically(self, accoms):
+        # Kahn's algorithm: returns all accomplishments, each one after
+        # all of it's dependencies. Those that depend on a cycle cannot be
+        # sorted, they go last.
+        waiting = {}
+        ready = deque()
+        for accom in accoms:
+            if self.depends[accom]:
+                waiting[accom] = len(self.depends[accom])
+            else:
+                ready.append(accom)
+
+        order = []
+        while ready:
+            accom = ready.popleft()
+            order.append(accom)
+            for dependent in self.dependents_of(accom):
+                if dependent not in waiting:
+                    continue
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    del waiting[dependent]
+                    ready.append(dependent)
+
+        order.extend(sorted(waiting))
+        return order
+
+    def _find_cycles(self, accoms):
+        # Tarjan's strongly connected components algorithm, without
+        # recursion, so that long chains of dependencies cannot hit the
+        # recursion limit.
+        index = {}
+        lowlink = {}
+        stack = []
+        onstack = set()
+        cycles = []
+
+        for root in accoms:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            onstack.add(root)
+            work = [(root, iter(self.depends[root]))]
+            while work:
+                node, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        index[dep] = lowlink[dep] = len(index)
+                        stack.append(dep)
+                        onstack.add(dep)
+                        work.append((dep, iter(self.depends[dep])))
+                        break
+                    elif dep in onstack:
+                        lowlink[node] = min(lowlink[node], index[dep])
+                else:
+                    # all dependencies of node have been visited
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            accom = stack.pop()
+                            onstack.discard(accom)
+                            component.append(accom)
+                            if accom == node:
+                                break
+                        if len(component) > 1 or node in self.depends[node]:
+                            cycles.append(sorted(component))
+
+        cycles.sort()
+        return cycles
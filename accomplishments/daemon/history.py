@@ -0,0 +1,103 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module provides an index of earned trophies ordered by the date
+they were accomplished.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import bisect
+
+# Sorts after any character that may follow a date in a date string, so
+# that "2012-06-30" + _END matches all of June 30th.
+_END = u"\uffff"
+
+
+class TrophyHistory(object):
+    """
+    The dates trophies were accomplished on, kept in order.
+
+    Dates are strings in the "YYYY-MM-DD HH:MM" form used by .trophy
+    files, so they sort in the order of time. Trophies without a date are
+    not included.
+    """
+    def __init__(self):
+        # sorted list of (date, accomID)
+        self.entries = []
+        # accomID -> date
+        self.dates = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, accomID, date):
+        """
+        Records that **accomID** was accomplished on **date**, replacing
+        whatever date it had before.
+        """
+        if not isinstance(date, basestring) or not date or date == "None":
+            self.remove(accomID)
+            return
+        if self.dates.get(accomID) == date:
+            return
+        self.remove(accomID)
+        bisect.insort(self.entries, (date, accomID))
+        self.dates[accomID] = date
+
+    def remove(self, accomID):
+        date = self.dates.pop(accomID, None)
+        if date is not None:
+            i = bisect.bisect_left(self.entries, (date, accomID))
+            del self.entries[i]
+
+    def clear(self):
+        del self.entries[:]
+        self.dates.clear()
+
+    def _slice(self, start, end):
+        # The range of entries between **start** and **end** (both
+        # included, see between())
+        i = bisect.bisect_left(self.entries, (start,)) if start else 0
+        if end:
+            j = bisect.bisect_left(self.entries, (end + _END,))
+        else:
+            j = len(self.entries)
+        return i, j
+
+    def between(self, start, end):
+        """
+        Returns a list of accomIDs of trophies accomplished between
+        **start** and **end**, the oldest first. Both are dates, or the
+        beginnings of dates (e.g. "2012-06" or "2012-06-30"), and both are
+        included: an **end** of "2012-06-30" includes all of that day. An
+        empty string means no limit.
+        """
+        i, j = self._slice(start, end)
+        return [accomID for date, accomID in self.entries[i:j]]
+
+    def recent(self, n):
+        """
+        Returns a list of accomIDs of the **n** most recently accomplished
+        trophies, the newest first.
+        """
+        if n <= 0:
+            return []
+        return [accomID for date, accomID in reversed(self.entries[-n:])]
+
+    def counts_by_day(self, start, end):
+        """
+        Returns a dict mapping days ("YYYY-MM-DD") between **start** and
+        **end** (see between()) to the number of trophies accomplished on
+        them. Days without trophies are left out.
+        """
+        i, j = self._slice(start, end)
+        counts = {}
+        for date, accomID in self.entries[i:j]:
+            day = date[:10]
+            counts[day] = counts.get(day, 0) + 1
+        return counts
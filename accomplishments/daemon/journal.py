@@ -0,0 +1,246 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module provides the journal of accomplishments' status changes,
+which lets the daemon restore their statuses when it starts, without
+checking all trophies again.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import json
+import os
+import time
+
+from twisted.python import log
+
+# bump this whenever the layout of the checkpoint changes
+JOURNAL_VERSION = 1
+
+# The journal is compacted into a checkpoint once it has this many
+# records.
+COMPACT_EVERY = 500
+
+# Kinds of records, see Journal.record
+EVENTS = frozenset((
+    "accomplished", "unaccomplished", "unlocked", "locked",
+    "signature-verified", "trophy-received", "trophy-created",
+    "extra-information-changed",
+))
+
+
+def file_key(st):
+    """
+    Returns what the journal remembers about a file, given it's stat
+    result **st** (or None if there is no such file).
+    """
+    if st is None:
+        return None
+    return [st.st_ino, st.st_mtime, st.st_size]
+
+
+class Journal(object):
+    """
+    An append-only log of status changes of accomplishments, stored as
+    one JSON object per line. Each record has a sequence number, a
+    timestamp, the kind of *event* and the accomplishment it concerns.
+
+    The state the records lead to is kept in memory:
+
+    * **accomplished** - accomID -> date accomplished
+    * **unlocked** - set of accomIDs
+    * **files** - accomID -> [trophy, signature]: the file_key() of the
+      trophy's .trophy and .asc files, as last seen by the daemon.
+    * **keys** - the accomplishments keys trophies were verified with,
+      see trophies.get_accomplishments_keys.
+
+    From time to time the state is written to a checkpoint, and the
+    journal is started anew.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint"
+        self.seq = 0
+        # the number of records since the last checkpoint
+        self.records = 0
+        # whether there was any state to load
+        self.loaded = False
+        self._clear_state()
+
+    def _clear_state(self):
+        self.accomplished = {}
+        self.unlocked = set()
+        self.files = {}
+        self.keys = None
+
+    def load(self):
+        """
+        Restores the state from the checkpoint and the records written
+        after it. Returns True if there was anything to restore.
+        """
+        self._clear_state()
+        self.seq = 0
+        self.records = 0
+        self.loaded = False
+        try:
+            f = open(self.checkpoint_path)
+            try:
+                checkpoint = json.load(f)
+            finally:
+                f.close()
+        except IOError:
+            checkpoint = None
+        except ValueError, e:
+            log.msg("Ignoring damaged journal checkpoint %s: %s" % (
+                self.checkpoint_path, e))
+            checkpoint = None
+        if checkpoint is not None:
+            if checkpoint.get('version') != JOURNAL_VERSION:
+                log.msg("Ignoring journal checkpoint of an unknown version.")
+                # the records that follow it cannot be used either
+                return False
+            self.seq = checkpoint['seq']
+            self.accomplished = checkpoint['accomplished']
+            self.unlocked = set(checkpoint['unlocked'])
+            self.files = checkpoint['files']
+            self.keys = checkpoint['keys']
+            self.loaded = True
+
+        try:
+            f = open(self.path, "r+")
+        except IOError:
+            return self.loaded
+        try:
+            offset = 0
+            for line in iter(f.readline, ""):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record cut short by a crash, it must be the last
+                    # one. Cut it off, so that new records are not
+                    # appended to it.
+                    log.msg("Dropping incomplete journal record.")
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                if record['seq'] <= self.seq:
+                    # already included in the checkpoint
+                    continue
+                self._apply(record)
+                self.seq = record['seq']
+                self.records += 1
+                self.loaded = True
+        finally:
+            f.close()
+        return self.loaded
+
+    def record(self, event, accomID=None, **data):
+        """
+        Appends a record of **event** concerning **accomID** to the
+        journal, and updates the state accordingly. Records may carry
+        more data:
+
+        * **date** - the date accomplished, for "accomplished" records.
+        * **files** - the new [trophy, signature] file keys.
+        * **item** - the extra information item that has changed.
+        """
+        assert event in EVENTS, event
+        self.seq += 1
+        record = dict(data, seq=self.seq, time=time.time(), event=event)
+        if accomID is not None:
+            record['accom'] = accomID
+        self._apply(record)
+        try:
+            f = open(self.path, "a")
+            try:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+            finally:
+                f.close()
+        except IOError, e:
+            log.msg("Could not write to journal %s: %s" % (self.path, e))
+        self.records += 1
+        if self.records >= COMPACT_EVERY:
+            self.checkpoint()
+
+    def _apply(self, record):
+        event = record['event']
+        accomID = record.get('accom')
+        if event == "accomplished":
+            self.accomplished[accomID] = record.get('date')
+        elif event == "unaccomplished":
+            self.accomplished.pop(accomID, None)
+        elif event == "unlocked":
+            self.unlocked.add(accomID)
+        elif event == "locked":
+            self.unlocked.discard(accomID)
+        if 'files' in record:
+            if record['files'] is None:
+                self.files.pop(accomID, None)
+            else:
+                self.files[accomID] = record['files']
+
+    def reset(self, accomplished, unlocked, files, keys):
+        """
+        Replaces the whole state, e.g. after all trophies have been
+        checked again, and writes a checkpoint of it.
+        """
+        self.accomplished = dict(accomplished)
+        self.unlocked = set(unlocked)
+        self.files = dict(files)
+        self.keys = keys
+        self.loaded = True
+        self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Writes the current state to the checkpoint, and empties the
+        journal.
+        """
+        checkpoint = {
+            'version': JOURNAL_VERSION,
+            'seq': self.seq,
+            'accomplished': self.accomplished,
+            'unlocked': sorted(self.unlocked),
+            'files': self.files,
+            'keys': self.keys,
+        }
+        tmppath = self.checkpoint_path + ".tmp"
+        try:
+            f = open(tmppath, "w")
+            try:
+                json.dump(checkpoint, f, sort_keys=True)
+            finally:
+                f.close()
+            os.rename(tmppath, self.checkpoint_path)
+            # Records up to self.seq are in the checkpoint now. Should
+            # the daemon crash before the journal is emptied, they are
+            # skipped when loading.
+            open(self.path, "w").close()
+            self.records = 0
+        except (IOError, OSError), e:
+            log.msg("Could not write journal checkpoint %s: %s" % (
+                self.checkpoint_path, e))
+
+    def agrees_with(self, files, keys):
+        """
+        Tells whether the state of the journal can be trusted, given the
+        **files** of all trophies in the trophies directory (accomID ->
+        [trophy, signature], see file_key) and the current accomplishments
+        **keys**. If any trophy has been added, removed or changed behind
+        the daemon's back, or the keys have changed, it can not.
+        """
+        if not self.loaded:
+            return False
+        # JSON has no tuples
+        return self.files == files and \
+            _to_lists(self.keys) == _to_lists(keys)
+
+
+def _to_lists(value):
+    if isinstance(value, (list, tuple)):
+        return [_to_lists(item) for item in value]
+    return value
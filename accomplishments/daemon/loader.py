@@ -0,0 +1,565 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module parses installed accomplishments collections into the entries
+that make up the daemon's *accomDB*.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import ConfigParser
+import multiprocessing
+import os
+from collections import OrderedDict
+
+from twisted.python import log
+
+from accomplishments.daemon import accomdb
+
+# Loading fewer collections than this is not worth starting a pool of
+# worker processes for.
+PARALLEL_MIN_COLLECTIONS = 4
+
+# Long texts that are only needed to show the details of a single
+# accomplishment. When loading lazily, these are left out of the accomDB
+# and read from the .accomplishment file when they are asked for.
+LAZY_TEXT_FIELDS = ('description', 'summary', 'help', 'steps', 'links',
+                    'pitfalls', 'tips')
+
+# How many accomplishments' lazily loaded texts are kept in memory.
+TEXT_FIELD_CACHE_SIZE = 100
+
+# Messages to log while parsing in a worker process of
+# parse_collections(). They are passed back to the daemon, which logs
+# them; workers do not write to the daemon's log themselves. None
+# outside of worker processes.
+_worker_messages = None
+
+
+def _log(message):
+    if _worker_messages is not None:
+        _worker_messages.append(message)
+    else:
+        log.msg(message)
+
+
+def parse_accomplishment_file(path):
+    """
+    Reads the [accomplishment] section of an .accomplishment file in a
+    single pass.
+
+    This accepts exactly the syntax ConfigParser.RawConfigParser does
+    (comments, continuation lines, "key: value" and "key = value" pairs,
+    inline "; comments"), but does not bother with interpolation or
+    keeping any sections other than the one we need.
+
+    Args:
+        * **path** - (str) the path to the .accomplishment file.
+
+    Returns:
+        * **dict(str:str)** - all keys of the [accomplishment] section. Values that span several lines are joined with newlines, just like ConfigParser does.
+
+    Raises:
+        * **ConfigParser.ParsingError** - if the file is malformed or has no [accomplishment] section.
+    """
+    f = open(path)
+    try:
+        lines = f.readlines()
+    finally:
+        f.close()
+
+    sections = {}
+    cursect = None
+    optname = None
+    error = None
+    for lineno, line in enumerate(lines):
+        if line.strip() == '' or line[0] in '#;':
+            # blank line or comment
+            continue
+        if line[0] in 'rR' and line.split(None, 1)[0].lower() == 'rem':
+            # yes, ConfigParser also accepts "rem" comments
+            continue
+
+        if line[0].isspace() and cursect is not None and optname:
+            # continuation line
+            value = line.strip()
+            if value:
+                cursect[optname].append(value)
+            continue
+
+        if line[0] == '[':
+            end = line.find(']', 1)
+            if end > 1:
+                cursect = sections.setdefault(line[1:end], {})
+                optname = None
+                continue
+
+        if cursect is None:
+            raise ConfigParser.MissingSectionHeaderError(
+                path, lineno + 1, line)
+
+        # key = value, or key: value - whichever comes first
+        pos = line.find('=')
+        colon = line.find(':')
+        if colon != -1 and (pos == -1 or colon < pos):
+            pos = colon
+        if pos > 0 and not line[0].isspace():
+            optname = line[:pos].rstrip().lower()
+            value = line[pos + 1:]
+            if value[-1:] == '\n':
+                value = value[:-1]
+            value = value.lstrip()
+            if ';' in value:
+                cpos = value.find(';')
+                if value[cpos - 1].isspace():
+                    value = value[:cpos]
+            value = value.strip()
+            if value == '""':
+                value = ''
+            cursect[optname] = [value]
+        else:
+            if error is None:
+                error = ConfigParser.ParsingError(path)
+            error.append(lineno + 1, repr(line))
+
+    if error is not None:
+        raise error
+
+    if 'accomplishment' not in sections:
+        error = ConfigParser.ParsingError(path)
+        error.message = "File contains no section: 'accomplishment'"
+        raise error
+
+    accomdata = {}
+    for optname, value in sections['accomplishment'].iteritems():
+        accomdata[optname] = '\n'.join(value)
+    return accomdata
+
+
+class TranslationIndex(object):
+    """
+    Knows which .accomplishment files of a collection are available in the
+    user's language. Each language directory is listed just once, so
+    that finding the file to read does not need to check whether a
+    translation exists for every single accomplishment.
+    """
+    def __init__(self, collpath, lang, langdefault):
+        self.collpath = collpath
+        self.langdefault = langdefault
+        # First the full language code (e.g. pt_BR), then the shorter one
+        # (e.g. pt).
+        self.langs = []
+        for l in (lang, lang.split("_")[0]):
+            if l not in [x[0] for x in self.langs]:
+                self.langs.append(
+                    (l, self._list_files(os.path.join(collpath, l))))
+
+    @staticmethod
+    def _list_files(langpath):
+        # Returns a set of paths to all .accomplishment files in this
+        # language directory, relative to it.
+        files = set()
+        try:
+            entries = os.listdir(langpath)
+        except OSError:
+            # This language is not available at all
+            return files
+        for entry in entries:
+            if entry[-15:] == '.accomplishment':
+                files.add(entry)
+            else:
+                # this is a set
+                try:
+                    setentries = os.listdir(os.path.join(langpath, entry))
+                except OSError:
+                    continue
+                for accomfile in setentries:
+                    files.add(os.path.join(entry, accomfile))
+        return files
+
+    def resolve(self, relpath):
+        """
+        Returns a (path, lang) tuple of the file that should be read for
+        the .accomplishment file **relpath** (relative to the default
+        language directory), along with the language it is written in.
+        """
+        for l, files in self.langs:
+            if relpath in files:
+                return os.path.join(self.collpath, l, relpath), l
+        # no translation, fallback to the default one
+        return (os.path.join(self.collpath, self.langdefault, relpath),
+                self.langdefault)
+
+
+class TextFieldCache(object):
+    """
+    A bounded cache of the LAZY_TEXT_FIELDS of accomplishments that were
+    loaded lazily. Once it holds **size** accomplishments, the least
+    recently used one is dropped.
+    """
+    def __init__(self, size=TEXT_FIELD_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, accomID, path):
+        """
+        Returns a dict of the text fields of accomplishment **accomID**,
+        reading them from the .accomplishment file at **path** if they
+        are not cached.
+        """
+        try:
+            fields = self.entries.pop(accomID)
+        except KeyError:
+            fields = load_text_fields(path)
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+        # (re)insert as the most recently used one
+        self.entries[accomID] = fields
+        return fields
+
+    def clear(self):
+        self.entries.clear()
+
+
+def load_text_fields(path):
+    """
+    Reads the LAZY_TEXT_FIELDS of the .accomplishment file at **path**.
+    Returns an empty dict if the file cannot be read anymore.
+    """
+    try:
+        accomdata = parse_accomplishment_file(path)
+    except (EnvironmentError, ConfigParser.Error), e:
+        log.msg("Could not load texts from %s: %s" % (path, e))
+        return {}
+    fields = {}
+    for field in LAZY_TEXT_FIELDS:
+        if field in accomdata:
+            fields[field] = accomdata[field]
+    return fields
+
+
+def parse_collection(installpath, collection, lang, lazy=False):
+    """
+    Parses a single accomplishments collection, installed in
+    *<installpath>/accomplishments/<collection>*. If a translated
+    .accomplishment file is available for **lang**, its contents are used
+    instead of the default one.
+
+    Args:
+        * **installpath** - (str) the install path the collection was found in.
+        * **collection** - (str) the name of the collection.
+        * **lang** - (str) the language to load translations for (e.g. pt_BR).
+        * **lazy** - (bool) if True, LAZY_TEXT_FIELDS are left out of the accomplishments' entries. The path of the file they can be read from is stored in their "file-path" field instead.
+
+    Returns:
+        * **dict** - all accomDB entries belonging to this collection: the collection itself, its sets and its accomplishments.
+    """
+    entries = {}
+
+    collpath = os.path.join(installpath, 'accomplishments', collection)
+    aboutpath = os.path.join(collpath, 'ABOUT')
+
+    # Load data from ABOUT file
+    cfg = ConfigParser.RawConfigParser()
+    cfg.read(aboutpath)
+
+    if not (cfg.has_option("general", "langdefault") and cfg.has_option("general", "name")):
+        _log("Invalid ABOUT file: %s" % aboutpath)
+        raise LookupError(
+            "Accomplishment collection with invalid ABOUT file ")
+
+    langdefault = cfg.get("general", "langdefault")
+    collectionname = cfg.get("general", "name")
+
+    collauthors = set()
+    collcategories = {}
+
+    # Find out which translations are available for this collection
+    translations = TranslationIndex(collpath, lang, langdefault)
+
+    langdefaultpath = os.path.join(collpath, langdefault)
+    setsslist = os.listdir(langdefaultpath)
+    accno = 0
+    for accomset in setsslist:
+        if accomset[-15:] == '.accomplishment':
+            # this is an ungroped accomplishment file
+            readpath, langused = translations.resolve(accomset)
+
+            # do the parse
+            try:
+                accomdata = parse_accomplishment_file(readpath)
+            except ConfigParser.ParsingError, e:
+                _log("Parse error for %s.  Skipping."
+                        "Parse error is: %s" % (readpath, e.message))
+                continue
+            except EnvironmentError, e:
+                _log("Could not read %s.  Skipping: %s" % (readpath, e))
+                continue
+
+            accomID = collection + "/" + accomset[:-15]
+            if 'author' in accomdata:
+                collauthors.add(accomdata['author'])
+            accomdata['set'] = ""
+            accomdata['collection'] = collection
+            accomdata['type'] = "accomplishment"
+            accomdata['lang'] = langused
+            accomdata['base-path'] = collpath
+            accomdata['script-path'] = os.path.join(installpath, os.path.join('scripts', os.path.join(collection, accomset[:-15] + ".py")))
+            if 'category' in accomdata:
+                cats = accomdata['category'].split(",")
+                categories = []
+                accomdata['categories'] = []
+                for cat in cats:
+                    catsplitted = cat.rstrip().lstrip().split(":")
+                    accomdata['categories'].append(
+                        cat.rstrip().lstrip())
+                    if catsplitted[0] in collcategories:
+                        pass
+                    else:
+                        collcategories[catsplitted[0]] = []
+                    if len(catsplitted) > 1:
+                        # category + subcategory
+                        if catsplitted[1] not in collcategories[catsplitted[0]]:
+                            collcategories[catsplitted[
+                                0]].append(catsplitted[1])
+                del accomdata['category']
+            else:
+                accomdata['categories'] = []
+            if lazy:
+                _drop_text_fields(accomdata, readpath)
+            entries[accomID] = accomdb.AccomRecord(accomdata)
+            accno = accno + 1
+        else:
+            # this is indeed a set!
+            setID = collection + ":" + accomset
+            setdata = {'type': "set", 'name': accomset}
+            entries[setID] = setdata
+            setdir = os.path.join(langdefaultpath, accomset)
+            accomfiles = os.listdir(setdir)
+            for accomfile in accomfiles:
+                # For each accomplishment in this set...
+                readpath, langused = translations.resolve(
+                    os.path.join(accomset, accomfile))
+
+                # do the parse
+                try:
+                    accomdata = parse_accomplishment_file(readpath)
+                except ConfigParser.ParsingError, e:
+                    _log("Parse error for %s.  Skipping."
+                            "Parse error is: %s" % (readpath, e.message))
+                    continue
+                except EnvironmentError, e:
+                    _log("Could not read %s.  Skipping: %s" % (readpath, e))
+                    continue
+
+                accomID = collection + "/" + accomfile[:-15]
+                if 'author' in accomdata:
+                    collauthors.add(accomdata['author'])
+                accomdata['type'] = "accomplishment"
+                accomdata['set'] = accomset
+                accomdata['collection'] = collection
+                accomdata['lang'] = langused
+                accomdata['base-path'] = collpath
+                accomdata['script-path'] = os.path.join(installpath, os.path.join('scripts', os.path.join(collection, os.path.join(accomset, accomfile[:-15] + ".py"))))
+                if 'category' in accomdata:
+                    cats = accomdata['category'].split(",")
+                    categories = []
+                    accomdata['categories'] = []
+                    for cat in cats:
+                        catsplitted = cat.rstrip(
+                        ).lstrip().split(":")
+                        accomdata['categories'].append(
+                            cat.rstrip().lstrip())
+                        if catsplitted[0] in collcategories:
+                            pass
+                        else:
+                            collcategories[catsplitted[0]] = []
+                        if len(catsplitted) > 1:
+                            # category + subcategory
+                            if catsplitted[1] not in collcategories[catsplitted[0]]:
+                                collcategories[catsplitted[
+                                    0]].append(catsplitted[1])
+                    del accomdata['category']
+                else:
+                    accomdata['categories'] = []
+                if lazy:
+                    _drop_text_fields(accomdata, readpath)
+                entries[accomID] = accomdb.AccomRecord(accomdata)
+                accno = accno + 1
+
+    # Look for extrainformation dir
+    extrainfodir = os.path.join(collpath, "extrainformation")
+    extrainfolist = os.listdir(extrainfodir)
+    extrainfo = {}
+    for extrainfofile in extrainfolist:
+        extrainfopath = os.path.join(extrainfodir, extrainfofile)
+        eicfg = ConfigParser.RawConfigParser()
+        eicfg.read(extrainfopath)
+
+        if eicfg.has_option("label", lang):
+            label = eicfg.get("label", lang)
+        elif eicfg.has_option("label", lang.split("_")[0]):
+            label = eicfg.get("label", lang.split("_")[0])
+        else:
+            label = eicfg.get("label", langdefault)
+
+        if eicfg.has_option("description", lang):
+            description = eicfg.get("description", lang)
+        elif eicfg.has_option("description", lang.split("_")[0]):
+            description = eicfg.get(
+                "description", lang.split("_")[0])
+        else:
+            description = eicfg.get("description", langdefault)
+
+        if eicfg.has_option("example", lang):
+            example = eicfg.get("example", lang)
+        elif eicfg.has_option("example", lang.split("_")[0]):
+            example = eicfg.get("example", lang.split("_")[0])
+        elif eicfg.has_option("example", langdefault):
+            example = eicfg.get("example", langdefault)
+        else:
+            example = None
+
+        if eicfg.has_option("regex", "value"):
+            regex = eicfg.get("regex", "value")
+        else:
+            regex = None
+
+        extrainfo[extrainfofile] = {
+            'label': label,
+            'description': description,
+            'example': example,
+            'regex': regex,
+        }
+
+    # Store data about this colection
+    collectiondata = {'langdefault': langdefault, 'name': collectionname, 'acc_num': accno, 'type': "collection", 'base-path': collpath, 'categories': collcategories, 'extra-information': extrainfo, 'authors': collauthors}
+    entries[collection] = collectiondata
+
+    return entries
+
+
+def _drop_text_fields(accomdata, readpath):
+    for field in LAZY_TEXT_FIELDS:
+        accomdata.pop(field, None)
+    accomdata['file-path'] = readpath
+
+
+def _parse_collection_task(task):
+    # Runs in a worker process. Pool.map() passes a single argument only.
+    # Returns the entries of the collection, and the messages to log.
+    global _worker_messages
+    _worker_messages = []
+    try:
+        return parse_collection(*task), _worker_messages
+    finally:
+        _worker_messages = None
+
+
+def parse_collections(tasks, processes=None):
+    """
+    Parses several collections, farming the work out to a pool of worker
+    processes if there are enough of them to make it worthwhile. If the
+    pool fails, they are parsed in this process instead.
+
+    The worker processes are forked from this one, which is only safe as
+    long as it has no threads: the daemon only uses them before the
+    reactor has started.
+
+    Args:
+        * **tasks** - (list) a list of (installpath, collection, lang, lazy) tuples, as taken by parse_collection().
+        * **processes** - (int) the maximum number of worker processes to use. If None, the number of CPUs is used. 1 or less forces parsing in this process.
+
+    Returns:
+        * **list(dict)** - the entries of each collection, in the same order as **tasks**.
+    """
+    if processes is None:
+        try:
+            processes = multiprocessing.cpu_count()
+        except NotImplementedError:
+            processes = 1
+    processes = min(processes, len(tasks))
+
+    if processes < 2 or len(tasks) < PARALLEL_MIN_COLLECTIONS:
+        return [parse_collection(*task) for task in tasks]
+
+    log.msg("Parsing %d collections using %d processes" % (
+        len(tasks), processes))
+    try:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_parse_collection_task, tasks)
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+    except Exception, e:
+        log.msg("Could not parse collections in worker processes, "
+                "parsing them one by one: %s" % e)
+        return [parse_collection(*task) for task in tasks]
+
+    for entries, messages in results:
+        for message in messages:
+            log.msg(message)
+    return [entries for entries, messages in results]
+
+
+def get_collection_signature(collpath):
+    """
+    Returns a cheap, stat-based signature of a single collection. Adding,
+    removing or replacing a file changes the modification time of the
+    directory it lives in, but editing a file in place does not, so the
+    .accomplishment files (including translations) and the ABOUT file
+    are stat'ed as well.
+    """
+    signature = []
+    for root, dirs, files in os.walk(collpath):
+        dirs.sort()
+        relroot = root[len(collpath):]
+        signature.append((relroot, os.stat(root).st_mtime))
+        for name in sorted(files):
+            if name.endswith(".accomplishment"):
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    # removed in the meantime
+                    continue
+                signature.append((os.path.join(relroot, name),
+                                  st.st_mtime, st.st_size))
+    aboutpath = os.path.join(collpath, 'ABOUT')
+    if os.path.exists(aboutpath):
+        st = os.stat(aboutpath)
+        signature.append(('ABOUT', st.st_mtime, st.st_size))
+    return tuple(signature)
+
+
+def get_changed_collections(old, new):
+    """
+    Compares two collection signatures, as returned by
+    Accomplishments._get_accom_database_signature(), and returns a sorted
+    list of the names of all collections that were added, removed or
+    modified in between. A collection that moved to a different install
+    path counts as modified.
+    """
+    if old is None or old['lang'] != new['lang'] or \
+            old.get('lazy', False) != new.get('lazy', False):
+        # Everything has to be loaded again
+        changed = set(new['collections'])
+        if old is not None:
+            changed.update(old['collections'])
+        return sorted(changed)
+
+    changed = set()
+    for collection, sig in new['collections'].iteritems():
+        if old['collections'].get(collection) != sig:
+            changed.add(collection)
+    for collection in old['collections']:
+        if collection not in new['collections']:
+            changed.add(collection)
+    return sorted(changed)
@@ -0,0 +1,113 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module provides the queue of accomplishments whose scripts are
+waiting to be run, ordered by how urgently they are wanted.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import itertools
+from collections import deque
+
+# The lanes of the queue, the most urgent first:
+#  - INTERACTIVE: scripts a user has asked for, e.g. with run_script
+#  - UNLOCKED: scripts of accomplishments that have just been unlocked
+#  - SWEEP: the periodic run of all unlocked accomplishments' scripts
+INTERACTIVE = 0
+UNLOCKED = 1
+SWEEP = 2
+LANES = (INTERACTIVE, UNLOCKED, SWEEP)
+LANE_NAMES = ("interactive", "unlocked", "sweep")
+
+
+class ScriptScheduler(object):
+    """
+    A queue of accomIDs with a FIFO lane per priority. Items are taken
+    from the most urgent lane that is not empty. An accomID is never
+    queued twice: adding one that is queued already in a less urgent lane
+    moves it to the more urgent one, adding it to the same or a less
+    urgent lane does nothing.
+
+    Moving an item leaves it's old entry behind in the old lane; such
+    entries are recognized by their ticket not being the current one,
+    and are skipped when they come up.
+    """
+    def __init__(self):
+        self.lanes = tuple(deque() for lane in LANES)
+        # accomID -> (lane, ticket) of it's current entry
+        self.queued = {}
+        self._tickets = itertools.count()
+
+    def __len__(self):
+        return len(self.queued)
+
+    def __contains__(self, accomID):
+        return accomID in self.queued
+
+    def __iter__(self):
+        # the queued accomIDs, in the order they will be taken
+        for lane in self.lanes:
+            for ticket, accomID in lane:
+                if self.queued.get(accomID, (None, None))[1] == ticket:
+                    yield accomID
+
+    def lane_of(self, accomID):
+        """
+        Returns the lane **accomID** is queued in, or None if it is not
+        queued.
+        """
+        entry = self.queued.get(accomID)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def add(self, accomID, lane=SWEEP):
+        """
+        Queues **accomID** in **lane**, unless it is queued already in it
+        or in a more urgent one. Returns True if it has been (re)queued.
+        """
+        entry = self.queued.get(accomID)
+        if entry is not None and entry[0] <= lane:
+            return False
+        ticket = self._tickets.next()
+        self.queued[accomID] = (lane, ticket)
+        self.lanes[lane].append((ticket, accomID))
+        return True
+
+    def extend(self, accomIDs, lane=SWEEP):
+        for accomID in accomIDs:
+            self.add(accomID, lane)
+
+    def pop(self):
+        """
+        Removes and returns the next accomID to run the script of. Raises
+        IndexError if the queue is empty.
+        """
+        for lane in self.lanes:
+            while lane:
+                ticket, accomID = lane.popleft()
+                entry = self.queued.get(accomID)
+                if entry is not None and entry[1] == ticket:
+                    del self.queued[accomID]
+                    return accomID
+        raise IndexError("pop from an empty ScriptScheduler")
+
+    def counts(self):
+        """
+        Returns a dict mapping the names of the lanes to the number of
+        accomIDs queued in them.
+        """
+        counts = dict.fromkeys(LANE_NAMES, 0)
+        for lane, ticket in self.queued.itervalues():
+            counts[LANE_NAMES[lane]] += 1
+        return counts
+
+    def clear(self):
+        for lane in self.lanes:
+            lane.clear()
+        self.queued.clear()
@@ -0,0 +1,147 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module provides a full-text search index over accomplishments'
+titles, keywords and categories.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import bisect
+import heapq
+import re
+
+# How much a match in each of the fields is worth when ranking results.
+TITLE_WEIGHT = 3
+KEYWORD_WEIGHT = 2
+CATEGORY_WEIGHT = 1
+
+# A token matching the query word exactly ranks better than one that
+# only starts with it.
+EXACT_MATCH_BONUS = 1
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Splits **text** into a list of lowercase unicode words.
+    """
+    if isinstance(text, str):
+        text = text.decode("utf-8", "replace")
+    return _token_re.findall(text.lower())
+
+
+class SearchIndex(object):
+    """
+    An inverted index mapping words to the accomplishments they appear
+    in. Each query word matches all words it is a prefix of, so results
+    show up while the user is still typing.
+    """
+    def __init__(self):
+        # token -> {accomID: weight}
+        self.postings = {}
+        # accomID -> set of it's tokens
+        self.tokens_of = {}
+        # accomID -> words of it's title, used to order results that rank the same
+        self.titles = {}
+        # sorted list of all tokens, None if it needs to be sorted again
+        self._sorted_tokens = None
+
+    def __len__(self):
+        return len(self.tokens_of)
+
+    def add(self, accomID, title, keywords, categories):
+        """
+        Indexes accomplishment **accomID**, replacing whatever was
+        indexed for it before.
+        """
+        self.remove(accomID)
+        weights = {}
+        fields = [(title, TITLE_WEIGHT)]
+        fields.extend((keyword, KEYWORD_WEIGHT) for keyword in keywords)
+        fields.extend((category, CATEGORY_WEIGHT) for category in categories)
+        for text, weight in fields:
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0), weight)
+
+        for token, weight in weights.iteritems():
+            if token not in self.postings:
+                self.postings[token] = {}
+                self._sorted_tokens = None
+            self.postings[token][accomID] = weight
+        self.tokens_of[accomID] = set(weights)
+        self.titles[accomID] = tokenize(title)
+
+    def remove(self, accomID):
+        """
+        Removes accomplishment **accomID** from the index, if it is there.
+        """
+        tokens = self.tokens_of.pop(accomID, ())
+        for token in tokens:
+            posting = self.postings[token]
+            del posting[accomID]
+            if not posting:
+                del self.postings[token]
+                self._sorted_tokens = None
+        self.titles.pop(accomID, None)
+
+    def clear(self):
+        self.postings.clear()
+        self.tokens_of.clear()
+        self.titles.clear()
+        self._sorted_tokens = None
+
+    def _tokens_starting_with(self, prefix):
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self.postings)
+        tokens = self._sorted_tokens
+        i = bisect.bisect_left(tokens, prefix)
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            yield tokens[i]
+            i += 1
+
+    def search(self, query, limit=0, accept=None):
+        """
+        Returns a list of accomIDs of accomplishments matching all words
+        of **query**, best matches first.
+
+        Args:
+            * **query** - (str) the words to look for.
+            * **limit** - (int) the maximum number of results, 0 means no limit.
+            * **accept** - (function) if given, only accomplishments for which it returns True are included.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+
+        scores = None
+        for word in set(words):
+            # The best score of each accomplishment for this word
+            matches = {}
+            for token in self._tokens_starting_with(word):
+                bonus = EXACT_MATCH_BONUS if token == word else 0
+                for accomID, weight in self.postings[token].iteritems():
+                    if matches.get(accomID, 0) < weight + bonus:
+                        matches[accomID] = weight + bonus
+            if scores is None:
+                scores = matches
+            else:
+                scores = dict((accomID, score + matches[accomID])
+                              for accomID, score in scores.iteritems()
+                              if accomID in matches)
+            if not scores:
+                return []
+
+        results = scores.keys()
+        if accept is not None:
+            results = [accomID for accomID in results if accept(accomID)]
+        rank = lambda accomID: (-scores[accomID], self.titles[accomID],
+                                accomID)
+        if limit > 0:
+            return heapq.nsmallest(limit, results, key=rank)
+        return sorted(results, key=rank)
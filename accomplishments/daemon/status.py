@@ -0,0 +1,134 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module keeps the status of all installed accomplishments in compact
+vectors, so that listing accomplishments by their status does not need
+to look at each of them in turn.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import bisect
+import itertools
+
+try:
+    import numpy
+    useNumpy = True
+except ImportError:
+    useNumpy = False
+
+# Status flags, each accomplishment's status is a combination of these.
+ACCOMPLISHED = 1
+LOCKED = 2
+HAS_SCRIPT = 4
+EXTRAINFO_COMPLETE = 8
+
+# (mask, value) -> translation table for bytearray.translate(), see
+# StatusVectors._selectors()
+_tables = {}
+
+
+def _get_table(mask, value):
+    try:
+        return _tables[(mask, value)]
+    except KeyError:
+        table = "".join(
+            "\x01" if (state & mask) == value else "\x00"
+            for state in range(256))
+        _tables[(mask, value)] = table
+        return table
+
+
+class StatusVectors(object):
+    """
+    The status flags of all accomplishments, held in a single vector of
+    bytes. Accomplishments are numbered in the order of their IDs, so the
+    accomplishments of each collection make a contiguous slice of it.
+
+    The vector is a numpy array if numpy is available, and a bytearray
+    otherwise.
+    """
+    def __init__(self, accoms, old=None, use_numpy=None):
+        """
+        Creates vectors for **accoms**, with all flags cleared. If **old**
+        StatusVectors are given, accomplishments that were known to them
+        keep their status.
+        """
+        if use_numpy is None:
+            use_numpy = useNumpy
+        self.use_numpy = use_numpy
+
+        self.accoms = sorted(accoms)
+        self.number = dict((accom, i) for i, accom in enumerate(self.accoms))
+        if self.use_numpy:
+            self.states = numpy.zeros(len(self.accoms), dtype=numpy.uint8)
+        else:
+            self.states = bytearray(len(self.accoms))
+
+        if old is not None:
+            for i, accom in enumerate(self.accoms):
+                if accom in old.number:
+                    self.states[i] = old.states[old.number[accom]]
+
+    def __len__(self):
+        return len(self.accoms)
+
+    def get(self, accomID, flag):
+        return bool(self.states[self.number[accomID]] & flag)
+
+    def set(self, accomID, flag, value):
+        i = self.number[accomID]
+        if value:
+            self.states[i] = self.states[i] | flag
+        else:
+            self.states[i] = self.states[i] & ~flag & 0xff
+
+    def _range(self, collection):
+        # The slice of the vector holding accomplishments of
+        # **collection**, or the whole vector.
+        if collection is None:
+            return 0, len(self.accoms)
+        # "0" is the character right after "/"
+        return (bisect.bisect_left(self.accoms, collection + "/"),
+                bisect.bisect_left(self.accoms, collection + "0"))
+
+    def _selectors(self, mask, value, collection):
+        start, end = self._range(collection)
+        if self.use_numpy:
+            return start, (self.states[start:end] & mask) == value
+        return start, self.states[start:end].translate(
+            _get_table(mask, value))
+
+    def select(self, mask, value=None, collection=None):
+        """
+        Returns a sorted list of IDs of accomplishments whose flags in
+        **mask** are set as in **value** (by default, all of them set).
+        This can be limited to a single **collection**.
+
+        Example:
+            >>> vectors.select(LOCKED | ACCOMPLISHED, 0)
+            # all unlocked accomplishments that are not accomplished yet
+        """
+        if value is None:
+            value = mask
+        start, selectors = self._selectors(mask, value, collection)
+        if self.use_numpy:
+            return [self.accoms[start + i]
+                    for i in numpy.flatnonzero(selectors)]
+        return list(itertools.compress(
+            itertools.islice(self.accoms, start, None), selectors))
+
+    def count(self, mask, value=None, collection=None):
+        """
+        Returns the number of accomplishments select() would return.
+        """
+        if value is None:
+            value = mask
+        start, selectors = self._selectors(mask, value, collection)
+        if self.use_numpy:
+            return int(numpy.count_nonzero(selectors))
+        return selectors.count("\x01")
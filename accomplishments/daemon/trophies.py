@@ -0,0 +1,368 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module finds the trophies present in the trophies directory, and
+caches their contents and the results of checking their signatures.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import ConfigParser
+import cPickle
+import hashlib
+import os
+import stat
+
+from twisted.python import log
+
+try:
+    # os.scandir is not available in Python 2, the scandir module
+    # provides the same.
+    from scandir import scandir
+    useScandir = True
+except ImportError:
+    useScandir = False
+
+# bump these whenever the layout of the stored caches changes
+TROPHY_CACHE_VERSION = 1
+SIGNATURE_CACHE_VERSION = 1
+
+# The user ID of the key trophies are signed with
+ACCOMPLISHMENTS_KEY_UID = "Ubuntu Accomplishments <jono@ubuntu.com>"
+
+
+class TrophyFiles(object):
+    """
+    The files of a single trophy: **trophy** and **asc** are the stat
+    results of it's .trophy and .trophy.asc files, or None if a file is
+    not there.
+    """
+    __slots__ = ('trophy', 'asc')
+
+    def __init__(self, trophy=None, asc=None):
+        self.trophy = trophy
+        self.asc = asc
+
+    def __repr__(self):
+        return "TrophyFiles(trophy=%r, asc=%r)" % (self.trophy, self.asc)
+
+
+def _list_files(path):
+    # Yields (name, stat result) of all regular files in **path**, or
+    # nothing if it is not a directory.
+    try:
+        if useScandir:
+            for entry in scandir(path):
+                if entry.is_file():
+                    yield entry.name, entry.stat()
+            return
+        names = os.listdir(path)
+    except OSError:
+        return
+    for name in names:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except OSError:
+            # removed in the meantime
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield name, st
+
+
+def _list_dirs(path):
+    # Returns a sorted list of names of directories in **path**, leaving
+    # out hidden ones (like .extrainformation).
+    try:
+        if useScandir:
+            names = [entry.name for entry in scandir(path)
+                     if entry.is_dir() and not entry.name.startswith(".")]
+        else:
+            names = [name for name in os.listdir(path)
+                     if not name.startswith(".") and
+                     os.path.isdir(os.path.join(path, name))]
+    except OSError:
+        return []
+    return sorted(names)
+
+
+def scan_trophies(trophies_path, collections=None):
+    """
+    Walks the trophies directory once, and returns a dict mapping the
+    accomIDs of all trophies found there to their TrophyFiles. A trophy
+    is included even if only it's .asc file is there.
+
+    Args:
+        * **trophies_path** - (str) the trophies directory.
+        * **collections** - (list) names of collections to look at, all of them by default.
+
+    Example:
+        >>> scan_trophies("/home/user/.local/share/accomplishments/trophies")
+        {'ubuntu-community/registered-on-launchpad': TrophyFiles(...)}
+    """
+    if collections is None:
+        collections = _list_dirs(trophies_path)
+    found = {}
+    for collection in collections:
+        collpath = os.path.join(trophies_path, collection)
+        for name, st in _list_files(collpath):
+            if name.endswith(".trophy"):
+                accomID = collection + "/" + name[:-7]
+                found.setdefault(accomID, TrophyFiles()).trophy = st
+            elif name.endswith(".trophy.asc"):
+                accomID = collection + "/" + name[:-11]
+                found.setdefault(accomID, TrophyFiles()).asc = st
+    return found
+
+
+def parse_trophy_file(path):
+    """
+    Returns the contents of the [trophy] section of the .trophy file at
+    **path** as a dict, or an empty dict if the file cannot be parsed.
+    """
+    cfg = ConfigParser.RawConfigParser()
+    try:
+        cfg.read(path)
+    except ConfigParser.Error, e:
+        log.msg("Could not parse trophy file %s: %s" % (path, e))
+        return {}
+    if not cfg.has_section("trophy"):
+        return {}
+    return dict(cfg._sections["trophy"])
+
+
+def _stat_key(st):
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+class TrophyCache(object):
+    """
+    The parsed contents of .trophy files, kept in memory and stored in
+    the cache directory between runs. Each entry is keyed by the path of
+    the file, and remembers the inode, modification time and size the
+    file had when it was parsed; as long as these do not change, the
+    file is not read again.
+    """
+    def __init__(self, path=None):
+        # **path** is where the cache is stored, None to keep it in
+        # memory only
+        self.path = path
+        # trophy path -> (stat key, contents)
+        self.entries = {}
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, trophypath, st=None):
+        """
+        Returns a dict with the contents of the [trophy] section of the
+        .trophy file at **trophypath**, or None if there is no such file.
+        **st** may be given if the caller already has the stat result of
+        this file, so that it does not need to be taken again.
+        """
+        if st is None:
+            try:
+                st = os.stat(trophypath)
+            except OSError:
+                self.discard(trophypath)
+                return None
+        key = _stat_key(st)
+        entry = self.entries.get(trophypath)
+        if entry is None or entry[0] != key:
+            entry = (key, parse_trophy_file(trophypath))
+            self.entries[trophypath] = entry
+            self.dirty = True
+        return dict(entry[1])
+
+    def discard(self, trophypath):
+        if self.entries.pop(trophypath, None) is not None:
+            self.dirty = True
+
+    def retain(self, trophypaths):
+        """
+        Forgets all entries other than those of **trophypaths**.
+        """
+        keep = set(trophypaths)
+        for trophypath in self.entries.keys():
+            if trophypath not in keep:
+                self.discard(trophypath)
+
+    def clear(self):
+        self.entries.clear()
+        self.dirty = True
+
+    def load(self):
+        """
+        Loads the entries stored by save(). Returns True if this
+        succeeded, or False if there is nothing usable stored.
+        """
+        stored = _load_stored(self.path, TROPHY_CACHE_VERSION, "trophy cache")
+        if stored is None:
+            return False
+        self.entries = stored['entries']
+        self.dirty = False
+        return True
+
+    def save(self):
+        """
+        Stores the entries in the cache directory, if they have changed
+        since they were loaded or last saved.
+        """
+        if self.dirty and _store(self.path, TROPHY_CACHE_VERSION,
+                                 {'entries': self.entries}, "trophy cache"):
+            self.dirty = False
+
+
+def signature_digest(trophy, signature):
+    """
+    Returns a hash of the contents of a .trophy file and of it's .asc
+    signature, which identifies this pair of files.
+    """
+    h = hashlib.sha256()
+    h.update("%d:" % len(trophy))
+    h.update(trophy)
+    h.update(signature)
+    return h.hexdigest()
+
+
+def get_accomplishments_keys(ctx):
+    """
+    Returns a sorted tuple describing the accomplishments keys (and
+    their subkeys) in the key ring of gpgme Context **ctx**: a
+    (fingerprint, usable) pair for each of them. This changes whenever
+    such a key is added, removed, revoked or expires.
+    """
+    keys = set()
+    for key in ctx.keylist():
+        if not any(uid.uid == ACCOMPLISHMENTS_KEY_UID for uid in key.uids):
+            continue
+        usable = not (key.revoked or key.expired or key.disabled or
+                      key.invalid)
+        for subkey in key.subkeys:
+            keys.add((subkey.fpr, usable and not (
+                subkey.revoked or subkey.expired or subkey.disabled or
+                subkey.invalid)))
+    return tuple(sorted(keys))
+
+
+class SignatureCache(object):
+    """
+    Remembers trophies whose signatures have been verified, so that they
+    do not need to be verified again. Trophies are identified by a
+    signature_digest() of their files, so any change to them makes them
+    unknown again. Only signatures made with one of the accomplishments
+    keys are remembered, and all of them are forgotten when these keys
+    change (see set_keys).
+    """
+    def __init__(self, path=None):
+        # **path** is where the cache is stored, None to keep it in
+        # memory only
+        self.path = path
+        # the result of get_accomplishments_keys() the entries are valid
+        # for, None if it is not known yet
+        self.keys = None
+        # digest -> fingerprint of the key it was signed with
+        self.verified = {}
+        self.dirty = False
+        self._usable = frozenset()
+
+    def __len__(self):
+        return len(self.verified)
+
+    def set_keys(self, keys):
+        """
+        Sets the accomplishments keys currently in the key ring. If they
+        differ from the ones the entries were verified with, all entries
+        are dropped.
+        """
+        if keys != self.keys:
+            if self.verified:
+                self.verified.clear()
+            self.keys = keys
+            self.dirty = True
+        self._usable = frozenset(fpr for fpr, usable in keys if usable)
+
+    def is_verified(self, digest):
+        return self.verified.get(digest) in self._usable
+
+    def add(self, digest, fpr):
+        """
+        Records that the trophy identified by **digest** is correctly
+        signed with the key of fingerprint **fpr**. Signatures made with
+        other keys than the accomplishments keys are not recorded.
+        """
+        if fpr in self._usable and self.verified.get(digest) != fpr:
+            self.verified[digest] = fpr
+            self.dirty = True
+
+    def load(self):
+        """
+        Loads the entries stored by save(). Returns True if this
+        succeeded, or False if there is nothing usable stored.
+        """
+        stored = _load_stored(self.path, SIGNATURE_CACHE_VERSION,
+                              "signature cache")
+        if stored is None:
+            return False
+        self.verified = stored['verified']
+        self.keys = stored['keys']
+        self._usable = frozenset(fpr for fpr, usable in self.keys if usable)
+        self.dirty = False
+        return True
+
+    def save(self):
+        """
+        Stores the entries in the cache directory, if they have changed
+        since they were loaded or last saved.
+        """
+        if self.dirty and self.keys is not None and \
+                _store(self.path, SIGNATURE_CACHE_VERSION,
+                       {'keys': self.keys, 'verified': self.verified},
+                       "signature cache"):
+            self.dirty = False
+
+
+def _load_stored(path, version, what):
+    # Returns the dict stored at **path** by _store(), or None if there is
+    # nothing usable stored.
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        f = open(path, "rb")
+        try:
+            stored = cPickle.load(f)
+        finally:
+            f.close()
+    except Exception, e:
+        log.msg("Could not load %s %s: %s" % (what, path, e))
+        return None
+    if not isinstance(stored, dict) or stored.get('version') != version:
+        log.msg("Ignoring %s of an unknown version." % what)
+        return None
+    return stored
+
+
+def _store(path, version, data, what):
+    # Stores **data** (a dict) at **path**. Returns True if this
+    # succeeded.
+    if path is None:
+        return False
+    stored = dict(data, version=version)
+    # Write to a temporary file first, so that a crash cannot leave a
+    # truncated file behind.
+    tmppath = path + ".tmp"
+    try:
+        f = open(tmppath, "wb")
+        try:
+            cPickle.dump(stored, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmppath, path)
+    except (IOError, OSError, cPickle.PicklingError), e:
+        log.msg("Could not save %s %s: %s" % (what, path, e))
+        return False
+    return True
@@ -0,0 +1,201 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module verifies the signatures of trophies in a pool of worker
+threads, so that the daemon keeps answering D-Bus calls while they are
+being checked.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import multiprocessing
+import os
+import threading
+from StringIO import StringIO
+
+import gpgme
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
+from twisted.python.threadpool import ThreadPool
+
+from accomplishments.daemon import trophies
+
+# Signatures are never checked by more threads than this at once.
+MAX_WORKERS = 4
+
+
+class SignatureVerifier(object):
+    """
+    Checks whether .trophy.asc files are correct signatures of their
+    .trophy files. Trophies found in the SignatureCache **cache** are not
+    verified again, and correctly signed ones are added to it.
+
+    verify() and verify_many() return Deferreds. The signatures are
+    verified in worker threads, each with a gpgme Context of it's own,
+    unless the verifier is **synchronous**; then, they are verified right
+    away, and the Deferreds returned have already fired. While the
+    reactor is not running yet (i.e. when the daemon is starting up),
+    only trophies found in the cache are known right away, all others
+    wait for the reactor to start.
+    """
+    def __init__(self, cache, max_workers=None, synchronous=False):
+        self.cache = cache
+        if max_workers is None:
+            try:
+                max_workers = min(multiprocessing.cpu_count(), MAX_WORKERS)
+            except NotImplementedError:
+                max_workers = 1
+        self.max_workers = max_workers
+        self.synchronous = synchronous
+        # the number of signatures waiting to be verified
+        self.pending = 0
+        self._pool = None
+        self._local = threading.local()
+
+    def verify_now(self, ascpath):
+        """
+        Returns True if **ascpath** is a correct signature, verifying it
+        in the calling thread.
+        """
+        return self._record(self._check(ascpath))
+
+    def verify(self, ascpath):
+        """
+        Returns a Deferred firing with True if **ascpath** is a correct
+        signature, and with False otherwise.
+        """
+        if self.synchronous:
+            return defer.maybeDeferred(self.verify_now, ascpath)
+        if not reactor.running:
+            if self._is_cached(ascpath):
+                return defer.succeed(True)
+            d = defer.Deferred()
+            self.pending += 1
+            reactor.callWhenRunning(self._verify_queued, ascpath, d)
+            return d
+        self.pending += 1
+        return self._verify_in_pool(ascpath)
+
+    def verify_many(self, ascpaths):
+        """
+        Verifies all of **ascpaths**, and returns a Deferred firing with a
+        dict mapping each of them to True or False, once all of them
+        have been checked.
+        """
+        ascpaths = sorted(set(ascpaths))
+        results = {}
+        deferreds = []
+        for ascpath in ascpaths:
+            d = self.verify(ascpath)
+            d.addErrback(self._failed, ascpath)
+            d.addCallback(lambda correct, ascpath=ascpath:
+                          results.__setitem__(ascpath, correct))
+            deferreds.append(d)
+        d = defer.gatherResults(deferreds)
+        d.addCallback(lambda _: results)
+        return d
+
+    def _verify_queued(self, ascpath, d):
+        self._verify_in_pool(ascpath).chainDeferred(d)
+
+    def _verify_in_pool(self, ascpath):
+        d = threads.deferToThreadPool(
+            reactor, self._get_pool(), self._check, ascpath)
+        d.addCallback(self._record)
+        d.addBoth(self._done)
+        return d
+
+    def _done(self, result):
+        self.pending -= 1
+        return result
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(0, self.max_workers, "signatures")
+            self._pool.start()
+            reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+        return self._pool
+
+    def _get_context(self):
+        # gpgme contexts must not be shared between threads
+        ctx = getattr(self._local, "context", None)
+        if ctx is None:
+            ctx = self._local.context = gpgme.Context()
+        return ctx
+
+    def _failed(self, failure, ascpath):
+        log.msg("Cannot validate signature %s: %s" % (
+            ascpath, failure.getErrorMessage()))
+        return False
+
+    def _record(self, result):
+        # Runs in the reactor thread, so that only it updates the cache.
+        correct, digest, fpr = result
+        if correct and fpr is not None:
+            self.cache.add(digest, fpr)
+        return correct
+
+    def _read(self, ascpath):
+        # Returns the contents of the .trophy file and of it's signature
+        # **ascpath**, or None if they cannot be read.
+        trophypath = ascpath[:-4]
+        if not os.path.exists(ascpath):
+            log.msg("Cannot check if signature is correct, because file"
+                    "%s does not exist" % ascpath)
+            return None
+        elif not os.path.exists(trophypath):
+            log.msg("Cannot check if signature is correct, because file"
+                    "%s does not exist" % trophypath)
+            return None
+
+        try:
+            trophysigned = open(ascpath, "r")
+            trophy = open(trophypath, "r")
+            try:
+                return trophy.read(), trophysigned.read()
+            finally:
+                trophysigned.close()
+                trophy.close()
+        except IOError, e:
+            log.msg("Cannot validate signature due to exception: %s" % e)
+            return None
+
+    def _is_cached(self, ascpath):
+        data = self._read(ascpath)
+        return data is not None and \
+            self.cache.is_verified(trophies.signature_digest(*data))
+
+    def _check(self, ascpath):
+        # Returns (correct, digest, fpr), where fpr is the fingerprint of
+        # the key that made the signature, or None if it was not verified
+        # now. This may run in a worker thread.
+        data = self._read(ascpath)
+        if data is None:
+            return False, None, None
+        plaindata, signeddata = data
+
+        # Trophies verified before do not need to be verified again
+        digest = trophies.signature_digest(plaindata, signeddata)
+        if self.cache.is_verified(digest):
+            return True, digest, None
+
+        sig = self._get_context().verify(
+            StringIO(signeddata), None, StringIO(plaindata))
+        if len(sig) != 1:
+            # No Sig
+            return False, digest, None
+        if sig[0].status is not None:
+            # Bad Sig
+            return False, digest, None
+        # Correct!
+        return True, digest, sig[0].fpr
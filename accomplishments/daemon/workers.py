@@ -0,0 +1,154 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This module runs accomplishments' Python scripts in processes forked from
+a warm zygote process (see zygote.py), instead of starting a new Python
+interpreter for each of them.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import itertools
+import json
+import os
+import sys
+
+from twisted.internet import defer, protocol, reactor
+from twisted.python import log
+
+from accomplishments import exceptions
+from accomplishments.daemon import zygote
+from accomplishments.util import TIMED_OUT
+
+# Modules accomplishments' scripts commonly import, imported once by the
+# zygote. Those that are not installed are skipped.
+PRELOAD = (
+    "json", "urllib", "urllib2", "httplib", "dbus",
+    "accomplishments.daemon.dbusapi", "launchpadlib.launchpad",
+)
+
+ZYGOTE_PATH = os.path.splitext(zygote.__file__)[0] + ".py"
+
+
+def can_run(scriptpath):
+    """
+    Tells whether the script at **scriptpath** is a Python script, which
+    a WorkerPool can run.
+    """
+    if scriptpath.endswith(".py"):
+        return True
+    try:
+        f = open(scriptpath)
+        try:
+            firstline = f.readline(200)
+        finally:
+            f.close()
+    except IOError:
+        return False
+    return firstline.startswith("#!") and "python" in firstline
+
+
+class ZygoteProtocol(protocol.ProcessProtocol):
+    def __init__(self, pool):
+        self.pool = pool
+        self.buffer = ""
+
+    def childDataReceived(self, childFD, data):
+        if childFD != zygote.RESULTS_FD:
+            # output of scripts
+            log.msg("Got script output: %s" % data)
+            return
+        self.buffer += data
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self.pool._result(json.loads(line))
+
+    def processEnded(self, reason):
+        self.pool._ended(reason)
+
+
+class WorkerPool(object):
+    """
+    Runs Python scripts in children forked from a zygote process that has
+    the **preload** modules imported already. The zygote is started when
+    the first script is run, and again if it has stopped.
+
+    The scripts are run like the Python interpreter would run them, so
+    they end with the same exit codes they would end with otherwise.
+
+    If the zygote stops, scripts it has not started yet fail with
+    WorkerPoolError, and can be run some other way. Scripts it has
+    started fail with ScriptLost instead, as they may have done some of
+    their work already, and should not be run again.
+    """
+    def __init__(self, preload=PRELOAD):
+        self.preload = preload
+        # request id -> Deferred of scripts that are running
+        self.pending = {}
+        # request ids of scripts the zygote has started
+        self.started = set()
+        self._ids = itertools.count(1)
+        self._protocol = None
+        self._trigger_added = False
+
+    def run(self, scriptpath, timeout=None):
+        """
+        Runs the script at **scriptpath**, and returns a Deferred firing
+        with it's exit code, or with TIMED_OUT if it has been stopped
+        after running for **timeout** seconds.
+        """
+        if self._protocol is None:
+            self._start()
+        requestid = self._ids.next()
+        d = self.pending[requestid] = defer.Deferred()
+        self._protocol.transport.write(json.dumps({
+            'id': requestid, 'script': scriptpath, 'timeout': timeout,
+        }) + "\n")
+        return d
+
+    def _start(self):
+        log.msg("Starting the script worker pool")
+        self._protocol = ZygoteProtocol(self)
+        command = [sys.executable, ZYGOTE_PATH] + list(self.preload)
+        reactor.spawnProcess(
+            self._protocol, command[0], command, env=os.environ,
+            childFDs={0: "w", 1: "r", 2: "r", zygote.RESULTS_FD: "r"})
+        if not self._trigger_added:
+            self._trigger_added = True
+            reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+    def _result(self, result):
+        if result.get('started'):
+            if result['id'] in self.pending:
+                self.started.add(result['id'])
+            return
+        self.started.discard(result['id'])
+        d = self.pending.pop(result['id'], None)
+        if d is None:
+            return
+        if result.get('timed-out'):
+            d.callback(TIMED_OUT)
+        else:
+            d.callback(result['exitcode'])
+
+    def _ended(self, reason):
+        log.msg("The script worker pool has stopped: %s" % (
+            reason.getErrorMessage(),))
+        self._protocol = None
+        pending, self.pending = self.pending, {}
+        started, self.started = self.started, set()
+        for requestid, d in pending.iteritems():
+            if requestid in started:
+                d.errback(exceptions.ScriptLost())
+            else:
+                d.errback(exceptions.WorkerPoolError())
+
+    def stop(self):
+        # The zygote stops the scripts still running, and exits once they
+        # are gone.
+        if self._protocol is not None:
+            self._protocol.transport.closeStdin()
@@ -0,0 +1,240 @@
+"""
+(c) 2012, Jono Bacon, and the Ubuntu Accomplishments community.
+
+This is the process behind workers.WorkerPool. It imports the modules
+accomplishments' scripts commonly use once, and then runs each script it
+is asked to in a forked child, so that scripts do not need to start a
+Python interpreter and import these modules all over again.
+
+It is run as a program, with the names of the modules to import as
+arguments, and only uses the standard library, so that the Twisted
+reactor is not started in it. Requests are read from stdin and results
+are written to RESULTS_FD, as JSON objects, one per line:
+
+* a request: {"id": 1, "script": "/path/to/script.py", "timeout": 300}
+* the script has been started: {"id": 1, "started": true}
+* a result: {"id": 1, "exitcode": 0} or {"id": 1, "timed-out": true}
+
+The exit code is null if the script has been killed by a signal. Anything
+the scripts write to stdout and stderr goes to the zygote's own.
+
+This file is licensed under the GNU Public License version 3.
+
+If you are interested in contributing improvements or changes to this
+program, please see http://wiki.ubuntu.com/Accomplishments for how to
+get involved.
+"""
+
+import errno
+import fcntl
+import json
+import os
+import runpy
+import select
+import signal
+import sys
+import time
+import traceback
+
+# The file descriptor results are written to, so that they do not get
+# mixed up with the output of scripts
+RESULTS_FD = 3
+
+# How many seconds a script that timed out gets to terminate, before it
+# is killed (the same as util.TERMINATE_GRACE).
+TERMINATE_GRACE = 5
+
+
+def preload(modules):
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception, e:
+            sys.stderr.write("Could not preload %s: %s\n" % (name, e))
+
+
+def _exit_code(code):
+    # The exit status of a Python process that raised SystemExit(code)
+    if code is None:
+        return 0
+    if isinstance(code, (int, long)):
+        return code & 0xff
+    sys.stderr.write("%s\n" % (code,))
+    return 1
+
+
+def run_script(scriptpath):
+    """
+    Runs the script at **scriptpath** like the Python interpreter would,
+    and returns it's exit status. This runs in the forked child.
+    """
+    sys.argv = [scriptpath]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(scriptpath)))
+    try:
+        runpy.run_path(scriptpath, run_name="__main__")
+    except SystemExit, e:
+        return _exit_code(e.code)
+    except:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class Zygote(object):
+    def __init__(self, results, wakeup):
+        self.results = results
+        # the pipe SIGCHLD wakes select() up with
+        self.wakeup = wakeup
+        # pid -> {'id', 'deadline', 'kill', 'timed-out'} of running scripts
+        self.children = {}
+        self.stdin_open = True
+        self.buffer = ""
+
+    def serve(self):
+        while self.stdin_open or self.children:
+            readable = [self.wakeup[0]]
+            if self.stdin_open:
+                readable.append(0)
+            try:
+                ready = select.select(
+                    readable, [], [], self._next_timeout())[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                ready = []
+            if self.wakeup[0] in ready:
+                try:
+                    os.read(self.wakeup[0], 4096)
+                except OSError:
+                    pass
+            if 0 in ready:
+                self._read_requests()
+            self._reap()
+            self._check_deadlines()
+
+    def _next_timeout(self):
+        times = []
+        for child in self.children.itervalues():
+            for key in ('deadline', 'kill'):
+                if child[key] is not None:
+                    times.append(child[key])
+        if not times:
+            return None
+        return max(min(times) - time.time(), 0)
+
+    def _read_requests(self):
+        data = os.read(0, 4096)
+        if not data:
+            # The daemon has gone away, so should the scripts.
+            self.stdin_open = False
+            now = time.time()
+            for pid, child in self.children.iteritems():
+                self._terminate(pid, child, now)
+            return
+        self.buffer += data
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            if line.strip():
+                self._start(json.loads(line))
+
+    def _start(self, request):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                # a session (and so a process group) of it's own, so that
+                # the script can be stopped with everything it starts
+                os.setsid()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.set_wakeup_fd(-1)
+                for fd in (RESULTS_FD,) + self.wakeup:
+                    os.close(fd)
+                devnull = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(devnull, 0)
+                os.close(devnull)
+                code = run_script(request['script'])
+            finally:
+                try:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                finally:
+                    os._exit(code)
+        timeout = request.get('timeout')
+        self.children[pid] = {
+            'id': request['id'],
+            'deadline': time.time() + timeout if timeout else None,
+            'kill': None,
+            'timed-out': False,
+        }
+        self._write({'id': request['id'], 'started': True})
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid == 0:
+                return
+            child = self.children.pop(pid, None)
+            if child is None:
+                continue
+            if child['kill'] is not None:
+                # whatever the script has started may still be running
+                self._signal(pid, signal.SIGKILL)
+            result = {'id': child['id']}
+            if child['timed-out']:
+                result['timed-out'] = True
+            elif os.WIFEXITED(status):
+                result['exitcode'] = os.WEXITSTATUS(status)
+            else:
+                result['exitcode'] = None
+            self._write(result)
+
+    def _write(self, message):
+        self.results.write(json.dumps(message) + "\n")
+        self.results.flush()
+
+    def _check_deadlines(self):
+        now = time.time()
+        for pid, child in self.children.iteritems():
+            if child['deadline'] is not None and now >= child['deadline']:
+                child['timed-out'] = True
+                self._terminate(pid, child, now)
+            elif child['kill'] is not None and now >= child['kill']:
+                child['kill'] = None
+                self._signal(pid, signal.SIGKILL)
+
+    def _terminate(self, pid, child, now):
+        # SIGTERM now, SIGKILL once the grace period is over
+        child['deadline'] = None
+        if child['kill'] is None:
+            child['kill'] = now + TERMINATE_GRACE
+            self._signal(pid, signal.SIGTERM)
+
+    def _signal(self, pid, signum):
+        try:
+            os.killpg(pid, signum)
+        except OSError:
+            # the whole group is gone already
+            pass
+
+
+def main(modules):
+    preload(modules)
+    results = os.fdopen(RESULTS_FD, "w")
+    wakeup = os.pipe()
+    for fd in wakeup:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    signal.set_wakeup_fd(wakeup[1])
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    Zygote(results, wakeup).serve()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -30,3 +30,15 @@ class AccomplishmentLocked(Error):
     """
     This accomplishment requires other things to be accomplished first.
     """
+
+
+class WorkerPoolError(Error):
+    """
+    The worker pool has stopped before the script has been started.
+    """
+
+
+class ScriptLost(WorkerPoolError):
+    """
+    The worker pool has stopped while the script was running.
+    """
@@ -1,5 +1,6 @@
 import optparse
 import os
+import signal
 
 import gettext
 from gettext import gettext as _
@@ -91,6 +92,74 @@ class SubprocessReturnCodeProtocol(protocol.ProcessProtocol):
         log.msg(data)
 
 
+# What ScriptProtocol's returnCodeDeferred fires with if the command took
+# too long.
+TIMED_OUT = "timed-out"
+
+# How many seconds a command that timed out gets to terminate, before it
+# is killed.
+TERMINATE_GRACE = 5
+
+# Prepended to commands run by ScriptProtocol: makes the command the
+# leader of a new session, and so of a process group of it's own. The
+# children of reactor.spawnProcess are not process group leaders, so
+# setsid(1) execs the command in place, and it keeps the pid the
+# transport knows.
+SETSID_COMMAND = ["setsid"]
+
+
+class ScriptProtocol(SubprocessReturnCodeProtocol):
+    """
+    Like SubprocessReturnCodeProtocol, but gives up on the command after
+    **timeout** seconds: it's process group is sent SIGTERM, and SIGKILL
+    TERMINATE_GRACE seconds later, and the returnCodeDeferred fires with
+    TIMED_OUT. The command has to be started with SETSID_COMMAND, so that
+    the process group contains only the command and whatever it started.
+    """
+    def __init__(self, command="", timeout=None):
+        SubprocessReturnCodeProtocol.__init__(self, command)
+        self.timeout = timeout
+        self.timed_out = False
+        self._timeout_call = None
+        self._kill_call = None
+        self.pid = None
+
+    def connectionMade(self):
+        SubprocessReturnCodeProtocol.connectionMade(self)
+        # the transport forgets it once the process has ended
+        self.pid = self.transport.pid
+        if self.timeout:
+            self._timeout_call = reactor.callLater(
+                self.timeout, self._terminate)
+
+    def _terminate(self):
+        log.msg("Process timed out after %s seconds, terminating: %s" % (
+            self.timeout, " ".join(self.command)))
+        self.timed_out = True
+        self._signal(signal.SIGTERM)
+        self._kill_call = reactor.callLater(
+            TERMINATE_GRACE, self._signal, signal.SIGKILL)
+
+    def _signal(self, signum):
+        try:
+            os.killpg(self.pid, signum)
+        except OSError:
+            # the whole group is gone already
+            pass
+
+    def processEnded(self, reason):
+        if self._timeout_call is not None and self._timeout_call.active():
+            self._timeout_call.cancel()
+        if self._kill_call is not None and self._kill_call.active():
+            self._kill_call.cancel()
+            # whatever the command has started may still be running
+            self._signal(signal.SIGKILL)
+        if self.timed_out:
+            self.returnCodeDeferred.callback(TIMED_OUT)
+        else:
+            SubprocessReturnCodeProtocol.processEnded(self, reason)
+
+
 def import_gpg_key(pub_key):
     """
     """
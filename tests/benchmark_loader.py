@@ -0,0 +1,179 @@
+"""
+Benchmarks for loading accomplishments collections.
+
+These are not unit tests; run this file directly:
+
+    python tests/benchmark_loader.py [number-of-files [number-of-accoms]]
+"""
+import ConfigParser
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], ".."))
+from accomplishments.daemon import accomdb
+from accomplishments.daemon import loader
+
+ACCOMPLISHMENT = """[accomplishment]
+title=Benchmark Accomplishment %(n)d
+description=Accomplishment number %(n)d, generated for the benchmark
+summary=This is a long summary of the accomplishment, which spans several
+ lines, just like the summaries in the real collections do.
+ It goes on and on, describing why this accomplishment matters.
+steps=Open a web browser.
+ Go to http://www.example.com/%(n)d
+ Click on the big button.
+links=http://www.example.com http://www.example.org
+help=#ubuntu on Freenode
+pitfalls=Don't forget to actually click the button.
+tips=It helps to read the steps first.
+icon=default.png
+depends=benchmark/accomplishment-%(dep)d
+needs-signing=true
+needs-information=launchpad-email
+category=Benchmarks:Loading, Testing
+keywords=benchmark, loading, parser
+author=Benchmark Author <benchmark@example.com>
+"""
+
+
+def write_files(directory, count):
+    paths = []
+    for n in range(count):
+        path = os.path.join(directory, "accomplishment-%d.accomplishment" % n)
+        f = open(path, "w")
+        f.write(ACCOMPLISHMENT % {'n': n, 'dep': max(n - 1, 0)})
+        f.close()
+        paths.append(path)
+    return paths
+
+
+def write_collection(installpath, count):
+    collpath = os.path.join(installpath, "accomplishments", "benchmark")
+    os.makedirs(os.path.join(collpath, "en"))
+    os.makedirs(os.path.join(collpath, "extrainformation"))
+    f = open(os.path.join(collpath, "ABOUT"), "w")
+    f.write("[general]\nname = Benchmark\nlangdefault = en\n")
+    f.close()
+    write_files(os.path.join(collpath, "en"), count)
+
+
+def parse_with_configparser(path):
+    # This is how the loader used to read every .accomplishment file.
+    accomcfg = ConfigParser.RawConfigParser()
+    accomcfg.read(path)
+    accomdata = dict(accomcfg._sections["accomplishment"])
+    del accomdata['__name__']
+    return accomdata
+
+
+def measure(parse, paths, rounds=3):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        for path in paths:
+            parse(path)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark_parser(count):
+    directory = tempfile.mkdtemp()
+    try:
+        paths = write_files(directory, count)
+
+        # Both parsers have to agree, or there's no point in comparing them
+        for path in paths:
+            assert loader.parse_accomplishment_file(path) == \
+                parse_with_configparser(path)
+
+        old = measure(parse_with_configparser, paths)
+        new = measure(loader.parse_accomplishment_file, paths)
+    finally:
+        shutil.rmtree(directory)
+
+    print "Parsing %d .accomplishment files:" % count
+    print "  ConfigParser:               %8.3fs  (%6.0f files/s)" % (
+        old, count / old)
+    print "  parse_accomplishment_file:  %8.3fs  (%6.0f files/s)" % (
+        new, count / new)
+    print "  speedup:                    %8.2fx" % (old / new)
+
+
+def deep_size(obj, seen):
+    # The number of bytes taken by obj and everything it refers to, not
+    # counting objects that have been seen already (e.g. shared strings).
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif isinstance(obj, accomdb.AccomRecord):
+        # every slot, including the parsed values and the dict of extra
+        # fields, not just the fields values() hands out
+        for slot in type(obj).__slots__:
+            try:
+                value = getattr(obj, slot)
+            except AttributeError:
+                continue
+            size += deep_size(value, seen)
+    return size
+
+
+def accoms_size(entries):
+    seen = set()
+    size = 0
+    for key, data in entries.iteritems():
+        if data['type'] == "accomplishment":
+            size += deep_size(key, seen) + deep_size(data, seen)
+    return size
+
+
+def parse_collection_as(installpath, record_type):
+    original = accomdb.AccomRecord
+    accomdb.AccomRecord = record_type
+    try:
+        return loader.parse_collection(installpath, "benchmark", "en")
+    finally:
+        accomdb.AccomRecord = original
+
+
+def benchmark_memory(count):
+    installpath = tempfile.mkdtemp()
+    try:
+        write_collection(installpath, count)
+        # This is how accomplishments used to be stored
+        old = accoms_size(parse_collection_as(installpath, dict))
+        new = accoms_size(parse_collection_as(installpath,
+                                              accomdb.AccomRecord))
+    finally:
+        shutil.rmtree(installpath)
+
+    print "Memory used by %d accomplishments:" % count
+    print "  dict:          %10d bytes  (%5d bytes/accomplishment)" % (
+        old, old / count)
+    print "  AccomRecord:   %10d bytes  (%5d bytes/accomplishment)" % (
+        new, new / count)
+    print "  saved:         %9.1f%%" % (100.0 * (old - new) / old)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 5000
+    benchmark_parser(count)
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+    else:
+        count = 50000
+    benchmark_memory(count)
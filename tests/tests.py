@@ -4,16 +4,36 @@ Tests for accomplishments daemon.
 import unittest
 import sys
 import os
+import json
+import subprocess
 import tempfile
 import shutil
+import ConfigParser
+import cPickle
 import datetime
 import time
 import Image
 import gpgme
 from types import GeneratorType
+from twisted.internet import defer, process, reactor
+from twisted.python import failure, log
 
 sys.path.insert(0, os.path.join(os.path.split(__file__)[0], ".."))
+from accomplishments import exceptions
+from accomplishments.daemon import accomdb
+from accomplishments.daemon import backoff
 from accomplishments.daemon import api
+from accomplishments.daemon import depgraph
+from accomplishments.daemon import history
+from accomplishments.daemon import journal
+from accomplishments.daemon import loader
+from accomplishments.daemon import scheduler
+from accomplishments.daemon import search
+from accomplishments.daemon import status
+from accomplishments.daemon import trophies
+from accomplishments.daemon import verification
+from accomplishments.daemon import workers
+from accomplishments.daemon import zygote
 
 # These tests will modify the user's envrionment, outside of the test
 # dir and so are not written/skipped:
@@ -91,6 +111,32 @@ extrainfo_seen = 1""" % (self.td, self.td))
         fp.write(content)
         fp.close()
 
+    def util_wait_for(self, d, timeout=30):
+        # Spins the reactor until the Deferred **d** fires, and returns
+        # it's result. The reactor is not run, as it can not be started
+        # again once it has stopped, so children that have exited are
+        # reaped here; there is no SIGCHLD handler to do it.
+        results = []
+        d.addBoth(results.append)
+        deadline = time.time() + timeout
+        while not results and time.time() < deadline:
+            reactor.iterate(0.05)
+            process.reapAllProcesses()
+        self.assertTrue(results, "timed out waiting for a Deferred")
+        return results[0]
+
+    def util_process_is_running(self, pid):
+        # zombies do not count, whoever has inherited them may not have
+        # reaped them yet
+        try:
+            fp = open("/proc/%d/stat" % pid)
+        except IOError:
+            return False
+        try:
+            return fp.read().split(") ", 1)[1][0] != "Z"
+        finally:
+            fp.close()
+
     def setUp(self):
         self.td = tempfile.mkdtemp()
 
@@ -332,20 +378,44 @@ extrainfo_seen = 1""" % (self.td, self.td))
         a.write_extra_information_file("info", "whatever")
         a.write_extra_information_file("info2", "whatever2")
 
-        self.assertFalse(a._check_if_accom_is_accomplished("%s/first"
-                                                        % self.ACCOM_SET))
-        self.assertFalse(a._check_if_accom_is_accomplished("%s/second"
-                                                        % self.ACCOM_SET))
-        self.assertFalse(a._check_if_accom_is_accomplished("%s/third"
-                                                        % self.ACCOM_SET))
+        self.assertEqual(a._find_trophy_signature("%s/first"
+                                                  % self.ACCOM_SET),
+                         (False, None))
+        self.assertEqual(a._find_trophy_signature("%s/second"
+                                                  % self.ACCOM_SET),
+                         (False, None))
+        self.assertEqual(a._find_trophy_signature("%s/third"
+                                                  % self.ACCOM_SET),
+                         (False, None))
         self.assertTrue(a.accomplish("%s/first" % self.ACCOM_SET))
         a = api.Accomplishments(None, None, True)
-        self.assertTrue(a._check_if_accom_is_accomplished("%s/first"
-                                                       % self.ACCOM_SET))
-        self.assertFalse(a._check_if_accom_is_accomplished("%s/second"
-                                                        % self.ACCOM_SET))
-        self.assertFalse(a._check_if_accom_is_accomplished("%s/third"
-                                                        % self.ACCOM_SET))
+        self.assertEqual(a._find_trophy_signature("%s/first"
+                                                  % self.ACCOM_SET),
+                         (True, None))
+        self.assertEqual(a._find_trophy_signature("%s/second"
+                                                  % self.ACCOM_SET),
+                         (False, None))
+        self.assertEqual(a._find_trophy_signature("%s/third"
+                                                  % self.ACCOM_SET),
+                         (False, None))
+
+        # the trophies found by scan_trophies() give the same answers
+        found = trophies.scan_trophies(a.trophies_path,
+                                       a.list_collections())
+        self.assertEqual(a._find_trophy_signature("%s/first"
+                                                  % self.ACCOM_SET, found),
+                         (True, None))
+        self.assertEqual(a._find_trophy_signature("%s/second"
+                                                  % self.ACCOM_SET, found),
+                         (False, None))
+
+        # the test daemon verifies signatures right away
+        results = []
+        a._verify_if_accom_is_accomplished(
+            "%s/first" % self.ACCOM_SET).addCallback(results.append)
+        a._verify_if_accom_is_accomplished(
+            "%s/second" % self.ACCOM_SET).addCallback(results.append)
+        self.assertEqual(results, [True, False])
 
     # this tests:
     # accomplish()
@@ -496,11 +566,11 @@ extrainfo_seen = 1""" % (self.td, self.td))
         self.assertRaises(KeyError, a.get_accom_needs_signing, "wrong")
 
         # get_accom_depends
-        self.assertTrue(a.get_accom_depends("%s/first" % self.ACCOM_SET) == [])
+        self.assertTrue(a.get_accom_depends("%s/first" % self.ACCOM_SET) == ())
         deps = a.get_accom_depends("%s/second" % self.ACCOM_SET)
         self.assertEquals(len(deps), 1)
         self.assertTrue(deps[0] == "%s/first" % self.ACCOM_SET)
-        self.assertTrue(a.get_accom_depends("%s/third" % self.ACCOM_SET) == [])
+        self.assertTrue(a.get_accom_depends("%s/third" % self.ACCOM_SET) == ())
         self.assertRaises(KeyError, a.get_accom_depends, "wrong")
 
         # get_accom_is_unlocked
@@ -533,9 +603,9 @@ extrainfo_seen = 1""" % (self.td, self.td))
         for i in info:
             self.assertTrue(i in ["info", "info2"])
         self.assertEqual(a.get_accom_needs_info("%s/second" % self.ACCOM_SET),
-                         [])
+                         ())
         self.assertEqual(a.get_accom_needs_info("%s/third" % self.ACCOM_SET),
-                         [])
+                         ())
         self.assertRaises(KeyError, a.get_accom_needs_info, "wrong")
 
         # get_accom_collection
@@ -667,6 +737,861 @@ extrainfo_seen = 1""" % (self.td, self.td))
 
         self.util_remove_all_accoms(self.accom_dir)
 
+    def test_accom_database_snapshot(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+
+        a = api.Accomplishments(None, None, True)
+        snapshotpath = a._get_accom_database_snapshot_path()
+        self.assertTrue(os.path.exists(snapshotpath))
+
+        # nothing has changed, so a new daemon should not parse anything
+        parse_collection = loader.parse_collection
+        def fail(*args):
+            self.fail("parse_collection should not be called")
+        loader.parse_collection = fail
+        try:
+            b = api.Accomplishments(None, None, True)
+        finally:
+            loader.parse_collection = parse_collection
+        self.assertEqual(sorted(b.list_accoms()), sorted(a.list_accoms()))
+        self.assertEqual(b.accomdb_signature, a.accomdb_signature)
+        self.assertFalse(b.get_accom_is_unlocked("%s/second" % self.ACCOM_SET))
+
+        # a corrupted snapshot is simply ignored
+        self.util_write_file(os.path.dirname(snapshotpath),
+                             os.path.basename(snapshotpath), "garbage")
+        b = api.Accomplishments(None, None, True)
+        self.assertEqual(len(b.list_accoms()), 2)
+
+    def test_reload_accom_database_incremental(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        a = api.Accomplishments(None, None, True)
+
+        # nothing has changed
+        self.assertEqual(a.reload_accom_database(), [])
+
+        # add another collection
+        other_root = os.path.join(self.accoms_root, "otheraccom")
+        os.makedirs(os.path.join(other_root, self.LANG))
+        os.makedirs(os.path.join(other_root, "extrainformation"))
+        self.util_write_about_file(other_root)
+        self.util_write_file(os.path.join(other_root, self.LANG),
+                             "other.accomplishment",
+                             "[accomplishment]\n"
+                             "title=Another Accomplishment\n"
+                             "depends=%s/first\n" % self.ACCOM_SET)
+        self.assertEqual(a.reload_accom_database(), ["otheraccom"])
+        self.assertEqual(len(a.list_accoms()), 3)
+        self.assertTrue("otheraccom" in a.list_collections())
+        self.assertFalse(a.get_accom_is_unlocked("otheraccom/other"))
+
+        # only the modified collection is reloaded
+        self.util_copy_accom(self.accom_dir, "third")
+        self.assertEqual(a.reload_accom_database(), [self.ACCOM_SET])
+        self.assertEqual(len(a.list_accoms()), 4)
+        self.assertTrue(a.get_accom_is_unlocked("%s/third" % self.ACCOM_SET))
+
+        # editing a file in place does not touch it's directory, but is
+        # noticed as well
+        fp = open(os.path.join(other_root, self.LANG,
+                               "other.accomplishment"), "a")
+        fp.write("title=An Edited Accomplishment\n")
+        fp.close()
+        self.assertEqual(a.reload_accom_database(), ["otheraccom"])
+        self.assertEqual(a.get_accom_title("otheraccom/other"),
+                         "An Edited Accomplishment")
+
+        # and removed collections disappear
+        shutil.rmtree(other_root)
+        self.assertEqual(a.reload_accom_database(), ["otheraccom"])
+        self.assertEqual(len(a.list_accoms()), 3)
+        self.assertFalse("otheraccom" in a.list_collections())
+
+    def test_lazy_text_fields(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        fp = open(os.path.join(self.config_dir, ".accomplishments"), "a")
+        fp.write("\nlazy_text_fields = true\ntext_field_cache_size = 5\n")
+        fp.close()
+        a = api.Accomplishments(None, None, True)
+        self.assertTrue(a.lazy_text_fields)
+        self.assertEqual(a.text_field_cache.size, 5)
+
+        accomID = "%s/first" % self.ACCOM_SET
+        self.assertFalse('description' in a.accomDB[accomID])
+        self.assertEqual(a.get_accom_title(accomID),
+                         "My First Accomplishment")
+        self.assertEqual(a.get_accom_description(accomID),
+                         "An example accomplishment for the test suite")
+        data = a.get_accom_data(accomID)
+        self.assertEqual(data['description'],
+                         "An example accomplishment for the test suite")
+        self.assertFalse('file-path' in data)
+        self.assertFalse('description' in a.accomDB[accomID])
+
+        # the cache is bounded
+        a.text_field_cache.size = 1
+        a.get_accom_data("%s/second" % self.ACCOM_SET)
+        self.assertEqual(a.text_field_cache.entries.keys(),
+                         ["%s/second" % self.ACCOM_SET])
+
+        # changed texts are picked up after a reload
+        a.text_field_cache.size = 10
+        a.get_accom_description(accomID)
+        os.remove(os.path.join(self.accom_dir, "first.accomplishment"))
+        self.util_write_file(self.accom_dir, "first.accomplishment",
+                             "[accomplishment]\n"
+                             "title=My First Accomplishment\n"
+                             "description=Changed\n")
+        a.reload_accom_database()
+        self.assertEqual(a.get_accom_description(accomID), "Changed")
+
+        # texts of files that have gone away since are empty
+        second = "%s/second" % self.ACCOM_SET
+        a.text_field_cache.clear()
+        os.remove(os.path.join(self.accom_dir, "second.accomplishment"))
+        self.assertEqual(a.get_accom_description(second), "")
+        self.assertEqual(a.get_accom_title(second), "My Second Accomplishment")
+
+    def test_scriptrunner_concurrency(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        fp = open(os.path.join(self.config_dir, ".accomplishments"), "a")
+        fp.write("\nscript_concurrency = 2\n")
+        fp.close()
+        a = api.Accomplishments(None, None, True)
+        self.assertEqual(a.script_concurrency, 2)
+        runner = a.asyncapi
+        self.assertEqual(runner._get_script_concurrency(), 2)
+
+        started = {}
+        processed = []
+        runner._run_script = lambda accomID: started.setdefault(
+            accomID, defer.Deferred())
+        runner._process_script_result = \
+            lambda accomID, result: processed.append((accomID, result))
+        registered = api.dbusapi.daemon_is_registered
+        api.dbusapi.daemon_is_registered = lambda: True
+        try:
+            a.scripts_queue.extend(["a", "b", "c"])
+            runner.start_scriptrunner()
+        finally:
+            api.dbusapi.daemon_is_registered = registered
+        # no more than two scripts run at once
+        self.assertEqual(sorted(started), ["a", "b"])
+        # results are processed in the order the scripts were started in
+        started["b"].callback(1)
+        self.assertEqual(processed, [])
+        started["a"].callback(0)
+        self.assertEqual(processed, [("a", 0), ("b", 1)])
+        self.assertEqual(sorted(started), ["a", "b", "c"])
+        # scripts queued while the runner works are picked up
+        a.scripts_queue.add("d", scheduler.UNLOCKED)
+        started["c"].callback(api.NOT_RUN)
+        started["d"].callback(2)
+        self.assertEqual(processed[2:], [("c", api.NOT_RUN), ("d", 2)])
+        self.assertEqual(runner.scripts_state, api.NOT_RUNNING)
+
+    def test_script_timeout(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        fp = open(os.path.join(self.config_dir, ".accomplishments"), "a")
+        fp.write("\nscript_timeout = 60\n")
+        fp.close()
+        a = api.Accomplishments(None, None, True)
+        first = "%s/first" % self.ACCOM_SET
+        second = "%s/second" % self.ACCOM_SET
+        self.assertEqual(a.get_accom_script_timeout(first), 60)
+        a.accomDB[second]['script-timeout'] = "5"
+        self.assertEqual(a.get_accom_script_timeout(second), 5)
+        a.accomDB[second]['script-timeout'] = "soon"
+        self.assertEqual(a.get_accom_script_timeout(second), 60)
+
+        # a script that runs for too long is stopped, together with what
+        # it has started
+        script = os.path.join(self.td, "hang.sh")
+        pidfile = os.path.join(self.td, "child.pid")
+        self.util_write_file(self.td, "hang.sh",
+                             "#!/bin/sh\nsleep 100 &\necho $! > %s\n"
+                             "sleep 100\n" % pidfile)
+        os.chmod(script, 0755)
+        start = time.time()
+        result = self.util_wait_for(
+            api.AsyncAPI._run_a_subprocess([script], 1))
+        self.assertEqual(result, api.TIMED_OUT)
+        self.assertTrue(time.time() - start < 10)
+        childpid = int(open(pidfile).read())
+        for i in range(100):
+            if not self.util_process_is_running(childpid):
+                break
+            time.sleep(0.01)
+        self.assertFalse(self.util_process_is_running(childpid))
+
+        a.asyncapi._process_script_result(first, api.TIMED_OUT)
+        self.assertEqual(a.script_backoff.entries[first]['last'],
+                         backoff.ERROR)
+
+    def test_script_scheduler(self):
+        s = scheduler.ScriptScheduler()
+        s.extend(["a", "b", "c"])
+        s.add("d", scheduler.UNLOCKED)
+        # queued items are promoted, not duplicated
+        self.assertTrue(s.add("c", scheduler.INTERACTIVE))
+        self.assertFalse(s.add("c", scheduler.SWEEP))
+        self.assertFalse(s.add("a"))
+        self.assertEqual(len(s), 4)
+        self.assertTrue("c" in s)
+        self.assertEqual(s.lane_of("c"), scheduler.INTERACTIVE)
+        self.assertEqual(s.counts(),
+                         {'interactive': 1, 'unlocked': 1, 'sweep': 2})
+        self.assertEqual(list(s), ["c", "d", "a", "b"])
+        self.assertEqual(s.pop(), "c")
+        # an item taken from the queue can be queued again
+        s.add("c")
+        self.assertEqual([s.pop() for i in range(len(s))],
+                         ["d", "a", "b", "c"])
+        self.assertEqual(len(s), 0)
+        self.assertRaises(IndexError, s.pop)
+        self.assertEqual(s.lane_of("c"), None)
+
+    def test_script_backoff(self):
+        path = os.path.join(self.td, "script-backoff")
+        b = backoff.ScriptBackoff(path, base=10, cap=60)
+        self.assertTrue(b.is_due("a", 0))
+        b.record("a", backoff.NOT_ACCOMPLISHED, 0)
+        self.assertFalse(b.is_due("a", 9))
+        self.assertTrue(b.is_due("a", 10))
+        b.record("a", backoff.NOT_ACCOMPLISHED, 10)
+        self.assertFalse(b.is_due("a", 29))
+        self.assertTrue(b.is_due("a", 30))
+        # errors back off faster, up to the cap
+        b.record("b", backoff.ERROR, 0)
+        self.assertFalse(b.is_due("b", 19))
+        self.assertTrue(b.is_due("b", 20))
+        for i in range(10):
+            b.record("b", backoff.ERROR, 0)
+        self.assertFalse(b.is_due("b", 59))
+        self.assertTrue(b.is_due("b", 60))
+        # success forgets the history
+        b.record("b", backoff.ACCOMPLISHED, 0)
+        self.assertTrue(b.is_due("b", 0))
+
+        b.save()
+        b2 = backoff.ScriptBackoff(path, base=10, cap=60)
+        self.assertTrue(b2.load())
+        self.assertEqual(b2.entries, b.entries)
+        self.assertFalse(b2.is_due("a", 29))
+
+    def test_run_scripts_backoff(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        a = api.Accomplishments(None, None, True)
+        first = "%s/first" % self.ACCOM_SET
+        self.assertEqual(a.list_unlocked_not_accomplished(), [first])
+        a.asyncapi._process_script_result(first, 1)
+        # the sweep backs off, but an explicit request does not
+        a.run_scripts()
+        self.assertFalse(first in a.scripts_queue)
+        a.run_script(first)
+        self.assertEqual(a.scripts_queue.lane_of(first),
+                         scheduler.INTERACTIVE)
+        a.scripts_queue.clear()
+        a.run_scripts()
+        self.assertTrue(first in a.scripts_queue)
+
+        a.script_backoff.record(first, backoff.ERROR)
+        a.write_extra_information_file("unrelated", "data")
+        self.assertFalse(a.script_backoff.is_due(first))
+        a.accomDB[first]['needs-information'] = "launchpad-email"
+        a.write_extra_information_file("launchpad-email", "a@b.c")
+        self.assertTrue(a.script_backoff.is_due(first))
+
+        # scripts that were not run do not back off, those killed by a
+        # signal have failed
+        a.asyncapi._process_script_result(first, api.NOT_RUN)
+        self.assertFalse(first in a.script_backoff.entries)
+        a.asyncapi._process_script_result(first, None)
+        self.assertEqual(a.script_backoff.entries[first]['last'],
+                         backoff.ERROR)
+
+    def test_worker_pool_scripts(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        fp = open(os.path.join(self.config_dir, ".accomplishments"), "a")
+        fp.write("\nscript_worker_pool = true\n")
+        fp.close()
+        a = api.Accomplishments(None, None, True)
+        self.assertTrue(isinstance(a.worker_pool, workers.WorkerPool))
+
+        pyscript = os.path.join(self.td, "script.py")
+        shscript = os.path.join(self.td, "script.sh")
+        noext = os.path.join(self.td, "script")
+        for path, firstline in ((pyscript, "import sys"),
+                                (shscript, "#!/bin/sh"),
+                                (noext, "#!/usr/bin/env python")):
+            fp = open(path, "w")
+            fp.write(firstline + "\n")
+            fp.close()
+        self.assertTrue(workers.can_run(pyscript))
+        self.assertFalse(workers.can_run(shscript))
+        self.assertTrue(workers.can_run(noext))
+
+        accomID = "%s/first" % self.ACCOM_SET
+        self.assertTrue(a._can_use_worker_pool(accomID, pyscript))
+        self.assertFalse(a._can_use_worker_pool(accomID, shscript))
+        a.accomDB[accomID]['script-worker-pool'] = "false"
+        self.assertFalse(a._can_use_worker_pool(accomID, pyscript))
+
+        # exit statuses are the same as the interpreter's
+        self.assertEqual(zygote._exit_code(None), 0)
+        self.assertEqual(zygote._exit_code(4), 4)
+        self.assertEqual(zygote._exit_code(258), 2)
+
+    def test_zygote(self):
+        scripts = {
+            1: "import sys\nsys.exit(0)\n",
+            2: "import sys\nsys.exit(1)\n",
+            3: "import sys\nsys.exit(2)\n",
+            4: "import os\nos._exit(4)\n",
+            5: "raise ValueError('broken script')\n",
+            6: "import time\ntime.sleep(100)\n",
+        }
+        requests = []
+        for requestid, content in sorted(scripts.items()):
+            name = "script%d.py" % requestid
+            self.util_write_file(self.td, name, content)
+            requests.append(json.dumps({
+                'id': requestid, 'script': os.path.join(self.td, name),
+                'timeout': 1 if requestid == 6 else None}))
+
+        # results are written to RESULTS_FD, as they would be to the
+        # daemon
+        rfd, wfd = os.pipe()
+
+        def pass_results_fd():
+            os.dup2(wfd, zygote.RESULTS_FD)
+
+        devnull = open(os.devnull, "w")
+        proc = subprocess.Popen(
+            [sys.executable, workers.ZYGOTE_PATH], stdin=subprocess.PIPE,
+            stdout=devnull, stderr=devnull, close_fds=False,
+            preexec_fn=pass_results_fd)
+        os.close(wfd)
+        resultsfile = os.fdopen(rfd)
+        try:
+            proc.stdin.write("\n".join(requests) + "\n")
+            proc.stdin.flush()
+            # every script is acknowledged once it has been started,
+            # before it's result
+            started = set()
+            results = []
+            while len(results) < len(requests):
+                result = json.loads(resultsfile.readline())
+                if result.get('started'):
+                    started.add(result['id'])
+                else:
+                    self.assertTrue(result['id'] in started)
+                    results.append(result)
+            # closing stdin makes the zygote exit, as if the daemon has
+            # gone away
+            proc.stdin.close()
+            self.assertEqual(proc.wait(), 0)
+        finally:
+            resultsfile.close()
+            devnull.close()
+        results = dict((r['id'], r) for r in results)
+        self.assertEqual(results, {
+            1: {'id': 1, 'exitcode': 0},
+            2: {'id': 2, 'exitcode': 1},
+            3: {'id': 3, 'exitcode': 2},
+            4: {'id': 4, 'exitcode': 4},
+            5: {'id': 5, 'exitcode': 1},
+            6: {'id': 6, 'timed-out': True},
+        })
+
+    def test_worker_pool_stops(self):
+        pool = workers.WorkerPool()
+        results = {}
+        for requestid in (1, 2, 3):
+            d = pool.pending[requestid] = defer.Deferred()
+            d.addErrback(lambda f: f.type)
+            d.addCallback(lambda r, requestid=requestid:
+                          results.__setitem__(requestid, r))
+        pool._result({'id': 1, 'started': True})
+        pool._result({'id': 2, 'started': True})
+        pool._result({'id': 2, 'exitcode': 0})
+        self.assertEqual(pool.started, set([1]))
+
+        # the zygote stops: the script it has started is lost, the one it
+        # has not can still be run some other way
+        pool._ended(failure.Failure(RuntimeError("zygote died")))
+        self.assertEqual(results, {
+            1: exceptions.ScriptLost,
+            2: 0,
+            3: exceptions.WorkerPoolError,
+        })
+        self.assertEqual(pool.pending, {})
+        self.assertEqual(pool.started, set())
+
+    def test_accom_record(self):
+        data = {
+            'title': "Title",
+            'collection': "".join(["test", "accom"]),
+            'categories': ["Launchpad"],
+            'some-other-field': "value",
+        }
+        record = accomdb.AccomRecord(data)
+        self.assertEqual(record, data)
+        self.assertEqual(dict(record), data)
+        self.assertEqual(sorted(record.keys()), sorted(data.keys()))
+        self.assertEqual(record['title'], "Title")
+        self.assertEqual(record['some-other-field'], "value")
+        self.assertTrue('title' in record)
+        self.assertFalse('icon' in record)
+        self.assertRaises(KeyError, lambda: record['icon'])
+        self.assertEqual(record.get('icon', "default.png"), "default.png")
+        # values shared by many accomplishments are interned
+        self.assertTrue(record['collection'] is intern("testaccom"))
+
+        record['locked'] = True
+        del record['some-other-field']
+        self.assertEqual(record.pop('title'), "Title")
+        self.assertEqual(dict(record), {
+            'collection': "testaccom",
+            'categories': ["Launchpad"],
+            'locked': True,
+        })
+        self.assertRaises(KeyError, record.__delitem__, 'title')
+
+        # list fields are parsed as soon as they are set
+        self.assertEqual(record.parsed_depends, ())
+        self.assertEqual(record.parsed_keywords, ("",))
+        self.assertFalse(record.parsed_needs_signing)
+        record['depends'] = "testaccom/first, testaccom/second"
+        record['needs-information'] = "info"
+        record['needs-signing'] = "true"
+        self.assertEqual(record.parsed_depends,
+                         ("testaccom/first", "testaccom/second"))
+        self.assertEqual(record.parsed_needs_info, ("info",))
+        self.assertTrue(record.parsed_needs_signing)
+        record['needs-signing'] = "no"
+        self.assertFalse(record.parsed_needs_signing)
+
+        copy = cPickle.loads(cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL))
+        self.assertTrue(isinstance(copy, accomdb.AccomRecord))
+        self.assertEqual(copy, record)
+        self.assertTrue(copy['collection'] is intern("testaccom"))
+        self.assertEqual(copy.parsed_depends,
+                         ("testaccom/first", "testaccom/second"))
+
+        del record['depends']
+        self.assertEqual(record.parsed_depends, ())
+
+    def test_accom_db_indexes(self):
+        db = accomdb.AccomDB({
+            "col": {'type': "collection"},
+            "col:set": {'type': "set"},
+            "col/b": accomdb.AccomRecord({'type': "accomplishment"}),
+            "col/a": accomdb.AccomRecord({'type': "accomplishment"}),
+            "other": {'type': "collection"},
+            "other/c": accomdb.AccomRecord({'type': "accomplishment"}),
+        })
+        self.assertEqual(db.keys_of_type("accomplishment"),
+                         ("col/a", "col/b", "other/c"))
+        self.assertEqual(db.keys_of_type("collection"), ("col", "other"))
+        self.assertEqual(db.keys_of_type("set"), ("col:set",))
+        self.assertEqual(sorted(db.keys_of_collection("col")),
+                         ["col", "col/a", "col/b", "col:set"])
+
+        del db["col/a"]
+        db["other/d"] = accomdb.AccomRecord({'type': "accomplishment"})
+        self.assertEqual(db.keys_of_type("accomplishment"),
+                         ("col/b", "other/c", "other/d"))
+        self.assertEqual(sorted(db.keys_of_collection("other")),
+                         ["other", "other/c", "other/d"])
+        for key in db.keys_of_collection("other"):
+            del db[key]
+        self.assertEqual(db.keys_of_collection("other"), [])
+        self.assertEqual(db.keys_of_type("collection"), ("col",))
+
+        # reverse dependencies
+        db["col/e"] = accomdb.AccomRecord({'type': "accomplishment",
+                                           'depends': "col/b, col/gone"})
+        db["col/f"] = accomdb.AccomRecord({'type': "accomplishment",
+                                           'depends': "col/b"})
+        self.assertEqual(db.dependents_of("col/b"), ["col/e", "col/f"])
+        self.assertEqual(db.dependents_of("col/gone"), ["col/e"])
+        self.assertEqual(db.dependents_of("col/e"), [])
+        del db["col/e"]
+        self.assertEqual(db.dependents_of("col/b"), ["col/f"])
+        self.assertEqual(db.dependents_of("col/gone"), [])
+
+        # indexes are rebuilt when unpickling
+        copy = cPickle.loads(cPickle.dumps(db, cPickle.HIGHEST_PROTOCOL))
+        self.assertTrue(isinstance(copy, accomdb.AccomDB))
+        self.assertEqual(copy, db)
+        self.assertEqual(copy.keys_of_type("accomplishment"),
+                         ("col/b", "col/f"))
+        self.assertEqual(copy.dependents_of("col/b"), ["col/f"])
+
+    def test_dependency_graph(self):
+        def accom(depends=None):
+            data = {'type': "accomplishment"}
+            if depends is not None:
+                data['depends'] = depends
+            return accomdb.AccomRecord(data)
+
+        db = accomdb.AccomDB({
+            "col/a": accom(),
+            "col/b": accom("col/a"),
+            "col/c": accom("col/b, col/a"),
+            "col/d": accom("col/missing"),
+            "col/e": accom("col/f"),
+            "col/f": accom("col/g"),
+            "col/g": accom("col/e"),
+            "col/h": accom("col/h"),
+            "col/i": accom("col/g"),
+            "col/j": accom(""),
+        })
+        graph = depgraph.DependencyGraph(db)
+
+        self.assertEqual(graph.cycles,
+                         [["col/e", "col/f", "col/g"], ["col/h"]])
+        self.assertEqual(graph.quarantined,
+                         frozenset(["col/e", "col/f", "col/g", "col/h"]))
+        self.assertEqual(graph.dangling, {"col/d": ("col/missing",)})
+
+        # every accomplishment comes after it's dependencies
+        self.assertEqual(sorted(graph.order), sorted(db.keys()))
+        position = dict((a, i) for i, a in enumerate(graph.order))
+        self.assertTrue(position["col/a"] < position["col/b"] <
+                        position["col/c"])
+
+        accomplished = set(["col/a", "col/e", "col/f", "col/g"])
+        is_accomplished = accomplished.__contains__
+        self.assertFalse(graph.is_locked("col/a", is_accomplished))
+        self.assertFalse(graph.is_locked("col/b", is_accomplished))
+        self.assertTrue(graph.is_locked("col/c", is_accomplished))
+        self.assertTrue(graph.is_locked("col/d", is_accomplished))
+        self.assertTrue(graph.is_locked("col/e", is_accomplished))
+        self.assertFalse(graph.is_locked("col/i", is_accomplished))
+        self.assertFalse(graph.is_locked("col/j", is_accomplished))
+
+    def test_broken_dependencies(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_write_file(self.accom_dir, "dangling.accomplishment",
+                             "[accomplishment]\n"
+                             "title=Dangling\n"
+                             "depends=%s/nothere\n" % self.ACCOM_SET)
+        self.util_write_file(self.accom_dir, "cycle.accomplishment",
+                             "[accomplishment]\n"
+                             "title=Cycle\n"
+                             "depends=%s/cycle\n" % self.ACCOM_SET)
+        self.util_write_file(self.accom_dir, "needscycle.accomplishment",
+                             "[accomplishment]\n"
+                             "title=Depends on a cycle\n"
+                             "depends=%s/cycle\n" % self.ACCOM_SET)
+        a = api.Accomplishments(None, None, True)
+
+        self.assertTrue(a.get_accom_is_unlocked("%s/first" % self.ACCOM_SET))
+        self.assertFalse(
+            a.get_accom_is_unlocked("%s/dangling" % self.ACCOM_SET))
+        self.assertFalse(a.get_accom_is_unlocked("%s/cycle" % self.ACCOM_SET))
+        self.assertFalse(
+            a.get_accom_is_unlocked("%s/needscycle" % self.ACCOM_SET))
+
+        # the dependency appears
+        self.util_write_file(self.accom_dir, "nothere.accomplishment",
+                             "[accomplishment]\n"
+                             "title=Now it is here\n")
+        a.reload_accom_database()
+        self.assertEqual(a.depgraph.dangling, {})
+        self.assertFalse(
+            a.get_accom_is_unlocked("%s/dangling" % self.ACCOM_SET))
+        self.assertEqual(a._mark_as_accomplished(
+            "%s/nothere" % self.ACCOM_SET), ["%s/dangling" % self.ACCOM_SET])
+        self.assertTrue(
+            a.get_accom_is_unlocked("%s/dangling" % self.ACCOM_SET))
+
+    def test_status_vectors(self):
+        modes = [False]
+        if status.useNumpy:
+            modes.append(True)
+        for use_numpy in modes:
+            vectors = status.StatusVectors(
+                ["col/b", "col/a", "other/c", "col2/d"], use_numpy=use_numpy)
+            self.assertEqual(vectors.accoms,
+                             ["col/a", "col/b", "col2/d", "other/c"])
+            vectors.set("col/a", status.ACCOMPLISHED, True)
+            vectors.set("col/b", status.LOCKED, True)
+            vectors.set("other/c", status.LOCKED, True)
+            vectors.set("other/c", status.LOCKED, False)
+            self.assertTrue(vectors.get("col/a", status.ACCOMPLISHED))
+            self.assertFalse(vectors.get("other/c", status.LOCKED))
+
+            self.assertEqual(vectors.select(status.ACCOMPLISHED), ["col/a"])
+            self.assertEqual(vectors.select(status.LOCKED, 0),
+                             ["col/a", "col2/d", "other/c"])
+            self.assertEqual(
+                vectors.select(status.LOCKED | status.ACCOMPLISHED, 0),
+                ["col2/d", "other/c"])
+            self.assertEqual(vectors.select(0, 0, "col"), ["col/a", "col/b"])
+            self.assertEqual(vectors.select(0, 0, "nothing"), [])
+            self.assertEqual(vectors.count(status.LOCKED, 0), 3)
+            self.assertEqual(vectors.count(status.LOCKED, 0, "col"), 1)
+
+            # the status of known accomplishments is kept
+            vectors = status.StatusVectors(["col/a", "col/e"], vectors)
+            self.assertTrue(vectors.get("col/a", status.ACCOMPLISHED))
+            self.assertFalse(vectors.get("col/e", status.ACCOMPLISHED))
+
+    def test_list_by_status(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        self.util_copy_accom(self.accom_dir, "third")
+        a = api.Accomplishments(None, None, True)
+        first = "%s/first" % self.ACCOM_SET
+        second = "%s/second" % self.ACCOM_SET
+        third = "%s/third" % self.ACCOM_SET
+
+        self.assertEqual(a.list_trophies(), [])
+        self.assertEqual(a.list_opportunities(), [first, second, third])
+        self.assertEqual(a.list_unlocked(), [first, third])
+        self.assertEqual(a.list_unlocked_not_accomplished(), [first, third])
+        self.assertEqual(a.get_collection_progress(self.ACCOM_SET),
+                         {'total': 3, 'accomplished': 0, 'unlocked': 2})
+
+        # only third has a script, and first needs extra information
+        self.util_write_file(self.script_root, "third.py", "print 'hello'")
+        a.reload_accom_database()
+        self.assertEqual(a.list_runnable(), [third])
+
+        trophydir = os.path.join(self.trophy_dir, self.ACCOM_SET)
+        os.makedirs(trophydir)
+        self.util_write_file(trophydir, "first.trophy",
+                             "[trophy]\ndate-accomplished = 2012-06-01 10:00\n")
+        self.assertEqual(a._mark_as_accomplished(first), [second])
+        self.assertEqual(a.list_trophies(), [first])
+        self.assertEqual(a.list_unlocked(), [first, second, third])
+        self.assertEqual(a.list_unlocked_not_accomplished(), [second, third])
+        self.assertEqual(a.get_collection_progress(self.ACCOM_SET),
+                         {'total': 3, 'accomplished': 1, 'unlocked': 2})
+        self.assertEqual(a.list_recent_trophies(5), [first])
+        self.assertEqual(a.list_trophies_between("2012-06", "2012-06"),
+                         [first])
+        self.assertEqual(a.list_trophies_between("2012-07", ""), [])
+        self.assertEqual(a.get_trophy_counts_by_day("", ""),
+                         {"2012-06-01": 1})
+        self.assertRaises(KeyError, a.get_collection_progress, "wrong")
+
+    def test_trophy_history(self):
+        h = history.TrophyHistory()
+        h.add("c/a", "2012-06-01 10:00")
+        h.add("c/b", "2012-06-30 23:59")
+        h.add("c/c", "2012-07-01 00:00")
+        h.add("c/d", "2012-06-01 09:00")
+        h.add("c/e", None)
+        h.add("c/f", "None")
+        self.assertEqual(len(h), 4)
+
+        self.assertEqual(h.between("2012-06-01", "2012-06-30"),
+                         ["c/d", "c/a", "c/b"])
+        self.assertEqual(h.between("2012-06-01 09:30", "2012-06"),
+                         ["c/a", "c/b"])
+        self.assertEqual(h.between("2012-07", ""), ["c/c"])
+        self.assertEqual(h.between("", ""), ["c/d", "c/a", "c/b", "c/c"])
+        self.assertEqual(h.recent(2), ["c/c", "c/b"])
+        self.assertEqual(h.recent(0), [])
+        self.assertEqual(h.counts_by_day("2012-06", "2012-07-01"),
+                         {"2012-06-01": 2, "2012-06-30": 1, "2012-07-01": 1})
+
+        h.add("c/c", "2012-05-01 00:00")
+        self.assertEqual(h.recent(1), ["c/b"])
+        h.remove("c/b")
+        h.remove("c/b")
+        h.add("c/a", "None")
+        self.assertEqual(h.between("", ""), ["c/c", "c/d"])
+
+    def test_search_index(self):
+        index = search.SearchIndex()
+        index.add("c/lp", "Registered on Launchpad", ("launchpad", "lp"),
+                  ["Launchpad"])
+        index.add("c/bug", "Filed a bug", ("launchpad", "bugs"), ["Launchpad"])
+        index.add("c/ask", "Asked a question", ("askubuntu",), ["Ask Ubuntu"])
+        self.assertEqual(len(index), 3)
+
+        # titles rank before keywords, exact words before prefixes
+        self.assertEqual(index.search("launchpad"), ["c/lp", "c/bug"])
+        self.assertEqual(index.search("LAUNCH"), ["c/lp", "c/bug"])
+        self.assertEqual(index.search("ask"), ["c/ask"])
+        self.assertEqual(index.search("a"), ["c/ask", "c/bug"])
+        # all words have to match
+        self.assertEqual(index.search("launchpad bug"), ["c/bug"])
+        self.assertEqual(index.search("launchpad question"), [])
+        self.assertEqual(index.search(""), [])
+        self.assertEqual(index.search("launchpad", 1), ["c/lp"])
+        self.assertEqual(index.search("launchpad",
+                                      accept=lambda a: a != "c/lp"), ["c/bug"])
+
+        index.add("c/lp", "Signed the Code of Conduct", (), [])
+        self.assertEqual(index.search("launchpad"), ["c/bug"])
+        index.remove("c/bug")
+        index.remove("c/bug")
+        self.assertEqual(index.search("launchpad"), [])
+        self.assertEqual(index.search("code"), ["c/lp"])
+
+    def test_search_accoms(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        a = api.Accomplishments(None, None, True)
+        first = "%s/first" % self.ACCOM_SET
+        second = "%s/second" % self.ACCOM_SET
+        third = "%s/third" % self.ACCOM_SET
+
+        self.assertEqual(a.search_accoms("my accomp"), [first, second])
+        self.assertEqual(a.search_accoms("my", 1), [first])
+        self.assertEqual(a.search_accoms("my", 0, "locked"), [second])
+        self.assertEqual(a.search_accoms("my", 0, "opportunity"), [first])
+        self.assertEqual(a.search_accoms("my", 0, "accomplished"), [])
+        self.assertRaises(ValueError, a.search_accoms, "my", 0, "wrong")
+
+        # the index follows changes to installed accomplishments
+        self.util_copy_accom(self.accom_dir, "third")
+        a.reload_accom_database()
+        self.assertEqual(a.search_accoms("third"), [third])
+        self.assertEqual(a.search_accoms("unit"), [third])
+        os.remove(os.path.join(self.accom_dir, "first.accomplishment"))
+        a.reload_accom_database()
+        self.assertEqual(a.search_accoms("first"), [])
+
+    def test_parse_collections_parallel(self):
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        tasks = [(os.path.join(self.td, "accomplishments"), self.ACCOM_SET,
+                  self.LANG)]
+        for i in range(loader.PARALLEL_MIN_COLLECTIONS):
+            name = "collection%d" % i
+            root = os.path.join(self.accoms_root, name)
+            shutil.copytree(self.accom_root, root)
+            tasks.append((os.path.join(self.td, "accomplishments"), name,
+                          self.LANG))
+
+        # workers leave logging to the daemon
+        self.util_write_file(os.path.join(self.accoms_root, "collection0",
+                                          self.LANG),
+                             "broken.accomplishment", "[accomplishment]\n"
+                             "title\n")
+        messages = []
+        log.addObserver(messages.append)
+        try:
+            serial = loader.parse_collections(tasks, 1)
+            serial_messages = len(messages)
+            parallel = loader.parse_collections(tasks, 2)
+        finally:
+            log.removeObserver(messages.append)
+        self.assertEqual(len(parallel), len(tasks))
+        self.assertEqual(serial, parallel)
+        self.assertTrue("collection0/first" in parallel[1])
+        self.assertTrue(any("broken.accomplishment" in " ".join(m['message'])
+                            for m in messages[serial_messages:]))
+
+        # if the pool fails, collections are parsed one by one
+        def broken_pool(processes):
+            raise OSError("cannot fork")
+        pool = loader.multiprocessing.Pool
+        loader.multiprocessing.Pool = broken_pool
+        try:
+            self.assertEqual(loader.parse_collections(tasks, 2), serial)
+        finally:
+            loader.multiprocessing.Pool = pool
+
+    def test_parse_accomplishment_file(self):
+        self.util_write_file(self.accom_dir, "long.accomplishment",
+                             "# a comment\n"
+                             "[accomplishment]\n"
+                             "Title = Long Accomplishment ; inline comment\n"
+                             "description: one;two\n"
+                             "steps=First step.\n"
+                             "  Second step.\n"
+                             "\n"
+                             "  Third step.\n"
+                             "empty=\"\"\n")
+        data = loader.parse_accomplishment_file(
+            os.path.join(self.accom_dir, "long.accomplishment"))
+        self.assertEqual(data, {
+            'title': "Long Accomplishment",
+            'description': "one;two",
+            'steps': "First step.\nSecond step.\nThird step.",
+            'empty': ""})
+
+        # the same data as ConfigParser would return
+        testdir = os.path.dirname(__file__)
+        path = os.path.join(testdir, "accoms", "third.accomplishment")
+        cfg = ConfigParser.RawConfigParser()
+        cfg.read(path)
+        expected = dict(cfg._sections["accomplishment"])
+        del expected['__name__']
+        self.assertEqual(loader.parse_accomplishment_file(path), expected)
+
+        self.util_write_file(self.accom_dir, "bad.accomplishment",
+                             "[accomplishment]\n"
+                             "descriptionbad desc\n")
+        self.assertRaises(ConfigParser.ParsingError,
+                          loader.parse_accomplishment_file,
+                          os.path.join(self.accom_dir, "bad.accomplishment"))
+        self.util_write_file(self.accom_dir, "bad.accomplishment",
+                             "title=No section\n")
+        self.assertRaises(ConfigParser.ParsingError,
+                          loader.parse_accomplishment_file,
+                          os.path.join(self.accom_dir, "bad.accomplishment"))
+        self.util_write_file(self.accom_dir, "bad.accomplishment",
+                             "[something]\n"
+                             "title=Wrong section\n")
+        self.assertRaises(ConfigParser.ParsingError,
+                          loader.parse_accomplishment_file,
+                          os.path.join(self.accom_dir, "bad.accomplishment"))
+
+    def test_translation_index(self):
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        os.makedirs(os.path.join(self.accom_dir, "someset"))
+        self.util_copy_accom(os.path.join(self.accom_dir, "someset"), "third")
+        os.makedirs(os.path.join(self.accom_root, "pt", "someset"))
+        self.util_copy_accom(os.path.join(self.accom_root, "pt"), "first")
+        self.util_copy_accom(os.path.join(self.accom_root, "pt", "someset"),
+                             "third")
+        os.makedirs(os.path.join(self.accom_root, "pt_BR"))
+        self.util_copy_accom(os.path.join(self.accom_root, "pt_BR"), "second")
+
+        index = loader.TranslationIndex(self.accom_root, "pt_BR", self.LANG)
+        self.assertEqual(index.resolve("first.accomplishment"),
+                         (os.path.join(self.accom_root, "pt",
+                                       "first.accomplishment"), "pt"))
+        self.assertEqual(index.resolve("second.accomplishment"),
+                         (os.path.join(self.accom_root, "pt_BR",
+                                       "second.accomplishment"), "pt_BR"))
+        self.assertEqual(index.resolve("someset/third.accomplishment"),
+                         (os.path.join(self.accom_root, "pt", "someset",
+                                       "third.accomplishment"), "pt"))
+        self.assertEqual(index.resolve("fourth.accomplishment"),
+                         (os.path.join(self.accom_dir,
+                                       "fourth.accomplishment"), self.LANG))
+
+        # a language that is not available at all
+        index = loader.TranslationIndex(self.accom_root, "de_DE", self.LANG)
+        self.assertEqual(index.resolve("first.accomplishment"),
+                         (os.path.join(self.accom_dir,
+                                       "first.accomplishment"), self.LANG))
+
     def test_missing_about_file(self):
         os.remove(os.path.join(self.accom_root, "ABOUT"))
         self.assertRaises(LookupError, api.Accomplishments, None, None, True)
@@ -694,6 +1619,13 @@ extrainfo_seen = 1""" % (self.td, self.td))
         a.reload_accom_database()
         self.assertEqual(len(a.list_accoms()), 1)
 
+        # files that cannot be read are skipped as well
+        os.remove(os.path.join(self.accom_dir, "bad.accomplishment"))
+        os.symlink(os.path.join(self.td, "missing"),
+                   os.path.join(self.accom_dir, "bad.accomplishment"))
+        a.reload_accom_database()
+        self.assertEqual(len(a.list_accoms()), 1)
+
         # cleanup
         self.util_remove_all_accoms(self.accom_dir)
 
@@ -777,6 +1709,255 @@ extrainfo_seen = 1""" % (self.td, self.td))
         self.assertTrue(a.get_trophy_path("%s/third" %
                                           self.ACCOM_SET).endswith("third.trophy"))
 
+    def test_scan_trophies(self):
+        trophydir = os.path.join(self.trophy_dir, self.ACCOM_SET)
+        os.makedirs(trophydir)
+        self.util_write_file(trophydir, "first.trophy",
+                             "[trophy]\ndate-accomplished = 2012-06-01\n")
+        self.util_write_file(trophydir, "second.trophy", "[trophy]\n")
+        self.util_write_file(trophydir, "third.trophy.asc", "signature")
+        self.util_write_file(trophydir, "README", "not a trophy")
+        os.makedirs(os.path.join(self.trophy_dir, ".extrainformation"))
+        self.util_write_file(os.path.join(self.trophy_dir, ".extrainformation"),
+                             "info", "someone")
+
+        found = trophies.scan_trophies(self.trophy_dir)
+        first = "%s/first" % self.ACCOM_SET
+        second = "%s/second" % self.ACCOM_SET
+        third = "%s/third" % self.ACCOM_SET
+        self.assertEqual(sorted(found), [first, second, third])
+        self.assertTrue(found[first].trophy is not None)
+        self.assertEqual(found[first].asc, None)
+        # second needs a signature, which is not there
+        self.assertEqual(found[second].asc, None)
+        self.assertEqual(found[third].trophy, None)
+        self.assertEqual(found[third].asc.st_size, len("signature"))
+        self.assertEqual(trophies.scan_trophies(self.trophy_dir, ["wrong"]),
+                         {})
+        self.assertEqual(trophies.scan_trophies("/nonexistent"), {})
+
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "second")
+        self.util_copy_accom(self.accom_dir, "third")
+        a = api.Accomplishments(None, None, True)
+        self.assertEqual(a.list_trophies(), [first])
+        self.assertEqual(a.get_accom_date_accomplished(first), "2012-06-01")
+
+    def test_trophy_cache(self):
+        self.util_write_file(self.td, "first.trophy",
+                             "[trophy]\nid = first\n"
+                             "date-accomplished = 2012-06-01\n")
+        trophypath = os.path.join(self.td, "first.trophy")
+        cachepath = os.path.join(self.td, "trophies.cache")
+        cache = trophies.TrophyCache(cachepath)
+        self.assertFalse(cache.load())
+
+        data = cache.get(trophypath)
+        self.assertEqual(data['date-accomplished'], "2012-06-01")
+        # returned dicts are copies
+        data['id'] = "changed"
+        self.assertEqual(cache.get(trophypath)['id'], "first")
+        self.assertEqual(cache.get(os.path.join(self.td, "wrong.trophy")),
+                         None)
+        cache.save()
+        self.assertFalse(cache.dirty)
+
+        # unchanged files are not parsed again
+        cache = trophies.TrophyCache(cachepath)
+        self.assertTrue(cache.load())
+        key, contents = cache.entries[trophypath]
+        cache.entries[trophypath] = (key, {'id': "cached"})
+        self.assertEqual(cache.get(trophypath), {'id': "cached"})
+        # but a different size, mtime or inode means the file has changed
+        self.util_write_file(self.td, "first.trophy",
+                             "[trophy]\nid = first-changed\n")
+        self.assertEqual(cache.get(trophypath)['id'], "first-changed")
+
+        self.util_write_file(self.td, "broken.trophy", "no section\n")
+        self.assertEqual(cache.get(os.path.join(self.td, "broken.trophy")),
+                         {})
+        cache.retain([trophypath])
+        self.assertEqual(cache.entries.keys(), [trophypath])
+
+    def test_signature_cache(self):
+        cachepath = os.path.join(self.td, "signatures.cache")
+        cache = trophies.SignatureCache(cachepath)
+        digest = trophies.signature_digest("[trophy]\n", "signature")
+        self.assertNotEqual(
+            digest, trophies.signature_digest("[trophy]\ns", "ignature"))
+
+        # nothing is recorded before the keys are known
+        cache.add(digest, "AAAA")
+        self.assertFalse(cache.is_verified(digest))
+        cache.set_keys((("AAAA", True), ("BBBB", False)))
+        cache.add(digest, "AAAA")
+        self.assertTrue(cache.is_verified(digest))
+        # signatures made with other or unusable keys are not recorded
+        other = trophies.signature_digest("other", "signature")
+        cache.add(other, "BBBB")
+        cache.add(other, "CCCC")
+        self.assertFalse(cache.is_verified(other))
+        cache.save()
+
+        cache = trophies.SignatureCache(cachepath)
+        self.assertTrue(cache.load())
+        self.assertTrue(cache.is_verified(digest))
+        cache.set_keys((("AAAA", True), ("BBBB", False)))
+        self.assertTrue(cache.is_verified(digest))
+        # the key got revoked
+        cache.set_keys((("AAAA", False), ("BBBB", False)))
+        self.assertFalse(cache.is_verified(digest))
+        self.assertEqual(len(cache), 0)
+
+    def test_verify_many(self):
+        self.util_write_file(self.td, "first.trophy", "[trophy]\n")
+        self.util_write_file(self.td, "first.trophy.asc", "signature")
+        self.util_write_file(self.td, "second.trophy.asc", "signature")
+        first = os.path.join(self.td, "first.trophy.asc")
+        second = os.path.join(self.td, "second.trophy.asc")
+        cache = trophies.SignatureCache()
+        cache.set_keys((("AAAA", True),))
+        cache.add(trophies.signature_digest("[trophy]\n", "signature"),
+                  "AAAA")
+        verifier = verification.SignatureVerifier(cache, synchronous=True)
+
+        results = []
+        verifier.verify_many([first, second, first]).addCallback(
+            results.append)
+        # the reactor is not running, so this is done already
+        self.assertEqual(results, [{first: True, second: False}])
+        results = []
+        verifier.verify(second).addCallback(results.append)
+        self.assertEqual(results, [False])
+
+        # Before the reactor runs, only cached trophies are known
+        verifier = verification.SignatureVerifier(cache)
+        results = []
+        verifier.verify(first).addCallback(results.append)
+        verifier.verify(second).addCallback(results.append)
+        self.assertEqual(results, [True])
+        self.assertEqual(verifier.pending, 1)
+
+    def test_startup_progress(self):
+        a = api.Accomplishments(None, None, True)
+        # In test mode, the startup completes right away
+        self.assertEqual(a.get_startup_progress(), {
+            'stage': "ready", 'completed': 3, 'stages': 3,
+            'pending-signatures': 0, 'ready': True})
+
+        a.startup_stage = "icons"
+        self.assertEqual(a.get_startup_progress()['completed'], 1)
+        self.assertFalse(a.get_startup_progress()['ready'])
+        a.run_scripts()
+        a.run_scripts(["%s/first" % self.ACCOM_SET])
+        self.assertEqual(a.postponed_script_runs,
+                         [(None, scheduler.SWEEP),
+                          (["%s/first" % self.ACCOM_SET],
+                           scheduler.INTERACTIVE)])
+        self.assertEqual(len(a.scripts_queue), 0)
+
+    def test_startup_stage_fails(self):
+        a = api.Accomplishments(None, None, True)
+        self.assertTrue(a.startup_complete.called)
+
+        def fail(collection):
+            raise OSError("no space left on device")
+        a.create_trophy_icons = fail
+        runs = []
+        a.run_scripts = lambda which, lane: runs.append((which, lane))
+        a.postponed_script_runs = [(None, scheduler.SWEEP)]
+
+        # the daemon becomes ready anyway, and runs the postponed scripts
+        d = a._complete_startup()
+        d.addErrback(a._startup_failed)
+        self.assertTrue(d.called)
+        self.assertEqual(d.result, None)
+        self.assertTrue(a.get_startup_progress()['ready'])
+        self.assertEqual(runs, [(None, scheduler.SWEEP)])
+        self.assertEqual(a.postponed_script_runs, [])
+
+    def test_journal(self):
+        path = os.path.join(self.td, "journal")
+        j = journal.Journal(path)
+        self.assertFalse(j.load())
+        self.assertFalse(j.agrees_with({}, ()))
+        j.reset({}, [], {}, (("AAAA", True),))
+        self.assertTrue(j.agrees_with({}, (("AAAA", True),)))
+        self.assertFalse(j.agrees_with({}, (("AAAA", False),)))
+
+        j.record("accomplished", "c/first", date="2012-06-01",
+                 files=[[1, 2.5, 3], None])
+        j.record("unlocked", "c/second")
+        j.record("extra-information-changed", item="info")
+        self.assertEqual(j.seq, 3)
+
+        j = journal.Journal(path)
+        self.assertTrue(j.load())
+        self.assertEqual(j.seq, 3)
+        self.assertEqual(j.accomplished, {"c/first": "2012-06-01"})
+        self.assertEqual(j.unlocked, set(["c/second"]))
+        self.assertTrue(j.agrees_with({"c/first": [[1, 2.5, 3], None]},
+                                      (("AAAA", True),)))
+        self.assertFalse(j.agrees_with({"c/first": [[1, 2.5, 4], None]},
+                                       (("AAAA", True),)))
+
+        # a record cut short by a crash is ignored
+        f = open(path, "a")
+        f.write('{"event": "unaccomplished", "accom": "c/fi')
+        f.close()
+        j = journal.Journal(path)
+        j.load()
+        self.assertEqual(j.accomplished, {"c/first": "2012-06-01"})
+        j.record("unaccomplished", "c/first")
+        j = journal.Journal(path)
+        j.load()
+        self.assertEqual(j.accomplished, {})
+        self.assertEqual(j.seq, 4)
+
+        # compaction
+        j = journal.Journal(path)
+        j.load()
+        self.assertEqual(j.records, 4)
+        for i in range(journal.COMPACT_EVERY - 4):
+            j.record("locked" if i % 2 else "unlocked", "c/second")
+        self.assertEqual(j.records, 0)
+        self.assertEqual(os.path.getsize(path), 0)
+        j.record("locked", "c/second")
+        j = journal.Journal(path)
+        j.load()
+        self.assertEqual(j.seq, journal.COMPACT_EVERY + 1)
+        self.assertEqual(j.unlocked, set())
+
+    def test_restore_statuses_from_journal(self):
+        self.util_remove_all_accoms(self.accom_dir)
+        self.util_copy_accom(self.accom_dir, "first")
+        self.util_copy_accom(self.accom_dir, "third")
+        first = "%s/first" % self.ACCOM_SET
+        third = "%s/third" % self.ACCOM_SET
+        a = api.Accomplishments(None, None, True)
+        self.assertTrue(a.accomplish(third))
+        self.assertEqual(a.journal.accomplished.keys(), [third])
+
+        # The journal matches the trophies, so they are not checked again
+        check = api.Accomplishments._find_trophy_signature
+        def fail(*args):
+            self.fail("trophies should not be checked")
+        api.Accomplishments._find_trophy_signature = fail
+        try:
+            a = api.Accomplishments(None, None, True)
+        finally:
+            api.Accomplishments._find_trophy_signature = check
+        self.assertEqual(a.list_trophies(), [third])
+        self.assertEqual(sorted(a.journal.unlocked), [first, third])
+
+        # A trophy that appeared behind the daemon's back
+        trophydir = os.path.join(self.trophy_dir, self.ACCOM_SET)
+        self.util_write_file(trophydir, "first.trophy", "[trophy]\n")
+        a = api.Accomplishments(None, None, True)
+        self.assertEqual(a.list_trophies(), [first, third])
+        self.assertEqual(sorted(a.journal.accomplished), [first, third])
+
     def test_write_extra_information_file(self):
         a = api.Accomplishments(None, None, True)
 
@@ -796,7 +1977,7 @@ extrainfo_seen = 1""" % (self.td, self.td))
 
     @unittest.skipUnless(accoms_public_key_present(),
         "Ubuntu Accomplishments public key is not available, skipping test")
-    def test_get_is_asc_correct(self):
+    def test_verify_trophy_signatures(self):
         a = api.Accomplishments(None, None, True)
 
         testdir = os.path.dirname(__file__)
@@ -806,7 +1987,7 @@ extrainfo_seen = 1""" % (self.td, self.td))
         t_src = os.path.join(testdir, "trophies", "good.trophy")
         t_dest = os.path.join(self.td, "good.trophy")
         shutil.copyfile(t_src, t_dest)
-        self.assertTrue(a._get_is_asc_correct(a_dest))
+        good = a_dest
 
         testdir = os.path.dirname(__file__)
         a_src = os.path.join(testdir, "trophies", "bad.trophy.asc")
@@ -815,10 +1996,14 @@ extrainfo_seen = 1""" % (self.td, self.td))
         t_src = os.path.join(testdir, "trophies", "bad.trophy")
         t_dest = os.path.join(self.td, "bad.trophy")
         shutil.copyfile(t_src, t_dest)
-        self.assertFalse(a._get_is_asc_correct(a_dest))
-
-        # bad path should return false, not an exception
-        self.assertFalse(a._get_is_asc_correct("abcdefg"))
+        bad = a_dest
+
+        # bad path should give false, not an exception
+        results = []
+        a.verifier.verify_many([good, bad, "abcdefg"]).addCallback(
+            results.append)
+        self.assertEqual(results, [{good: True, bad: False,
+                                    "abcdefg": False}])
 
     def test_create_extra_information_file(self):
         a = api.Accomplishments(None, None, True)